@@ -0,0 +1,15 @@
+# Gunicorn settings loaded automatically from the working directory
+from prometheus_client import multiprocess
+import os, shutil
+
+# Start every run with an empty metrics directory so counters of previous runs are not summed
+def on_starting(server):
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+# Stop summing the live gauges of a worker once it exits
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
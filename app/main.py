@@ -7,12 +7,20 @@ from flask import (
     make_response,
     jsonify,
     redirect,
-    url_for
+    url_for,
+    Response,
+    send_file,
+    g,
+    has_request_context
 )
 from celery.exceptions import TimeoutError
-import os, json, time, random
+import os, re, json, time, random, hashlib, shutil, uuid, secrets
 from celery import Celery
-import jwt
+from celery.signals import before_task_publish
+from kombu.serialization import register
+from kombu.utils.json import dumps, loads
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+import jwt, zlib
 
 # Create a Flask application instance with session and JWT configuration for secure access
 app = Flask(__name__)
@@ -27,6 +35,28 @@ app.config['JWT_SECRET_KEY'] = '7c975dfb9c4e71a67b76b91c2a17f0b678830ecac162f70b
 app.config['CELERY_BROKER_URL'] = os.environ.get('CELERY_BROKER_URL', 'redis://redis:6379/0')
 app.config['CELERY_RESULT_BACKEND'] = os.environ.get('CELERY_RESULT_BACKEND', 'redis://redis:6379/0')
 app.config['CELERY_RESULT_EXPIRES'] = 60
+app.config['CELERY_RESULT_SERIALIZER'] = 'zjson'
+app.config['CELERY_ACCEPT_CONTENT'] = ['json', 'zjson']
+
+# Extract CV texts on a database worker so AI workers need no shared files volume, the texts are shipped
+# inside the summarization task, or stored before the fair-share scheduler queues the CVs
+app.config['SUMMARIZE_SHIP_TEXT'] = os.environ.get('SUMMARIZE_SHIP_TEXT', 'false').lower() == 'true'
+
+# Summarize CVs through the fair-share scheduler, one CV per task, instead of one task per job
+app.config['SUMMARIZE_FAIR_SHARE'] = os.environ.get('SUMMARIZE_FAIR_SHARE', 'true').lower() == 'true'
+
+# Serializer of task results, JSON compressed with zlib when large (same as tasks/results.py)
+def zjson_dumps(obj):
+    data = dumps(obj).encode("utf-8")
+    return zlib.compress(data) if len(data) > 1024 else data
+
+def zjson_loads(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    # zlib streams start with "x", which no JSON document starts with
+    return loads(zlib.decompress(data) if data[:1] == b"x" else data)
+
+register("zjson", zjson_dumps, zjson_loads, content_type="application/x-zjson", content_encoding="binary")
 
 # Create a Celery instance
 celery = Celery(
@@ -36,10 +66,80 @@ celery = Celery(
 )
 celery.conf.update(app.config)
 
+# Prometheus metrics, shared between gunicorn workers through PROMETHEUS_MULTIPROC_DIR
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Flask request latency", ["method", "endpoint", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+TASKS_SENT = Counter("celery_tasks_sent", "Celery tasks sent by the web service", ["task"])
+
+# Spans of the web service are appended to the same JSON lines file as the workers', sampled
+# and rotated the same way (see tasks/tracing.py)
+TRACE_FILE = os.environ.get("TRACE_FILE")
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 1))
+TRACE_FILE_MAX_BYTES = int(os.environ.get("TRACE_FILE_MAX_BYTES", 50 * 1024 * 1024))
+
+# Function to write a request span in the tasks/tracing.py format
+def export_span(trace, end, status_code):
+    if not TRACE_FILE:
+        return
+    if TRACE_SAMPLE_RATE < 1 and int(trace["trace_id"][:8], 16) >= TRACE_SAMPLE_RATE * 0x100000000:
+        return
+    try:
+        if TRACE_FILE_MAX_BYTES and os.path.exists(TRACE_FILE) and os.path.getsize(TRACE_FILE) >= TRACE_FILE_MAX_BYTES:
+            os.replace(TRACE_FILE, TRACE_FILE + ".1")
+        os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+        with open(TRACE_FILE, "a", encoding="utf-8") as file:
+            file.write(json.dumps({
+                "trace_id": trace["trace_id"],
+                "span_id": trace["span_id"],
+                "parent_id": trace["parent_id"],
+                "name": f"{request.method} {request.endpoint or 'unmatched'}",
+                "service": "cv-scan-web",
+                "start": trace["start"],
+                "end": end,
+                "duration_ms": round((end - trace["start"]) * 1000, 3),
+                "attributes": trace["attributes"],
+                "error": f"HTTP {status_code}" if status_code >= 500 else None
+            }) + "\n")
+    except Exception as error:
+        print(f"Failed to export span: {error}")
+
+# Add the publish time and the trace context to every task message so workers can measure
+# the queue wait (same as tasks/metrics.py) and continue the request trace (tasks/tracing.py)
+@before_task_publish.connect
+def add_sent_at_header(sender=None, headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault("sent_at", time.time())
+        trace = g.get("trace") if has_request_context() else None
+        if trace:
+            headers.setdefault("traceparent", f"00-{trace['trace_id']}-{trace['span_id']}-01")
+    TASKS_SENT.labels(sender or "unknown").inc()
+
+# Maximum number of records returned per page by paginated endpoints
+MAX_PAGE_SIZE = 200
+
+# Staging directory and allowed identifiers for chunked uploads
+UPLOAD_DIR = os.path.join("files", "uploads")
+UPLOAD_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Supported export formats with their file extension and MIME type
+EXPORT_FORMATS = {
+    "csv": (".csv", "text/csv"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "arrow": (".arrow", "application/vnd.apache.arrow.file"),
+    "xlsx": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
 """
     Celery Workers:
     1. queue1 - worker
     2. queue2 - ai_worker
+    3. queue3 - extract_worker
+    4. queue4 - worker, bulk lane (exports, deletions)
+    5. queue5 - worker, I/O lane (password reset emails, blob storage)
 
     Routes and Functions:
     1. generate_access_token
@@ -90,10 +190,60 @@ celery.conf.update(app.config)
     46. exportCSV
     47. getContacts
     48. getContactsTask
+    49. uploadStatus
+    50. finalizeUpload
+    51. downloadFile
+    52. getLLMUsage
+    53. metrics
 """
 
 # Define routes and views
 
+# Start timing every request, continuing the caller's trace when it sends a traceparent header
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    parts = request.headers.get("traceparent", "").split("-")
+    incoming = len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16
+    g.trace = {
+        "trace_id": parts[1] if incoming else secrets.token_hex(16),
+        "span_id": secrets.token_hex(8),
+        "parent_id": parts[2] if incoming else None,
+        "start": time.time(),
+        "attributes": {"path": request.path}
+    }
+    # Lets `python tracing.py --job <job id>` find the request that submitted a job
+    if request.form.get("job_id"):
+        g.trace["attributes"]["job_id"] = request.form.get("job_id")
+
+# Record the latency of every request, labelled by route rather than URL to bound the label values
+@app.after_request
+def observe_request_latency(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        REQUEST_LATENCY.labels(request.method, request.endpoint or "unmatched", response.status_code).observe(time.perf_counter() - start)
+    trace = g.pop("trace", None)
+    if trace is not None:
+        trace["attributes"]["status"] = response.status_code
+        export_span(trace, time.time(), response.status_code)
+        response.headers["X-Trace-Id"] = trace["trace_id"]
+    return response
+
+# Prometheus metrics of the web service
+@app.route("/metrics")
+def metrics():
+    """
+    Expose the web service metrics in the Prometheus text format.
+
+    Returns:
+        Response: The metrics of every gunicorn worker.
+    """
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
 # Helper functions for user authentication and authorization
 
 def generate_access_token(user_id):
@@ -139,6 +289,85 @@ def logout_user():
     """Log out the user by removing the user ID from the session."""
     session.pop('user_id', None)
 
+def stream_file(filepath, chunk_size=65536, remove=False):
+    """
+    Yield the contents of a file in fixed-size chunks.
+
+    Parameters:
+    - filepath (str): Path of the file to stream.
+    - chunk_size (int): Number of bytes read per chunk.
+    - remove (bool): Whether to delete the file once it has been streamed.
+    """
+    try:
+        with open(filepath, "rb") as file:
+            while True:
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        if remove and os.path.exists(filepath):
+            os.remove(filepath)
+
+def get_page_args(source):
+    """
+    Read keyset pagination and field projection parameters from a request.
+
+    Parameters:
+    - source: The request args or form.
+
+    Returns:
+    - tuple: (limit, cursor, fields), each None when not provided.
+    """
+    limit = source.get("limit", type=int)
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+    cursor = source.get("cursor", type=int)
+    fields = [field.strip() for field in source.get("fields", "").split(",") if field.strip()] or None
+    return limit, cursor, fields
+
+def read_upload_metadata(upload_dir):
+    """
+    Read the metadata of a chunked upload.
+
+    Parameters:
+    - upload_dir (str): The staging directory of the upload.
+
+    Returns:
+    - dict or None: The upload metadata, None if the upload does not exist.
+    """
+    try:
+        with open(os.path.join(upload_dir, "metadata.json")) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def get_received_ranges(upload_dir):
+    """
+    List the byte ranges received for a chunked upload, merged and sorted.
+
+    Parameters:
+    - upload_dir (str): The staging directory of the upload.
+
+    Returns:
+    - list: [start, end) pairs of received bytes.
+    """
+    chunks = []
+    for name in os.listdir(os.path.join(upload_dir, "chunks")):
+        offset, length = map(int, name.split("-"))
+        chunks.append((offset, offset + length))
+    ranges = []
+    for start, end in sorted(chunks):
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([start, end])
+    return ranges
+
+def count_received_bytes(upload_dir):
+    """Return the number of distinct bytes received for a chunked upload."""
+    return sum(end - start for start, end in get_received_ranges(upload_dir))
+
 # Decorators for view function authorization and roles
 
 def login_required(view_function):
@@ -278,7 +507,7 @@ def forgotPassword():
         reset_link = url_for("reset_password", _external=True)
 
         # Send a Celery task to execute forgot password
-        task = celery.send_task("tasks.forgot_password_user", args=[email, reset_link], queue="queue1")
+        task = celery.send_task("tasks.forgot_password_user", args=[email, reset_link], queue="queue5")
 
         return make_response(jsonify({'task_id': task.id}), 200)
 
@@ -769,7 +998,7 @@ def deleteUser():
 
     user_id = request.form.get("user_id")
 
-    task = celery.send_task("tasks.delete_user", args=[user_id,], queue="queue1")
+    task = celery.send_task("tasks.delete_user", args=[user_id,], queue="queue4")
 
     return make_response(jsonify({"task_id": task.id}), 200)
 
@@ -955,7 +1184,9 @@ def generateQuestions():
     Endpoint for generating questions using GPT.
 
     Extracts user input from the request form, sends a Celery task to formulate questions,
-    and returns a task ID for tracking the status.
+    and returns a task ID for tracking the status. The task first looks up questions
+    generated earlier for an identical job description, unless the form sets refresh
+    to "true".
 
     Returns:
         JSON response containing the task ID.
@@ -974,16 +1205,24 @@ def generateQuestions():
     job_requirements = request.form["job_requirements"]
     manual_questions = request.form["manual_questions"]
     job_title = request.form["job_title"]
+    refresh = request.form.get("refresh", "false").lower() == "true"
 
-    # Send a Celery task to formulate questions using GPT
-    async_result = celery.send_task("tasks.formulate_questions", kwargs={
+    job_description = {
         "user_id": user_id,
         "job_title": job_title,
         "company_background": company_background,
         "job_duties": job_duties,
         "job_requirements": job_requirements,
         "manualquestions": manual_questions
-    }, queue="queue2")
+    }
+
+    if refresh:
+        # Send a Celery task to formulate questions using GPT
+        async_result = celery.send_task("tasks.formulate_questions", kwargs=job_description, queue="queue2")
+    else:
+        # Look the job description up on the interactive lane, a miss is sent on to the
+        # AI workers under the same task ID
+        async_result = celery.send_task("tasks.cached_questions", kwargs=job_description, queue="queue1")
 
     return make_response(jsonify({"task_id": async_result.id}), 200)
 
@@ -1074,6 +1313,11 @@ def getJobs():
     Retrieves the user's ID from the token, sends a Celery task to get jobs,
     and returns the list of jobs as a JSON response.
 
+    Optional query parameters:
+        limit: Page size; when given the response is {"items": [...], "next_cursor": ...}.
+        cursor: The next_cursor value of the previous page.
+        fields: Comma-separated job fields to return.
+
     Returns:
         JSON response containing the user's jobs.
     """
@@ -1085,8 +1329,15 @@ def getJobs():
     # Extract user_id from the validated token
     user_id = decode_and_validate_token(token).get('user_id')
 
+    # Extract optional pagination and projection parameters
+    limit, cursor, fields = get_page_args(request.args)
+
     # Send a Celery task to get user's jobs
-    async_result = celery.send_task("tasks.get_jobs", args=[user_id,], queue="queue1")
+    async_result = celery.send_task("tasks.get_jobs", args=[user_id,], kwargs={
+        "limit": limit,
+        "cursor": cursor,
+        "fields": fields
+    }, queue="queue1")
     
     # Retrieve the result of the task
     jobs = async_result.get()
@@ -1110,7 +1361,7 @@ def deleteJob():
     job_id = request.form.get("job_id")
 
     # Send a Celery task to delete the job
-    task = celery.send_task("tasks.delete_job", args=[job_id,], queue="queue1")
+    task = celery.send_task("tasks.delete_job", args=[job_id,], queue="queue4")
     
     # Wait for the task to complete
     task.get()
@@ -1118,18 +1369,29 @@ def deleteJob():
     # Return the task ID as a JSON response
     return make_response(jsonify({"task_id": task.id}), 200)
 
-# Upload a file
+# Upload a file chunk
 @app.route("/upload", methods=["POST"])
 def upload():
     """
-    Endpoint for uploading a file.
+    Endpoint for uploading a file chunk.
 
-    Retrieves user information and file details from the request,
-    sends a Celery task to save the file in the database, and writes
-    the file chunk to the file on the server.
+    Chunks are addressed by their byte offset and written in place into a staging
+    file, so a retried or duplicated chunk overwrites the same bytes instead of
+    being appended again. Each received chunk is recorded so an interrupted
+    upload can be resumed with /uploadStatus. Nothing is registered in the
+    database until /finalizeUpload is called.
+
+    Form fields:
+        upload_id: Client-chosen identifier of the upload ([A-Za-z0-9_-], max 64 chars).
+        file-name: Name of the uploaded file.
+        job_id: ID of the job the file belongs to.
+        offset: Byte offset of the chunk in the file.
+        total-size: Size of the whole file in bytes.
+        chunk-checksum: Optional SHA-256 hex digest of the chunk.
+        chunk: The chunk data.
 
     Returns:
-        JSON response indicating success.
+        JSON response containing the number of bytes received so far.
     """
     # Retrieve and validate user token from request headers
     token = request.headers.get('Authorization')
@@ -1139,20 +1401,122 @@ def upload():
     # Extract user_id from the validated token
     user_id = decode_and_validate_token(token).get('user_id')
 
-    # Retrieve file details from the request
-    filename = request.form.get('file-name')
+    # Retrieve file and chunk details from the request
+    upload_id = request.form.get("upload_id", "")
+    filename = os.path.basename(request.form.get('file-name', ""))
     job_id = request.form.get('job_id')
+    offset = request.form.get("offset", type=int)
+    total_size = request.form.get("total-size", type=int)
+    chunk_checksum = request.form.get("chunk-checksum")
     chunk = request.files.get("chunk")
+    data = chunk.read() if chunk else b""
+
+    if not UPLOAD_ID_PATTERN.match(upload_id) or not filename:
+        return jsonify({'error': 'Invalid upload ID or file name'}), 400
+    if offset is None or total_size is None or offset < 0 or offset + len(data) > total_size:
+        return jsonify({'error': 'Invalid chunk offset or total size'}), 400
+    if chunk_checksum and hashlib.sha256(data).hexdigest() != chunk_checksum.lower():
+        return jsonify({'error': 'Chunk checksum mismatch'}), 400
+
+    # Register the upload on its first chunk and reject chunks of a different upload
+    upload_dir = os.path.join(UPLOAD_DIR, upload_id)
+    os.makedirs(os.path.join(upload_dir, "chunks"), exist_ok=True)
+    metadata = {"filename": filename, "job_id": job_id, "user_id": user_id, "total_size": total_size}
+    existing_metadata = read_upload_metadata(upload_dir)
+    if existing_metadata is None:
+        with open(os.path.join(upload_dir, "metadata.json"), "w") as file:
+            json.dump(metadata, file)
+    elif existing_metadata != metadata:
+        return jsonify({'error': 'Upload ID already used for another file'}), 409
+
+    # Write the chunk at its offset, re-sending a chunk rewrites the same bytes
+    fd = os.open(os.path.join(upload_dir, "data"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        os.pwrite(fd, data, offset)
+    finally:
+        os.close(fd)
+    open(os.path.join(upload_dir, "chunks", f"{offset}-{len(data)}"), "w").close()
 
-    # Send a Celery task to save the file in the database
-    async_result = celery.send_task("tasks.db_save_file", args=[filename, job_id, user_id], queue="queue1")
+    # Return the number of bytes received so far
+    return make_response(jsonify({"received": count_received_bytes(upload_dir)}), 200)
 
-    # Write the file chunk to the file
-    with open(os.path.join("files", filename), "ab") as file:
-        file.write(chunk.read())
+# Get the status of a file upload
+@app.route("/uploadStatus", methods=["POST"])
+def uploadStatus():
+    """
+    Endpoint for resuming a file upload.
 
-    # Return a success response
-    return make_response(jsonify({}), 204)
+    Returns:
+        JSON response containing the total size and the byte ranges already received.
+    """
+    # Retrieve and validate user token from request headers
+    token = request.headers.get('Authorization')
+    if not token or not is_token_valid(token):
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    user_id = decode_and_validate_token(token).get('user_id')
+
+    upload_id = request.form.get("upload_id", "")
+    upload_dir = os.path.join(UPLOAD_DIR, upload_id)
+    metadata = read_upload_metadata(upload_dir) if UPLOAD_ID_PATTERN.match(upload_id) else None
+    if metadata is None or metadata["user_id"] != user_id:
+        return jsonify({'error': 'Unknown upload'}), 404
+
+    return make_response(jsonify({
+        "total_size": metadata["total_size"],
+        "received_ranges": get_received_ranges(upload_dir),
+        "received": count_received_bytes(upload_dir)
+    }), 200)
+
+# Finalize a file upload
+@app.route("/finalizeUpload", methods=["POST"])
+def finalizeUpload():
+    """
+    Endpoint for completing a file upload.
+
+    Checks that every byte has been received and that the whole-file SHA-256
+    matches the optional "checksum" form field and sends a single Celery task
+    to register it in the database and move it into the blob store under its
+    digest.
+
+    Returns:
+        JSON response containing the file name and its checksum.
+    """
+    # Retrieve and validate user token from request headers
+    token = request.headers.get('Authorization')
+    if not token or not is_token_valid(token):
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    user_id = decode_and_validate_token(token).get('user_id')
+
+    upload_id = request.form.get("upload_id", "")
+    checksum = request.form.get("checksum")
+    upload_dir = os.path.join(UPLOAD_DIR, upload_id)
+    metadata = read_upload_metadata(upload_dir) if UPLOAD_ID_PATTERN.match(upload_id) else None
+    if metadata is None or metadata["user_id"] != user_id:
+        return jsonify({'error': 'Unknown upload'}), 404
+
+    # Make sure the whole file has been received
+    received = count_received_bytes(upload_dir)
+    if received != metadata["total_size"]:
+        return jsonify({'error': 'Upload is incomplete', 'received': received, 'total_size': metadata["total_size"]}), 409
+
+    # Verify the whole-file checksum
+    datapath = os.path.join(upload_dir, "data")
+    open(datapath, "ab").close()
+    digest = hashlib.sha256()
+    for block in stream_file(datapath):
+        digest.update(block)
+    if checksum and digest.hexdigest() != checksum.lower():
+        return jsonify({'error': 'File checksum mismatch'}), 422
+
+    # Register the file once, the worker references its blob before moving the staged
+    # file into the content-addressed blob store, identical CVs are stored once
+    celery.send_task("tasks.db_save_file", args=[metadata["filename"], metadata["job_id"], user_id], kwargs={
+        "sha256": digest.hexdigest(),
+        "size": metadata["total_size"],
+        "upload_id": upload_id
+    }, queue="queue5")
+
+    return make_response(jsonify({"filename": metadata["filename"], "checksum": digest.hexdigest()}), 200)
 
 # Cancel file upload
 @app.route("/cancelUpload", methods=["POST"])
@@ -1161,7 +1525,8 @@ def cancelUpload():
     Endpoint for canceling file upload.
 
     Retrieves user information and file details from the request,
-    sends a Celery task to delete the file from the database.
+    removes the staged chunks and sends a Celery task to delete the file
+    from the database.
 
     Returns:
         JSON response indicating success.
@@ -1175,6 +1540,13 @@ def cancelUpload():
     user_id = decode_and_validate_token(token).get('user_id')
 
     try:
+        # Remove the staged chunks of an unfinished upload
+        upload_id = request.form.get("upload_id", "")
+        if UPLOAD_ID_PATTERN.match(upload_id):
+            metadata = read_upload_metadata(os.path.join(UPLOAD_DIR, upload_id))
+            if metadata and metadata["user_id"] == user_id:
+                shutil.rmtree(os.path.join(UPLOAD_DIR, upload_id), ignore_errors=True)
+
         # Attempt to remove the file on cancel request
         filename = request.form.get("file-name")
         job_id = request.form.get("job_id")
@@ -1207,9 +1579,32 @@ def submitToSummarize():
 
     # Extract job_id from the request form
     job_id = request.form.get("job_id")
+
+    # Optionally only summarize the N CVs most relevant to the job
+    top_n = request.form.get("top_n", type=int)
+    if top_n is not None and top_n < 1:
+        return jsonify({'error': 'top_n must be a positive number'}), 400
     
+    if app.config['SUMMARIZE_FAIR_SHARE']:
+        # Queue the job's CVs in the scheduler, which sets the pre-assigned task ID
+        # to SUCCESS once the last CV is summarized. Sent to the bulk lane, it may
+        # extract the CVs of the whole job first
+        task_id = str(uuid.uuid4())
+        celery.send_task("tasks.schedule_summarization", args=[job_id, user_id, task_id], kwargs={
+            "top_n": top_n,
+            "ship_text": app.config['SUMMARIZE_SHIP_TEXT']
+        }, queue="queue4")
+        return make_response(jsonify({"task_id": task_id}), 200)
+
+    if app.config['SUMMARIZE_SHIP_TEXT']:
+        # Let a database worker ship the CV texts to the AI workers, the summarization
+        # task gets a pre-assigned ID so its progress can be tracked as usual
+        task_id = str(uuid.uuid4())
+        celery.send_task("tasks.dispatch_summarization", args=[job_id, user_id, task_id], kwargs={"top_n": top_n}, queue="queue4")
+        return make_response(jsonify({"task_id": task_id}), 200)
+
     # Send a Celery task to summarize CVs using ChatGPT
-    async_result = celery.send_task("tasks.summarize_cvs_using_chat_gpt", args=[job_id, user_id], queue="queue2")
+    async_result = celery.send_task("tasks.summarize_cvs_using_chat_gpt", args=[job_id, user_id], kwargs={"top_n": top_n}, queue="queue2")
 
     return make_response(jsonify({"task_id": async_result.id}), 200)
 
@@ -1231,6 +1626,73 @@ def submitToSummarizeTask():
 
     return make_response(jsonify({"status": status}), 200)
 
+# Route to replace the questions of a job
+@app.route("/updateQuestions", methods=["POST"])
+def updateQuestions():
+
+    """
+    Replace the questions of a job. Existing summaries are not changed, call
+    /resummarize to ask them the new or edited questions.
+
+    Form fields:
+        job_id: The job.
+        questions: JSON list of {"id": ..., "value": ...}, without an id for new questions.
+                   Questions of the job left out are deleted.
+
+    Returns:
+        JSON: {"question_ids": [...]} in question order.
+    """
+
+    # Retrieve and validate user token
+    token = request.headers.get('Authorization')
+    if not token or not is_token_valid(token):
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    user_id = decode_and_validate_token(token).get('user_id')
+
+    job_id = request.form.get("job_id", type=int)
+    try:
+        questions = json.loads(request.form.get("questions") or "[]")
+        questions = [{"id": question.get("id"), "value": str(question.get("value") or "")} for question in questions]
+    except (ValueError, TypeError, AttributeError):
+        return jsonify({'error': 'questions must be a JSON list of {"id", "value"} objects'}), 400
+    if job_id is None:
+        return jsonify({'error': 'job_id is required'}), 400
+
+    # Send a Celery task to store the questions
+    async_result = celery.send_task("tasks.update_questions", args=[job_id, user_id, questions], queue="queue1")
+    question_ids = async_result.get()
+    if question_ids is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return make_response(jsonify({"question_ids": question_ids}), 200)
+
+# Route to ask the summarized CVs of a job the questions they do not answer yet
+@app.route("/resummarize", methods=["POST"])
+def resummarize():
+
+    """
+    Ask every summarized CV of a job only the questions added or edited since
+    it was summarized, and merge the answers into its summary.
+
+    Returns:
+        JSON: The task ID, its status is polled with /submitToSummarizeTask.
+    """
+
+    # Retrieve and validate user token
+    token = request.headers.get('Authorization')
+    if not token or not is_token_valid(token):
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    user_id = decode_and_validate_token(token).get('user_id')
+
+    job_id = request.form.get("job_id")
+
+    # Queue the summaries missing answers in the scheduler, one CV at a time, which sets
+    # the pre-assigned task ID to SUCCESS once the last one is merged
+    task_id = str(uuid.uuid4())
+    celery.send_task("tasks.schedule_resummarization", args=[job_id, user_id, task_id], queue="queue4")
+
+    return make_response(jsonify({"task_id": task_id}), 200)
+
 # Route to get summaries for a job
 @app.route("/getSummaries", methods=["POST"])
 def getSummaries():
@@ -1238,6 +1700,14 @@ def getSummaries():
     """
     Get summaries for a specified job.
 
+    Optional form fields:
+        limit: Page size; when given the response is {"items": [...], "next_cursor": ...}.
+        cursor: The next_cursor value of the previous page.
+        fields: Comma-separated strings, only summary items whose title contains one are returned.
+        score_question_id: Sort by the score of this 1-10 rating question, each summary gets a "score".
+        order: "desc" (default) or "asc" when sorting by score.
+        min_score, max_score: Only return summaries scored within this range.
+
     Returns:
         JSON: Summaries for the specified job.
     """
@@ -1251,12 +1721,120 @@ def getSummaries():
     # Extract job_id from the request form
     job_id = request.form.get("job_id")
 
+    # Extract optional pagination and projection parameters
+    limit, cursor, fields = get_page_args(request.form)
+
+    # Extract optional score sorting and filtering parameters
+    score_question_id = request.form.get("score_question_id", type=int)
+    min_score = request.form.get("min_score", type=float)
+    max_score = request.form.get("max_score", type=float)
+    order = request.form.get("order", "desc")
+    if order not in ("asc", "desc"):
+        return jsonify({'error': 'order must be asc or desc'}), 400
+    if score_question_id is None and (min_score is not None or max_score is not None):
+        return jsonify({'error': 'min_score and max_score require score_question_id'}), 400
+
     # Send a Celery task to get summaries for the specified job
-    async_result = celery.send_task("tasks.get_summaries", args=[job_id, user_id], queue="queue1")
+    async_result = celery.send_task("tasks.get_summaries", args=[job_id, user_id], kwargs={
+        "limit": limit,
+        "cursor": cursor,
+        "fields": fields,
+        "score_question_id": score_question_id,
+        "min_score": min_score,
+        "max_score": max_score,
+        "order": order
+    }, queue="queue1")
     summaries = async_result.get()
 
     return make_response(jsonify(summaries), 200)
 
+# Route to rank the candidates of a job by their weighted rating answers
+@app.route("/rankCandidates", methods=["POST"])
+def rankCandidates():
+
+    """
+    Rank the candidates of a job by the weighted mean of their 1-10 ratings.
+
+    Form fields:
+        job_id: The job.
+        weights: JSON object mapping rating question IDs to weights, e.g. {"12": 2, "15": 1}.
+                 Questions left out weigh 1, 0 ignores a question.
+        top_k: Only return the K best candidates.
+
+    Returns:
+        JSON: {"questions": [...], "count": ..., "candidates": [{summary_id, score, percentile, scores}]}.
+    """
+
+    # Retrieve and validate user token
+    token = request.headers.get('Authorization')
+    if not token or not is_token_valid(token):
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    user_id = decode_and_validate_token(token).get('user_id')
+
+    job_id = request.form.get("job_id", type=int)
+    top_k = request.form.get("top_k", type=int)
+    try:
+        weights = json.loads(request.form.get("weights") or "{}")
+        weights = {int(question_id): float(weight) for question_id, weight in weights.items()}
+    except (ValueError, TypeError, AttributeError):
+        return jsonify({'error': 'weights must be a JSON object of question IDs to numbers'}), 400
+    if job_id is None or (top_k is not None and top_k < 1) or any(weight < 0 for weight in weights.values()):
+        return jsonify({'error': 'job_id is required, top_k and weights must be positive'}), 400
+
+    # Send a Celery task to rank the candidates from the worker's cached rating matrix
+    async_result = celery.send_task("tasks.rank_candidates", args=[job_id, user_id], kwargs={
+        "weights": weights,
+        "top_k": top_k
+    }, queue="queue1")
+    ranking = async_result.get()
+    if ranking is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return make_response(jsonify(ranking), 200)
+
+# Route to search the summaries and CV texts of the user's jobs
+@app.route("/search", methods=["GET"])
+def search():
+
+    """
+    Search the summary answers and CV texts of the user's jobs.
+
+    Query parameters:
+        q: The search text, e.g. kubernetes or "data engineer" -intern.
+        job_id: Only search this job.
+        kind: "summaries" or "cvs" (default: both).
+        limit: Maximum hits per kind (default: 20).
+
+    Returns:
+        JSON: {"summaries": [...], "cvs": [...]}, best hits first, each with an HTML snippet.
+    """
+
+    # Retrieve and validate user token
+    token = request.headers.get('Authorization')
+    if not token or not is_token_valid(token):
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    user_id = decode_and_validate_token(token).get('user_id')
+
+    query = request.args.get("q", "").strip()
+    job_id = request.args.get("job_id", type=int)
+    kind = request.args.get("kind")
+    if kind is not None and kind not in ("summaries", "cvs"):
+        return jsonify({'error': 'kind must be summaries or cvs'}), 400
+    kinds = [kind] if kind else ["summaries", "cvs"]
+    limit = max(1, min(request.args.get("limit", 20, type=int), MAX_PAGE_SIZE))
+    if not query:
+        return make_response(jsonify({kind: [] for kind in kinds}), 200)
+
+    # Send a Celery task to search the indexed texts
+    async_result = celery.send_task("tasks.search", args=[user_id, query], kwargs={
+        "job_id": job_id,
+        "kinds": kinds,
+        "limit": limit
+    }, queue="queue1")
+    hits = async_result.get()
+
+    return make_response(jsonify(hits), 200)
+
 # Route to get a specific summary
 @app.route("/getSummary", methods=["POST"])
 def getSummary():
@@ -1297,15 +1875,55 @@ def deleteSummary():
 
     return make_response(jsonify({"RESULT": result}), 200)
 
+# Route to download the CV of a summary
+@app.route("/downloadFile", methods=["POST"])
+def downloadFile():
+
+    """
+    Download the original CV of a summary.
+
+    The file is sent with send_file, which lets the WSGI server use sendfile
+    so the content is copied by the kernel instead of through Python.
+
+    Returns:
+        File: The uploaded CV.
+    """
+
+    # Retrieve and validate user token
+    token = request.headers.get('Authorization')
+    if not token or not is_token_valid(token):
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    user_id = decode_and_validate_token(token).get('user_id')
+
+    # Extract summary_id from the request form
+    summary_id = request.form.get("summary_id")
+
+    # Send a Celery task to locate the stored file of the summary
+    async_result = celery.send_task("tasks.get_summary_file", args=[summary_id, user_id], queue="queue1")
+    stored_file = async_result.get()
+    if not stored_file:
+        return jsonify({'error': 'File not found'}), 404
+    if stored_file.get("url"):
+        # The file lives in a remote blob backend, download it from there directly
+        return redirect(stored_file["url"])
+
+    return send_file(
+        os.path.join(app.root_path, "files", stored_file["path"]),
+        as_attachment=True,
+        download_name=stored_file["filename"]
+    )
+
 # Route to export summaries as CSV
 @app.route("/exportCSV", methods=["POST"])
 def exportCSV():
 
     """
-    Export summaries for a job as a CSV file.
+    Export summaries for a job as a CSV, Parquet, Arrow or XLSX file.
+
+    The format is selected with the optional "format" form field (default: csv).
 
     Returns:
-        CSV: Exported CSV file.
+        File: Exported file.
     """
 
     # Retrieve and validate user token
@@ -1314,17 +1932,56 @@ def exportCSV():
         return jsonify({'error': 'Invalid or expired token'}), 401
     user_id = decode_and_validate_token(token).get('user_id')
 
-    # Extract job_id from the request form
+    # Extract job_id and export format from the request form
     job_id = request.form.get("job_id")
-
-    # Send a Celery task to export summaries as CSV
-    async_result = celery.send_task("tasks.export_summaries_csv", args=[job_id, user_id], queue="queue1")
-    output = make_response(async_result.get())
-    output.headers["Content-Disposition"] = "attachment; filename=output_file.csv"
-    output.headers["Content-type"] = "text/csv"
+    export_format = request.form.get("format", "csv").lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported export format: {export_format}'}), 400
+
+    # Send a Celery task to write the summaries to a spool file
+    async_result = celery.send_task("tasks.export_summaries_csv", args=[job_id, user_id, export_format], queue="queue4")
+    spool_path = async_result.get()
+    if not spool_path:
+        return make_response(jsonify([]), 200)
+
+    # Stream the spool file to the client in chunks instead of loading it in memory
+    extension, mimetype = EXPORT_FORMATS[export_format]
+    output = Response(stream_file(os.path.join("files", spool_path), remove=True), mimetype=mimetype)
+    output.headers["Content-Disposition"] = f"attachment; filename=output_file{extension}"
     
     return output
 
+# Route to get the OpenAI usage of the current user
+@app.route("/getLLMUsage", methods=["POST"])
+def getLLMUsage():
+
+    """
+    Get the OpenAI calls, token usage, latency and estimated cost of the current user.
+
+    Optional form fields:
+        job_id: Only report the usage of this job.
+
+    Returns:
+        JSON: One row per job, calls outside a job (question generation) have a null job_id.
+    """
+
+    # Retrieve and validate user token
+    token = request.headers.get('Authorization')
+    if not token or not is_token_valid(token):
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    user_id = decode_and_validate_token(token).get('user_id')
+
+    job_id = request.form.get("job_id")
+
+    async_result = celery.send_task("tasks.get_llm_usage", kwargs={
+        "user_id": user_id,
+        "job_id": int(job_id) if job_id else None,
+        "group_by": "job"
+    }, queue="queue1")
+    usage = async_result.get()
+
+    return make_response(jsonify(usage), 200)
+
 @app.route("/getContacts")
 def getContacts():
     task = celery.send_task("tasks.get_contacts", queue="queue1")
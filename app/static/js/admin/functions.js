@@ -91,6 +91,8 @@ export function populateUsersTable(data) {
               <th class="text-center">Email</th>
               <th class="text-center">Role</th>
               <th class="text-center">Allow</th>
+              <th class="text-center">Tokens</th>
+              <th class="text-center">Cost (USD)</th>
               <th class="text-center">Actions</th>
             </tr>
           </thead>
@@ -159,6 +161,8 @@ export function populateUsersTable(data) {
     const email = createElement(`email-${user.id}`, `${user.email}`, 'text');
     const role = createElement(`role-${user.id}`, `${user.role}`, 'text');
     const apiKeyPermission = createElement(`api-key-permission-${user.id}`, `${user.gpt_api_key_permission}`, `text`);
+    const llmTokens = createElement(`llm-tokens-${user.id}`, `${(user.llm_tokens || 0).toLocaleString()}`, 'text');
+    const llmCost = createElement(`llm-cost-${user.id}`, `${(user.llm_cost || 0).toFixed(2)}`, 'text');
     const editButton = createElement(`edit-button-${user.id}`, null, "button");
     const deleteButton = createElement(`delete-button-${user.id}`, null, "button");
 
@@ -175,13 +179,15 @@ export function populateUsersTable(data) {
     const emailCell = insertCell(email);
     const roleCell = insertCell(role);
     const apiKeyPermissionCell = insertCell(apiKeyPermission);
+    const llmTokensCell = insertCell(llmTokens);
+    const llmCostCell = insertCell(llmCost);
     const actionsCell = insertCell(editButton, deleteButton);
 
     userIcon.classList.add('me-1');
     userIcon.innerHTML = `&#x1F464;`;
  
     // Add styling classes to cells
-    [userCell, emailCell, roleCell, apiKeyPermissionCell, actionsCell].forEach((cell) => { 
+    [userCell, emailCell, roleCell, apiKeyPermissionCell, llmTokensCell, llmCostCell, actionsCell].forEach((cell) => { 
       cell.style.textAlign = "center";
       cell.style.verticalAlign = "middle";
     });
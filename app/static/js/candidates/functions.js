@@ -26,6 +26,10 @@ import { uploadProgressFiles, uploadFilesButton, downloadSummariesButton, tableC
   18. showGenerateLoader
   19. closeModal
   20. showSuccess
+  21. getUploadID
+  22. sha256
+  23. getUploadStatus
+  24. finalizeUpload
 */
 
 let uploadFileCounter = 0;
@@ -94,6 +98,8 @@ export async function getSummaries(job_id) {
 
   const formData = new FormData();
   formData.append("job_id", job_id)
+  // The table only shows the candidate's english name, skip the other answers
+  formData.append("fields", "english")
   const result = await fetch("/getSummaries", {
     method: "POST",
     headers: {
@@ -595,6 +601,9 @@ async function uploadFile(file) {
     const uniqueID = Math.floor(Math.random() * 1024);
     const fileName = file.name;
 
+    // Derive a stable upload ID so a re-selected file resumes where it stopped
+    const uploadID = getUploadID(file);
+
     // Use FileReader to read file as ArrayBuffer
     const fileReader = new FileReader();
 
@@ -641,6 +650,7 @@ async function uploadFile(file) {
 
         formData.append("job_id", jobId);
         formData.append("file-name", fileName);
+        formData.append("upload_id", uploadID);
         await fetch("/cancelUpload", {
           method: "POST",
           headers: {
@@ -657,24 +667,41 @@ async function uploadFile(file) {
         resolve(true);
       });
 
-      let currentSize = 0;
       const totalSize = event.target.result.byteLength;
 
       // Define chunk size and calculate total number of chunks
       const CHUNK_SIZE = 250000;
-      const chunkCount = totalSize / CHUNK_SIZE;
+      const chunkCount = Math.max(1, Math.ceil(totalSize / CHUNK_SIZE));
+
+      // Track the upload so it can be canceled
+      uploadProgressFiles[uniqueID] = {
+        filename: fileName,
+        uploadid: uploadID,
+        abortcontrollers: {},
+      };
+
+      // Resume a previous attempt of the same file by skipping received chunks
+      const receivedRanges = await getUploadStatus(uploadID);
+      let currentSize = 0;
 
-      // Iterate through chunks and upload each chunk
-      for (let chunkId = 0; chunkId < chunkCount + 1; chunkId++) {
-        const chunk = event.target.result.slice(
-          chunkId * CHUNK_SIZE,
-          (chunkId + 1) * CHUNK_SIZE
+      // Iterate through chunks and upload each missing chunk
+      for (let chunkId = 0; chunkId < chunkCount; chunkId++) {
+        if (!uploadProgressFiles[uniqueID]) {
+          // Upload canceled, the cancel handler already resolved the promise
+          return;
+        }
+        const offset = chunkId * CHUNK_SIZE;
+        const chunk = event.target.result.slice(offset, offset + CHUNK_SIZE);
+        const received = receivedRanges.some(
+          ([start, end]) => start <= offset && offset + chunk.byteLength <= end
         );
 
         // Upload chunk and update progress
-        await uploadChunk(uniqueID, chunkId, "/upload", fileName, chunk);
-        const progressValue = Math.round((chunkId * 100) / chunkCount);
-        currentSize += currentSize >= totalSize ? 0 : chunk.byteLength;
+        if (!received) {
+          await uploadChunk(uniqueID, uploadID, chunkId, offset, totalSize, fileName, chunk);
+        }
+        currentSize += chunk.byteLength;
+        const progressValue = Math.round(((chunkId + 1) * 100) / chunkCount);
 
         // Update progress bar with current progress values
         updateProgress(
@@ -685,6 +712,9 @@ async function uploadFile(file) {
         );
       }
 
+      // Register the file once every chunk has been received
+      await finalizeUpload(uploadID, event.target.result);
+
       // Resolve the promise (upload completed)
       resolve(true);
     };
@@ -705,6 +735,7 @@ export function cancelAllUploads() {
     for (let uniqueID in uploadProgressFiles) {
       const uploadProgressFile = uploadProgressFiles[uniqueID];
       const fileName = uploadProgressFile["filename"];
+      const uploadID = uploadProgressFile["uploadid"];
       const abortController = uploadProgressFile["abortcontrollers"];
 
       // Abort ongoing chunks
@@ -722,6 +753,7 @@ export function cancelAllUploads() {
 
       formData.append("job_id", jobId);
       formData.append("file-name", fileName);
+      formData.append("upload_id", uploadID);
       formData.append("Authorization", "Bearer " + localStorage.getItem("jwt_access_token"))
       
       navigator.sendBeacon("/cancelUpload", formData);
@@ -779,22 +811,105 @@ export function createUploadProgressElement(
 }
 
 /*
-  Uploads a chunk of a file to a specified URL using FormData. The chunk is appended
-  to the form data along with additional information such as the file name and chunk length.
+  Builds an upload ID from the job, file name, size and modification time, so
+  selecting the same file again resumes its upload instead of restarting it.
 */
 /**
- * Async function to upload a chunk of a file to a specified URL.
- * Uses FormData to append the chunk and additional information such as file name and chunk length.
+ * Function to derive a stable upload ID for a file.
+ * @param {File} file - The file to be uploaded.
+ * @returns {string} An identifier made of [A-Za-z0-9_-] characters.
+ */
+function getUploadID(file) {
+  const urlParams = new URLSearchParams(new URL(location.href).search);
+  const jobId = urlParams.get('job_id');
+  let hash = 0;
+  for (const character of file.name) {
+    hash = (hash * 31 + character.charCodeAt(0)) >>> 0;
+  }
+  return `${jobId}-${hash.toString(36)}-${file.size}-${file.lastModified}`;
+}
+
+/*
+  Computes the SHA-256 hex digest of a buffer. Returns null when the Web Crypto
+  API is unavailable (non-secure contexts), the server then skips the check.
+*/
+/**
+ * Async function to compute the SHA-256 digest of a buffer.
+ * @param {ArrayBuffer} buffer - The data to hash.
+ * @returns {Promise<string|null>} The hex digest, or null if unsupported.
+ */
+async function sha256(buffer) {
+  if (!window.crypto || !window.crypto.subtle) {
+    return null;
+  }
+  const digest = await window.crypto.subtle.digest("SHA-256", buffer);
+  return Array.from(new Uint8Array(digest))
+    .map((byte) => byte.toString(16).padStart(2, "0"))
+    .join("");
+}
+
+/**
+ * Async function to get the byte ranges already received for an upload.
+ * @param {string} uploadID - The upload ID.
+ * @returns {Promise<number[][]>} The received [start, end) ranges, empty for a new upload.
+ */
+async function getUploadStatus(uploadID) {
+  const data = new FormData();
+  data.append("upload_id", uploadID);
+  const response = await fetch("/uploadStatus", {
+    method: "POST",
+    headers: {
+      'Authorization': `Bearer ${localStorage.getItem("jwt_access_token")}`,
+    },
+    body: data,
+  });
+  if (!response.ok) {
+    return [];
+  }
+  const status = await response.json();
+  return status.received_ranges;
+}
+
+/**
+ * Async function to complete an upload once every chunk has been received.
+ * @param {string} uploadID - The upload ID.
+ * @param {ArrayBuffer} buffer - The whole file, used to compute its checksum.
+ */
+async function finalizeUpload(uploadID, buffer) {
+  const data = new FormData();
+  data.append("upload_id", uploadID);
+  const checksum = await sha256(buffer);
+  if (checksum) {
+    data.append("checksum", checksum);
+  }
+  await fetch("/finalizeUpload", {
+    method: "POST",
+    headers: {
+      'Authorization': `Bearer ${localStorage.getItem("jwt_access_token")}`,
+    },
+    body: data,
+  });
+}
+
+/*
+  Uploads a chunk of a file at its byte offset. Failed chunks are retried, which
+  is safe because the server writes each chunk in place at its offset.
+*/
+/**
+ * Async function to upload a chunk of a file.
  * @param {string} uniqueID - The unique identifier for the progress element.
+ * @param {string} uploadID - The upload ID shared by every chunk of the file.
  * @param {number} chunkID - The ID of the current chunk being uploaded.
- * @param {string} url - The URL to which the chunk should be uploaded.
+ * @param {number} offset - The byte offset of the chunk in the file.
+ * @param {number} totalSize - The size of the whole file.
  * @param {string} fileName - The name of the file being uploaded.
- * @param {Blob} chunk - The chunk of the file to be uploaded.
+ * @param {ArrayBuffer} chunk - The chunk of the file to be uploaded.
  */
-async function uploadChunk(uniqueID, chunkID, url, fileName, chunk) {
+async function uploadChunk(uniqueID, uploadID, chunkID, offset, totalSize, fileName, chunk) {
   if (!uploadProgressFiles[uniqueID]) {
     uploadProgressFiles[uniqueID] = {
       filename: fileName,
+      uploadid: uploadID,
       abortcontrollers: {},
     };
   }
@@ -809,18 +924,36 @@ async function uploadChunk(uniqueID, chunkID, url, fileName, chunk) {
   const jobId = urlParams.get('job_id');
 
   data.append("job_id", jobId)
+  data.append("upload_id", uploadID);
   data.append("file-name", fileName);
-  data.append("chunk-length", chunk.length);
+  data.append("offset", offset);
+  data.append("total-size", totalSize);
+  const checksum = await sha256(chunk);
+  if (checksum) {
+    data.append("chunk-checksum", checksum);
+  }
   data.append("chunk", new Blob([chunk], { type: "application/octet-stream" }));
 
-  await fetch(url, {
-    method: "POST",
-    headers: {
-      'Authorization': `Bearer ${localStorage.getItem("jwt_access_token")}`,
-    },
-    body: data,
-    signal: uploadProgressFiles[uniqueID]["abortcontrollers"][chunkID].signal,
-  });
+  const MAX_ATTEMPTS = 3;
+  for (let attempt = 1; attempt <= MAX_ATTEMPTS; attempt++) {
+    try {
+      const response = await fetch("/upload", {
+        method: "POST",
+        headers: {
+          'Authorization': `Bearer ${localStorage.getItem("jwt_access_token")}`,
+        },
+        body: data,
+        signal: uploadProgressFiles[uniqueID]["abortcontrollers"][chunkID].signal,
+      });
+      if (response.ok) {
+        return;
+      }
+    } catch (error) {
+      if (error.name === "AbortError") {
+        return;
+      }
+    }
+  }
 }
 
 /*
@@ -975,7 +975,7 @@ export function showGenerateQuestionsModal() {
 
   addButtonClickEvent("cancel-btn", () => modalWrap.remove());
   addButtonClickEvent("generate-btn", () => {
-    generateQuestions(); // Callback function for the 'Regenerate' button
+    generateQuestions(true); // Callback function for the 'Regenerate' button, skips the questions cache
   });
   addButtonClickEvent("submit-btn", () => {
     submitQuestions(); // Callback function for the 'Confirm & Submit' button
@@ -985,7 +985,7 @@ export function showGenerateQuestionsModal() {
   });
 }
 
-export async function generateQuestions() {
+export async function generateQuestions(refresh = false) {
   
   // Prepare form inputs
   const formData = new FormData();
@@ -993,6 +993,7 @@ export async function generateQuestions() {
   for (let item in data["form"]) {
     formData.append(item, data["form"][item]);
   };
+  formData.append("refresh", refresh ? "true" : "false");
 
   showGenerateLoader();
 
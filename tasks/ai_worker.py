@@ -1,14 +1,23 @@
 # Importing necessary modules and components for the Flask app and background 
 from sqlalchemy.orm import Session
-from io import StringIO
 from celery import Celery
-from database import engine
+from celery.signals import worker_process_init
+from database import engine, prewarm_db
 from datetime import datetime, timedelta
-import os, json, csv
+import os, json
 from prompt import *
 from forgot_password import *
 from utils import *
 from crud import *
+import metrics  # Registers the task runtime and queue wait signal handlers
+import tracing  # Registers the trace propagation signal handlers
+from tracing import span
+from metrics import DUPLICATES
+import dedupe
+from prerank import rank, job_query
+from question_cache import cache_key, is_cacheable, QUESTION_CACHE_TTL, QUESTION_CACHE_SIZE
+from results import configure_results
+from scheduler import get_scheduler
 
 # Defining the base directory for file operations
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -22,6 +31,21 @@ celery = Celery(
     broker=CELERY_BROKER_URL,
     backend=CELERY_RESULT_BACKEND
 )
+configure_results(celery)
+
+# Function to get the worker process ready before its first task
+def prewarm():
+    """Open the database pool and the OpenAI HTTP client, and load the parsers used for CVs not extracted yet."""
+    prewarm_db()
+    import PyPDF2, docx2txt
+    get_http_client()
+
+@worker_process_init.connect
+def prewarm_worker_process(**kwargs):
+    try:
+        prewarm()
+    except Exception as error:
+        print(f"Failed to prewarm worker: {error}")
 
 # Task for formulating questions using ChatGPT
 @celery.task(name="tasks.formulate_questions")
@@ -29,88 +53,243 @@ def formulate_questions(user_id, job_title, company_background, job_duties, job_
     with Session(engine) as session:
         user = get_record(session, UserAccount, id=user_id)
         if user:
-            settings = { setting.name: setting.value for setting in get_all_records(session, Setting) }
-            formulate_questions_prompt = settings.get('formulate_questions_prompt')
-            if user.gpt_api_key_preference == 'default' and user.gpt_api_key_permission == 'default':
-                gpt_api_key = settings.get('gpt_api_key')
-                gpt_model = settings.get('gpt_model')
-                return formulate_question_using_chat_gpt(gpt_api_key, gpt_model, formulate_questions_prompt, job_title, company_background, job_duties, job_requirements, manualquestions)
-            else:
-                return formulate_question_using_chat_gpt(user.gpt_api_key, user.gpt_model, formulate_questions_prompt, job_title, company_background, job_duties, job_requirements, manualquestions)
+            gpt_api_key, gpt_model, formulate_questions_prompt = db_get_formulate_settings(session, user)
+            questions, status, usage = formulate_question_using_chat_gpt(gpt_api_key, gpt_model, formulate_questions_prompt, job_title, company_background, job_duties, job_requirements, manualquestions)
+            db_record_llm_call(session, usage, "formulate_questions", status, user_id=user.id)
+            if status == 'SUCCESS' and QUESTION_CACHE_TTL > 0 and is_cacheable(questions):
+                key = cache_key(gpt_model, formulate_questions_prompt, job_title, company_background, job_duties, job_requirements, manualquestions)
+                db_cache_questions(session, key, gpt_model, questions, QUESTION_CACHE_SIZE)
+            return questions, status
+
+# Function to load what every CV of a job is summarized with
+def get_summarize_context(session, job_id, user_id):
+    """
+    Load the questions, prompt and OpenAI credentials used to summarize the CVs of a job.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - job_id: The job ID.
+    - user_id: The user owning the job.
+
+    Returns:
+    - dict: user_id, form, questions, prompt, gpt_api_key and gpt_model.
+    """
+    user = get_record(session, UserAccount, id=user_id)
+    db_questions = session.query(Question).join(Form).join(UserAccount).filter(and_(Form.id == job_id, UserAccount.id == user_id)).all()
+    db_form = get_all_records(session, Form, id=job_id, user_account_id=user_id)[0]
+
+    settings = { setting.name: setting.value for setting in get_all_records(session, Setting) }
+    if user.gpt_api_key_preference == 'default' and user.gpt_api_key_permission == 'default':
+        gpt_api_key = settings.get('gpt_api_key')
+        gpt_model = settings.get('gpt_model')
+    else:
+        gpt_api_key = user.gpt_api_key
+        gpt_model = user.gpt_model
+
+    return {
+        "user_id": user.id,
+        "form": db_form,
+        "questions": [question.value for question in db_questions],
+        "prompt": db_form.summarize_cv_prompt,
+        "gpt_api_key": gpt_api_key,
+        "gpt_model": gpt_model
+    }
+
+# Function to summarize one CV and store its summary
+def summarize_file(session, db_file, text, context, job_id, summary_id=None, questions=None):
+    """
+    Summarize the text of a CV with ChatGPT and store the summary, retrying up to three times.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - db_file: The TempFile of the CV.
+    - text: The extracted text of the CV.
+    - context: The job context returned by get_summarize_context.
+    - job_id: The job ID.
+    - summary_id: An existing summary of the CV to merge the answers into.
+    - questions: Only ask these question texts (default: every question of the job).
+
+    Returns:
+    - The summary ID, or None if every attempt failed.
+    """
+    db_form = context["form"]
+    merge_into = summary_id
+    questions = questions if questions is not None else context["questions"]
+    kind = "summarize_cv" if merge_into is None else "resummarize_cv"
+
+    attempts = 1
+    while True:
+
+        with span("summarize.attempt", job_id=job_id, tempfile_id=db_file.id, attempt=attempts) as attempt:
+
+            summary_str, status, usage = summarize_using_chat_gpt(
+                text,
+                context["gpt_api_key"],
+                context["gpt_model"],
+                context["prompt"],
+                questions,
+                db_form.job_title,
+                db_form.company_background,
+                db_form.job_duties,
+                db_form.job_requirements
+            )
+
+            summary_id = None
+            if status == 'SUCCESS':
+                try:
+                    with span("summary.parse"):
+                        summary_str = summary_str.replace('```json', '').replace('```', '')
+                        summary = json.loads(summary_str)
+
+                    answers = dict(zip(questions, [str(value) for value in summary.values()]))
+                    if merge_into is not None:
+                        with span("db_merge_summary"):
+                            summary_id = db_merge_summary(session, answers, merge_into, job_id)
+                    else:
+                        with span("db_add_summary"):
+                            summary_id = db_add_summary(session, answers, job_id)
+
+                            db_file.summary_id = summary_id
+                            db_file.form_id = None
+
+                            session.commit()
+                except Exception as error:
+                    session.rollback()
+                    print("error:", error)
+                    status = 'INVALID_JSON'
+                    usage["error"] = f"{type(error).__name__}: {error}"
+
+            attempt.set(status=status)
+            db_record_llm_call(
+                session, usage, kind, status,
+                user_id=context["user_id"], job_id=job_id, temp_file_id=db_file.id,
+                summary_id=summary_id, attempt=attempts
+            )
+        if summary_id is not None:
+            return summary_id
+
+        attempts += 1
+        if attempts > 3:
+            return None
+
+# Function to get the text of a CV, extracting it if the upload was not extracted yet
+def get_file_text(session, db_file, texts=None):
+    # Use the text shipped in the payload or extracted when the upload completed,
+    # extract it now otherwise
+    if texts is not None:
+        return texts.get(str(db_file.id))
+    if db_file.text is not None:
+        return db_file.text
+    return db_extract_file(session, db_file)
+
+# Function to reuse the summary of a near-duplicate CV of the same job
+def reuse_duplicate_summary(session, db_file, text, context, job_id):
+    """
+    Look up an earlier near-duplicate of a CV and record it on the CV. With
+    DEDUPE_MODE=reuse, a duplicate of a CV already summarized for the same
+    job gets its summary instead of being sent to the model.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - db_file: The TempFile of the CV.
+    - text: The extracted text of the CV.
+    - context: The job context returned by get_summarize_context.
+    - job_id: The job ID.
+
+    Returns:
+    - The reused summary ID, or None if the CV still has to be summarized.
+    """
+    if dedupe.DEDUPE_MODE == "off":
+        return None
+    with span("dedupe", job_id=job_id, tempfile_id=db_file.id) as lookup:
+        if db_file.fingerprint is None:
+            # Texts shipped in the payload or extracted before fingerprints existed
+            db_file.fingerprint = dedupe.pack_signature(dedupe.minhash(text))
+        duplicate, score = db_find_duplicate(session, db_file, context["user_id"], job_id)
+        if duplicate is None:
+            session.commit()
+            return None
+        db_file.duplicate_of_id = duplicate.id
+        lookup.set(duplicate_of=duplicate.id, similarity=score)
+        if dedupe.DEDUPE_MODE == "reuse" and duplicate.summary is not None and duplicate.summary.form_id == int(job_id):
+            db_file.summary_id = duplicate.summary_id
+            db_file.form_id = None
+            session.commit()
+            DUPLICATES.labels("reused").inc()
+            return duplicate.summary_id
+        session.commit()
+        DUPLICATES.labels("flagged").inc()
+        return None
 
 # Task for summarizing CVs using ChatGPT
 @celery.task(name="tasks.summarize_cvs_using_chat_gpt")
-def summarize_cvs_using_chat_gpt(job_id, user_id):
+def summarize_cvs_using_chat_gpt(job_id, user_id, texts=None, top_n=None):
 
     with Session(engine) as session:
 
-        user = get_record(session, UserAccount, id=user_id)
-        db_files = get_all_records(session, TempFile, form_id=job_id)
-        db_questions = session.query(Question).join(Form).join(UserAccount).filter(and_(Form.id == job_id, UserAccount.id == user_id)).all()
-        db_form = get_all_records(session, Form, id=job_id, user_account_id=user_id)[0]
-
-        questions = [question.value for question in db_questions]
+        db_files = {db_file.id: db_file for db_file in get_all_records(session, TempFile, form_id=job_id)}
+        context = get_summarize_context(session, job_id, user_id)
 
-        summarize_cv_prompt = db_form.summarize_cv_prompt
-        settings = { setting.name: setting.value for setting in get_all_records(session, Setting) }
-        if user.gpt_api_key_preference == 'default' and user.gpt_api_key_permission == 'default':
-            gpt_api_key = settings.get('gpt_api_key')
-            gpt_model = settings.get('gpt_model')
-        else:
-            gpt_api_key = user.gpt_api_key
-            gpt_model = user.gpt_model
+        # Most relevant CVs first, CVs not extracted yet are extracted in the loop and come last
+        items = [
+            (db_file.id, texts.get(str(db_file.id)) if texts is not None else db_file.text)
+            for db_file in db_files.values()
+        ]
+        db_files = [db_files[file_id] for file_id in rank(job_query(context["form"]), items, top_n)]
 
         for db_file in db_files:
+            text = get_file_text(session, db_file, texts)
+            if text is not None and reuse_duplicate_summary(session, db_file, text, context, job_id) is None:
+                summarize_file(session, db_file, text, context, job_id)
 
-            filename: str = db_file.filename
-            
-            filepath = os.path.join(BASE_DIR, "files", filename)
-
-            if filename.endswith(".pdf") or filename.endswith(".PDF"):
-                text = extract_text_from_pdf(filepath)
-            elif filename.endswith(".docx") or filename.endswith(".DOCX"):
-                text = extract_text_from_docx(filepath)
-            else:
-                continue
-
-            n = 0
-            attempts = 1
-            while True:
-                
-                summary_str = summarize_using_chat_gpt(
-                    text,
-                    gpt_api_key,
-                    gpt_model,
-                    summarize_cv_prompt,
-                    questions,
-                    db_form.job_title, 
-                    db_form.company_background, 
-                    db_form.job_duties, 
-                    db_form.job_requirements
-                )
-
-                if n != 20 and summary_str[1] == 'SUCCESS':
-                    try:
-                        summary_str = summary_str[0].replace('```json', '').replace('```', '')
-                        summary = json.loads(summary_str)
+# Function to ask a summary the questions of its job it does not answer yet
+def resummarize_summary(session, summary, context, job_id):
+    """
+    Diff the questions of a job against a summary and only ask the new or
+    edited questions, in a prompt listing just those, merging the answers
+    into the summary. Unchanged answers are kept as they are.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - summary: The Summary record.
+    - context: The job context returned by get_summarize_context.
+    - job_id: The job ID.
+
+    Returns:
+    - str: "updated", "unchanged" or "failed".
+    """
+    db_questions = sorted(context["form"].questions, key=lambda question: question.id)
+    missing = db_missing_questions(summary, db_questions)
+    if not missing:
+        return "unchanged"
+    # Summaries reused by near-duplicate CVs are asked once, with the text of their first CV
+    texts = ((db_file, get_file_text(session, db_file)) for db_file in sorted(summary.tempfiles, key=lambda db_file: db_file.id))
+    db_file, text = next(((db_file, text) for db_file, text in texts if text is not None), (None, None))
+    if db_file is None:
+        return "failed"
+    summary_id = summarize_file(
+        session, db_file, text, context, job_id,
+        summary_id=summary.id, questions=[question.value for question in missing]
+    )
+    return "updated" if summary_id is not None else "failed"
 
-                        summary_id = db_add_summary(
-                            session,
-                            dict(zip(questions, [str(value) for value in summary.values()])),
-                            job_id
-                        )
-
-                        db_file.summary_id = summary_id
-                        db_file.form_id = None
-
-                        session.commit()
-
-                        n = len(summary)
-                        break
-                    except Exception as error:
-                        print("error:", error)
-                        continue
-                
-                attempts += 1
-                if attempts > 3:
-                    break
+# Task for summarizing a single CV dispatched by the fair-share scheduler
+@celery.task(name="tasks.summarize_cv")
+def summarize_cv(job_id, user_id, tempfile_id):
+    try:
+        with Session(engine) as session:
+            db_file = get_record(session, TempFile, id=tempfile_id)
+            # The CV may have been removed since it was scheduled
+            if db_file is None:
+                return
+            if db_file.form_id == int(job_id):
+                text = get_file_text(session, db_file)
+                if text is not None:
+                    context = get_summarize_context(session, job_id, user_id)
+                    if reuse_duplicate_summary(session, db_file, text, context, job_id) is None:
+                        summarize_file(session, db_file, text, context, job_id)
+            elif db_file.summary is not None and db_file.summary.form_id == int(job_id):
+                # A summarized CV, asked the questions of the job its summary does not answer yet
+                resummarize_summary(session, db_file.summary, get_summarize_context(session, job_id, user_id), job_id)
+    finally:
+        get_scheduler(celery).complete(job_id, tempfile_id)
@@ -0,0 +1,310 @@
+# Benchmark of summarization throughput against a local OpenAI-compatible stub server
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+import argparse, json, os, random, threading, time, uuid
+
+"""
+
+    Usage:
+
+        python bench_ai.py [--cvs 200] [--jobs 4] [--concurrency 1,4,8] [--modes job,cv]
+                           [--latency 0.5] [--token-rate 400] [--rate-limit 0.05] [--malformed 0.02]
+
+    Starts a stub of the chat completions API on localhost, points prompt.py at
+    it with OPENAI_BASE_URL and summarizes a synthetic CV corpus through the
+    AI worker code, so no API key is needed and nothing is billed.
+
+    Modes:
+
+    - job: One summarize_cvs_using_chat_gpt task per job, the CVs of a job
+           are summarized one after the other.
+    - cv:  One task per CV, the way the fair-share scheduler sends them.
+
+    Concurrency is the number of tasks run at once. Threads stand in for the
+    worker processes, the tasks spend their time waiting on the stub.
+
+    Every run seeds its own user, jobs and CVs and deletes them afterwards.
+    Set DATABASE_URI to benchmark against Postgres (default: sqlite:///bench_ai.sqlite).
+
+"""
+
+WORDS = (
+    "python sql aws docker kubernetes react java recruiter finance marketing sales analyst manager "
+    "engineer design product customer growth data cloud security mandarin cantonese english degree "
+    "university project team lead delivery budget stakeholder strategy operations hong kong award"
+).split()
+
+# Class serving a stub of the OpenAI chat completions API
+class StubOpenAI:
+
+    def __init__(self, latency=0.5, token_rate=400, rate_limit=0.0, malformed=0.0, completion_tokens=600, seed=0):
+        """
+        Parameters:
+        - latency: Seconds before the first token.
+        - token_rate: Completion tokens generated per second.
+        - rate_limit: Share of requests answered with 429 Too Many Requests.
+        - malformed: Share of answers cut in half, so they are not valid JSON.
+        - completion_tokens: Completion tokens per answer.
+        - seed: Random seed of the injected failures.
+        """
+        self.latency = latency
+        self.token_rate = token_rate
+        self.rate_limit = rate_limit
+        self.malformed = malformed
+        self.completion_tokens = completion_tokens
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.server = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.rate_limited = 0
+            self.malformed_answers = 0
+
+    def _roll(self):
+        # Decide the outcome of a request: "rate_limit", "malformed" or "ok"
+        with self.lock:
+            self.requests += 1
+            if self.random.random() < self.rate_limit:
+                self.rate_limited += 1
+                return "rate_limit"
+            if self.random.random() < self.malformed:
+                self.malformed_answers += 1
+                return "malformed"
+            return "ok"
+
+    def answer(self, body):
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in body.get("messages", [])) // 4
+        # Around 4 characters per token, spread over 20 answers
+        words_per_answer = max(1, self.completion_tokens * 4 // 20 // 8)
+        content = json.dumps({
+            f"Question {index}": " ".join(self.random.choice(WORDS) for _ in range(words_per_answer))
+            for index in range(1, 21)
+        })
+        return content, prompt_tokens
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                outcome = stub._roll()
+                if outcome == "rate_limit":
+                    self._send(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}, {"retry-after-ms": "50"})
+                    return
+                time.sleep(stub.latency + stub.completion_tokens / stub.token_rate)
+                content, prompt_tokens = stub.answer(body)
+                if outcome == "malformed":
+                    content = content[:len(content) // 2]
+                self._send(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "gpt-4o-mini"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": stub.completion_tokens,
+                        "total_tokens": prompt_tokens + stub.completion_tokens
+                    }
+                })
+
+            def _send(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+# Function to generate the text of a synthetic CV
+def synthetic_cv(rng, chars):
+    lines = [f"Candidate {rng.randint(1, 10 ** 6)}", "Experience"]
+    while sum(len(line) + 1 for line in lines) < chars:
+        lines.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 16))))
+    return "\n".join(lines)[:chars]
+
+# Function to seed a user with jobs and extracted CVs
+def seed(session, cvs, jobs, cv_chars, rng):
+    """
+    Create a user with jobs, questions and extracted CVs to summarize.
+
+    Returns:
+    - tuple: The user ID and a dict of job ID to the IDs of its CVs.
+    """
+    from models import UserAccount, Form, Question, TempFile
+    from datetime import datetime
+    name = f"bench-{uuid.uuid4().hex[:12]}"
+    user = UserAccount(
+        username=name, password="-", email=f"{name}@example.com",
+        gpt_api_key_preference="custom", gpt_api_key_permission="custom",
+        gpt_api_key="sk-bench", gpt_model="gpt-4o-mini"
+    )
+    session.add(user)
+    session.flush()
+    files = {}
+    for job in range(jobs):
+        form = Form(
+            job_title=f"Benchmark job {job}", company_background="A recruitment agency in Hong Kong.",
+            job_duties="Lead a data team.", job_requirements="Python, SQL and cloud experience.",
+            user_account_id=user.id
+        )
+        session.add(form)
+        session.flush()
+        session.add_all([Question(form_id=form.id, value=f"Question {index}") for index in range(1, 21)])
+        count = cvs // jobs + (1 if job < cvs % jobs else 0)
+        temp_files = [
+            TempFile(filename=f"cv-{job}-{index}.pdf", form_id=form.id, text=synthetic_cv(rng, cv_chars), extracted_at=datetime.utcnow())
+            for index in range(count)
+        ]
+        session.add_all(temp_files)
+        session.flush()
+        files[form.id] = [temp_file.id for temp_file in temp_files]
+    session.commit()
+    return user.id, files
+
+# Function to delete a seeded user with its jobs, summaries and LLM calls
+def cleanup(session, user_id):
+    from models import UserAccount, LLMCall
+    from sqlalchemy import delete
+    session.execute(delete(LLMCall).where(LLMCall.user_account_id == user_id))
+    session.execute(delete(UserAccount).where(UserAccount.id == user_id))
+    session.commit()
+
+# Function to summarize one CV the way summarize_cv does, without the scheduler
+def summarize_one(job_id, user_id, tempfile_id):
+    import ai_worker
+    from sqlalchemy.orm import Session
+    with Session(ai_worker.engine) as session:
+        db_file = ai_worker.get_record(session, ai_worker.TempFile, id=tempfile_id, form_id=job_id)
+        if db_file:
+            context = ai_worker.get_summarize_context(session, job_id, user_id)
+            ai_worker.summarize_file(session, db_file, ai_worker.get_file_text(session, db_file), context, job_id)
+
+# Function to get a percentile of a list of values
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(share * (len(values) - 1))))]
+
+# Function to run one mode at one concurrency
+def run(mode, concurrency, stub, cvs, jobs, cv_chars, rng):
+    """
+    Summarize a freshly seeded corpus and measure the throughput.
+
+    Parameters:
+    - mode: "job" or "cv".
+    - concurrency: Number of tasks run at once.
+    - stub: The running StubOpenAI.
+    - cvs, jobs, cv_chars: Size of the seeded corpus.
+    - rng: Random generator of the corpus.
+
+    Returns:
+    - dict: cvs, seconds, cvs_per_minute, p50 and p99 per-CV latency, calls_per_cv,
+      rate_limited, malformed and failed CVs.
+    """
+    import ai_worker
+    from models import TempFile
+    from sqlalchemy.orm import Session
+
+    with Session(ai_worker.engine) as session:
+        user_id, files = seed(session, cvs, jobs, cv_chars, rng)
+
+    # Time every CV, including its retries and the summary insert
+    latencies = []
+    original = ai_worker.summarize_file
+
+    def timed_summarize_file(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    if mode == "job":
+        tasks = [(ai_worker.summarize_cvs_using_chat_gpt, (job_id, user_id)) for job_id in files]
+    else:
+        tasks = [(summarize_one, (job_id, user_id, file_id)) for job_id, file_ids in files.items() for file_id in file_ids]
+
+    ai_worker.summarize_file = timed_summarize_file
+    stub.reset()
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(lambda task: task[0](*task[1]), tasks))
+    finally:
+        seconds = time.perf_counter() - start
+        ai_worker.summarize_file = original
+
+    with Session(ai_worker.engine) as session:
+        # Summarized CVs are detached from their job, the others failed every attempt
+        failed = session.query(TempFile).filter(TempFile.form_id.in_(list(files))).count()
+        cleanup(session, user_id)
+
+    return {
+        "cvs": cvs,
+        "seconds": seconds,
+        "cvs_per_minute": cvs / seconds * 60 if seconds else 0.0,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "calls_per_cv": stub.requests / cvs if cvs else 0.0,
+        "rate_limited": stub.rate_limited,
+        "malformed": stub.malformed_answers,
+        "failed": failed
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarization throughput benchmark against a stub OpenAI server")
+    parser.add_argument("--cvs", type=int, default=200, help="CVs summarized per run")
+    parser.add_argument("--jobs", type=int, default=4, help="Jobs the CVs are spread over")
+    parser.add_argument("--cv-chars", type=int, default=6000, help="Characters of extracted text per CV")
+    parser.add_argument("--modes", default="job,cv", help="Comma-separated modes: job, cv")
+    parser.add_argument("--concurrency", default="1,4,8", help="Comma-separated numbers of tasks run at once")
+    parser.add_argument("--latency", type=float, default=0.5, help="Stub seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=400, help="Stub completion tokens per second")
+    parser.add_argument("--completion-tokens", type=int, default=600, help="Stub completion tokens per answer")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--malformed", type=float, default=0.0, help="Share of answers that are not valid JSON")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the corpus and the injected failures")
+    args = parser.parse_args()
+
+    # Set before the worker modules are imported, they create their engine on import
+    os.environ.setdefault("DATABASE_URI", "sqlite:///bench_ai.sqlite")
+    stub = StubOpenAI(args.latency, args.token_rate, args.rate_limit, args.malformed, args.completion_tokens, args.seed)
+    os.environ["OPENAI_BASE_URL"] = stub.start()
+
+    from database import init_db
+    init_db()
+
+    print(f"{'mode':<6}{'tasks':>6}{'CVs':>6}{'CVs/min':>10}{'p50 (ms)':>11}{'p99 (ms)':>11}{'calls/CV':>10}{'429s':>6}{'bad JSON':>10}{'failed':>8}")
+    try:
+        for mode in args.modes.split(","):
+            for concurrency in [int(value) for value in args.concurrency.split(",")]:
+                result = run(mode, concurrency, stub, args.cvs, args.jobs, args.cv_chars, random.Random(args.seed))
+                print(
+                    f"{mode:<6}{concurrency:>6}{result['cvs']:>6}{result['cvs_per_minute']:>10.1f}"
+                    f"{result['p50'] * 1000:>11.0f}{result['p99'] * 1000:>11.0f}{result['calls_per_cv']:>10.2f}"
+                    f"{result['rate_limited']:>6}{result['malformed']:>10}{result['failed']:>8}"
+                )
+    finally:
+        stub.stop()
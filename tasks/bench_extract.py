@@ -0,0 +1,314 @@
+# Benchmark of CV text extraction over a generated corpus of PDF and DOCX files
+import argparse, json, os, random, statistics, string, subprocess, sys, zipfile, zlib
+
+"""
+
+    Usage:
+
+        python bench_extract.py generate [--out files/bench_corpus] [--count 3] [--seed 0]
+        python bench_extract.py run [--corpus files/bench_corpus] [--repeat 3] [--profile DIR]
+
+    generate writes a reproducible corpus, the same seed gives the same bytes.
+    It has several files of each profile:
+
+    - pdf-simple:  1-2 pages, one column, standard font
+    - pdf-long:    8-15 pages
+    - pdf-columns: Two columns, lines of both columns interleaved in the
+                   content stream as multi-column layouts are
+    - pdf-cmap:    Text drawn with glyph codes mapped through a ToUnicode
+                   CMap, as subset embedded fonts are, with Chinese names
+    - pdf-images:  Portfolio pages with a large image and a few lines each
+    - docx-simple, docx-long, docx-tables, docx-images: The same for DOCX
+
+    run extracts every file with extract_text_from_pdf or
+    extract_text_from_docx in a fresh interpreter. It reports the median time
+    over --repeat runs, the characters extracted, chars/sec and the peak RSS
+    added by the extraction, then a summary per profile. With --profile, a
+    cProfile of one extraction per file is written to DIR and the slowest
+    functions of the slowest file are printed.
+
+"""
+
+WORDS = (
+    "managed delivered python sql aws platform migration team recruiter client revenue growth analysis "
+    "reporting stakeholders budget design product launch customer data pipeline cloud security banking "
+    "insurance retail logistics marketing campaign university bachelor master award certified fluent"
+).split()
+CHINESE_NAMES = ["陳大文", "李小明", "黃志強", "張美玲", "王家豪", "劉嘉欣"]
+
+# Function to generate CV lines
+def cv_lines(rng, count, chinese=False):
+    lines = [f"Candidate {rng.randint(1000, 9999)}" + (f" {rng.choice(CHINESE_NAMES)}" if chinese else "")]
+    for index in range(count - 1):
+        if index % 12 == 0:
+            lines.append(rng.choice(["Experience", "Education", "Skills", "Projects", "Languages"]))
+        else:
+            lines.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 11))).capitalize())
+    return lines
+
+# Class writing a minimal PDF file
+class PdfWriter:
+
+    def __init__(self):
+        self.objects = []
+
+    def add(self, body):
+        self.objects.append(body if isinstance(body, bytes) else body.encode("latin-1"))
+        return len(self.objects)
+
+    def add_stream(self, data, entries=""):
+        data = zlib.compress(data)
+        return self.add(f"<< /Length {len(data)} /Filter /FlateDecode {entries}>>\nstream\n".encode("latin-1") + data + b"\nendstream")
+
+    def write(self, path, page_ids, pages_id):
+        self.objects[pages_id - 1] = (
+            f"<< /Type /Pages /Kids [{' '.join(f'{page_id} 0 R' for page_id in page_ids)}] /Count {len(page_ids)} >>"
+        ).encode("latin-1")
+        catalog_id = self.add(f"<< /Type /Catalog /Pages {pages_id} 0 R >>")
+        output = bytearray(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(self.objects, 1):
+            offsets.append(len(output))
+            output += f"{number} 0 obj\n".encode("latin-1") + body + b"\nendobj\n"
+        xref = len(output)
+        output += f"xref\n0 {len(self.objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+        output += b"".join(f"{offset:010d} 00000 n \n".encode("latin-1") for offset in offsets)
+        output += f"trailer\n<< /Size {len(self.objects) + 1} /Root {catalog_id} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+        with open(path, "wb") as file:
+            file.write(output)
+
+# Function to escape text for a PDF literal string
+def pdf_string(value):
+    return "(" + value.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+# Function to write a PDF of a profile
+def write_pdf(path, profile, rng):
+    writer = PdfWriter()
+    pages_id = writer.add("")
+    font_id = writer.add("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    fonts = f"/F1 {font_id} 0 R"
+    pages = {"pdf-simple": rng.randint(1, 2), "pdf-long": rng.randint(8, 15), "pdf-columns": rng.randint(2, 4),
+             "pdf-cmap": rng.randint(2, 4), "pdf-images": rng.randint(4, 8)}[profile]
+
+    codes = {}
+    if profile == "pdf-cmap":
+        # One-byte glyph codes mapped to Unicode, the way subset fonts are written
+        characters = sorted(set(string.ascii_letters + string.digits + " " + "".join(CHINESE_NAMES)))
+        codes = {character: index + 1 for index, character in enumerate(characters)}
+        entries = "\n".join(f"<{code:02X}> <{ord(character):04X}>" for character, code in codes.items())
+        cmap = (
+            "/CIDInit /ProcSet findresource begin 12 dict begin begincmap\n"
+            "/CMapName /Bench-UCS def /CMapType 2 def\n"
+            "1 begincodespacerange <01> <FF> endcodespacerange\n"
+            f"{len(codes)} beginbfchar\n{entries}\nendbfchar\n"
+            "endcmap CMapName currentdict /CMap defineresource pop end end"
+        )
+        cmap_id = writer.add_stream(cmap.encode("latin-1"))
+        font_id = writer.add(f"<< /Type /Font /Subtype /Type1 /BaseFont /BenchSubset /ToUnicode {cmap_id} 0 R >>")
+        fonts = f"/F1 {font_id} 0 R"
+
+    page_ids = []
+    for _ in range(pages):
+        resources = f"/Font << {fonts} >>"
+        operations = []
+        lines = cv_lines(rng, 12 if profile == "pdf-images" else 60, chinese=profile == "pdf-cmap")
+        if profile == "pdf-images":
+            width, height = 600, 400
+            # Noisy gradient, compresses about as badly as a photo
+            ramp = bytes(range(256)) * (width * 3 // 256 + 2)
+            gradient = b"".join(ramp[y % 256:y % 256 + width * 3] for y in range(height))
+            noise = rng.randbytes(len(gradient)).translate(bytes(value & 63 for value in range(256)))
+            pixels = (int.from_bytes(gradient, "big") ^ int.from_bytes(noise, "big")).to_bytes(len(gradient), "big")
+            image_id = writer.add_stream(pixels, f"/Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace /DeviceRGB /BitsPerComponent 8 ")
+            resources += f" /XObject << /Im1 {image_id} 0 R >>"
+            operations.append("q 500 0 0 333 50 420 cm /Im1 Do Q")
+        operations.append("BT /F1 9 Tf")
+        for index, line in enumerate(lines):
+            if profile == "pdf-columns":
+                # Left and right column lines alternate in the content stream
+                x, y = (40 if index % 2 == 0 else 310), 780 - (index // 2) * 12
+                line = line[:48]
+            else:
+                x, y = 40, (400 if profile == "pdf-images" else 780) - index * 12
+            if profile == "pdf-cmap":
+                text = "<" + "".join(f"{codes[character]:02X}" for character in line if character in codes) + ">"
+            else:
+                text = pdf_string(line)
+            operations.append(f"1 0 0 1 {x} {y} Tm {text} Tj")
+        operations.append("ET")
+        content_id = writer.add_stream("\n".join(operations).encode("latin-1"))
+        page_ids.append(writer.add(
+            f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 595 842] /Resources << {resources} >> /Contents {content_id} 0 R >>"
+        ))
+    writer.write(path, page_ids, pages_id)
+
+# Function to escape text for WordprocessingML
+def xml_text(value):
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+# Function to write a DOCX of a profile
+def write_docx(path, profile, rng):
+    paragraph = lambda line: f'<w:p><w:r><w:t xml:space="preserve">{xml_text(line)}</w:t></w:r></w:p>'
+    count = {"docx-simple": 60, "docx-long": 600, "docx-tables": 120, "docx-images": 40}[profile]
+    lines = cv_lines(rng, count, chinese=True)
+    body, media = [], {}
+    if profile == "docx-tables":
+        # Experience laid out as a table of period, company and description
+        for start in range(0, len(lines), 3):
+            cells = "".join(f"<w:tc>{paragraph(line)}</w:tc>" for line in lines[start:start + 3])
+            body.append(f"<w:tbl><w:tr>{cells}</w:tr></w:tbl>")
+    else:
+        body = [paragraph(line) for line in lines]
+    if profile == "docx-images":
+        for index in range(1, rng.randint(4, 8) + 1):
+            media[f"word/media/image{index}.png"] = rng.randbytes(200_000)
+            body.insert(index * 5, f'<w:p><w:r><w:drawing><a:blip xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" r:embed="rId{index}"/></w:drawing></w:r></w:p>')
+    relationships = "".join(
+        f'<Relationship Id="rId{index}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" Target="media/image{index}.png"/>'
+        for index in range(1, len(media) + 1)
+    )
+    files = {
+        "[Content_Types].xml": (
+            '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/><Default Extension="png" ContentType="image/png"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>'
+        ),
+        "_rels/.rels": (
+            '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/></Relationships>'
+        ),
+        "word/_rels/document.xml.rels": (
+            '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'{relationships}</Relationships>'
+        ),
+        "word/document.xml": (
+            '<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<w:body>{"".join(body)}</w:body></w:document>'
+        ),
+    }
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        # Fixed timestamps keep the corpus byte-for-byte reproducible
+        for name, data in list(files.items()) + list(media.items()):
+            archive.writestr(zipfile.ZipInfo(name, date_time=(2024, 1, 1, 0, 0, 0)), data, zipfile.ZIP_DEFLATED)
+
+PROFILES = {
+    "pdf-simple": write_pdf, "pdf-long": write_pdf, "pdf-columns": write_pdf, "pdf-cmap": write_pdf, "pdf-images": write_pdf,
+    "docx-simple": write_docx, "docx-long": write_docx, "docx-tables": write_docx, "docx-images": write_docx,
+}
+
+# Function to generate the corpus
+def generate(directory, count, seed):
+    """
+    Write count files of every profile to a directory, named <profile>-<n>.pdf or .docx.
+
+    Returns:
+    - list: The paths written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for profile, writer in PROFILES.items():
+        for index in range(count):
+            # One generator per file, so changing --count does not change the other files
+            rng = random.Random(f"{seed}-{profile}-{index}")
+            path = os.path.join(directory, f"{profile}-{index}.{profile.split('-')[0]}")
+            writer(path, profile, rng)
+            paths.append(path)
+    return paths
+
+# Code run in the child interpreter, prints the measurements as JSON
+PROBE = """
+import json, resource, statistics, time
+from utils import extract_text_from_pdf, extract_text_from_docx
+path, repeat, profile_path = {path!r}, {repeat!r}, {profile_path!r}
+extract = extract_text_from_pdf if path.endswith(".pdf") else extract_text_from_docx
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+timings = []
+for _ in range(repeat):
+    start = time.perf_counter()
+    text = extract(path)
+    timings.append(time.perf_counter() - start)
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if profile_path:
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.runcall(extract, path)
+    profiler.dump_stats(profile_path)
+print(json.dumps({{"seconds": statistics.median(timings), "chars": len(text or ""), "peak_rss_kb": peak - baseline}}))
+"""
+
+# Function to measure the extraction of one file
+def measure(path, repeat, profile_path=None):
+    """
+    Extract a file in a fresh interpreter.
+
+    Parameters:
+    - path: The PDF or DOCX file.
+    - repeat: Number of extractions, the median time is reported.
+    - profile_path: Where to write a cProfile of one more extraction, if given.
+
+    Returns:
+    - dict: seconds, chars and peak_rss_kb, the RSS added on top of the interpreter and imports.
+    """
+    code = PROBE.format(path=os.path.abspath(path), repeat=repeat, profile_path=profile_path and os.path.abspath(profile_path))
+    process = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=os.path.dirname(os.path.realpath(__file__)))
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1])
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+# Function to benchmark every file of a corpus
+def run(directory, repeat, profile_directory=None):
+    if profile_directory:
+        os.makedirs(profile_directory, exist_ok=True)
+    results = []
+    print(f"{'file':<22}{'size (KB)':>10}{'time (ms)':>11}{'chars':>9}{'chars/s':>12}{'peak RSS (MB)':>15}")
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith((".pdf", ".docx")):
+            continue
+        path = os.path.join(directory, filename)
+        profile_path = os.path.join(profile_directory, filename + ".prof") if profile_directory else None
+        result = measure(path, repeat, profile_path)
+        result.update(file=filename, profile=filename.rsplit("-", 1)[0], size_kb=os.path.getsize(path) / 1024, profile_path=profile_path)
+        result["chars_per_second"] = result["chars"] / result["seconds"] if result["seconds"] else 0.0
+        results.append(result)
+        print(
+            f"{filename:<22}{result['size_kb']:>10.0f}{result['seconds'] * 1000:>11.1f}{result['chars']:>9}"
+            f"{result['chars_per_second']:>12.0f}{result['peak_rss_kb'] / 1024:>15.1f}"
+        )
+
+    print(f"\n{'profile':<14}{'files':>6}{'median (ms)':>13}{'chars/s':>12}{'max peak RSS (MB)':>19}")
+    for profile in PROFILES:
+        rows = [result for result in results if result["profile"] == profile]
+        if rows:
+            print(
+                f"{profile:<14}{len(rows):>6}{statistics.median(row['seconds'] for row in rows) * 1000:>13.1f}"
+                f"{sum(row['chars'] for row in rows) / sum(row['seconds'] for row in rows):>12.0f}"
+                f"{max(row['peak_rss_kb'] for row in rows) / 1024:>19.1f}"
+            )
+
+    if profile_directory and results:
+        import pstats
+        slowest = max(results, key=lambda result: result["seconds"])
+        print(f"\nSlowest functions extracting {slowest['file']}:")
+        pstats.Stats(slowest["profile_path"]).sort_stats("cumulative").print_stats(15)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CV text extraction benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate_parser = commands.add_parser("generate", help="Write the synthetic corpus")
+    generate_parser.add_argument("--out", default=os.path.join("files", "bench_corpus"), help="Corpus directory")
+    generate_parser.add_argument("--count", type=int, default=3, help="Files per profile")
+    generate_parser.add_argument("--seed", type=int, default=0, help="Random seed, the same seed gives the same files")
+    run_parser = commands.add_parser("run", help="Extract every file of the corpus")
+    run_parser.add_argument("--corpus", default=os.path.join("files", "bench_corpus"), help="Corpus directory")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Extractions per file, the median time is reported")
+    run_parser.add_argument("--profile", help="Directory for one cProfile output per file")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        paths = generate(args.out, args.count, args.seed)
+        print(f"Wrote {len(paths)} files to {args.out}")
+    else:
+        run(args.corpus, args.repeat, args.profile)
@@ -0,0 +1,96 @@
+# Benchmark of worker start-up: import time and time until ready for the first task
+import argparse, json, os, subprocess, sys
+
+"""
+
+    Usage:
+
+        python bench_startup.py [--repeat 5] [--importtime]
+
+    Each worker module is imported in a fresh interpreter, then its prewarm()
+    hook is run the way a prefork child runs it before its first task. Set
+    DATABASE_URI (e.g. sqlite:///bench.sqlite) to benchmark without Postgres.
+
+"""
+
+# Worker modules and the queues they serve
+WORKERS = {
+    "worker": "queue1",
+    "ai_worker": "queue2",
+    "extract_worker": "queue3",
+}
+
+# Code run in the child interpreter, prints the timings as JSON
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+module = __import__({module!r})
+imported = time.perf_counter()
+error = None
+try:
+    module.prewarm()
+except Exception as exception:
+    error = str(exception)
+ready = time.perf_counter()
+heavy = [name for name in ("openai", "PyPDF2", "docx2txt", "bcrypt") if name in sys.modules]
+print(json.dumps({{
+    "import_seconds": imported - start,
+    "prewarm_seconds": ready - imported,
+    "ready_seconds": ready - start,
+    "heavy_modules": heavy,
+    "error": error
+}}))
+"""
+
+# Function to measure the start-up of one worker module
+def measure(module, importtime=False):
+    """
+    Import a worker module in a fresh interpreter and time its start-up.
+
+    Parameters:
+    - module: The worker module name.
+    - importtime: Whether to print the slowest imports reported by -X importtime.
+
+    Returns:
+    - dict: import_seconds, prewarm_seconds, ready_seconds, heavy_modules and error.
+    """
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", PROBE.format(module=module)]
+    process = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(os.path.realpath(__file__)))
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1])
+    if importtime:
+        print_slowest_imports(module, process.stderr)
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+# Function to print the slowest top-level imports from -X importtime output
+def print_slowest_imports(module, stderr, count=10):
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            imports.append((int(cumulative), name.strip()))
+    print(f"Slowest imports of {module}:")
+    for cumulative, name in sorted(imports, reverse=True)[:count]:
+        print(f"  {cumulative / 1000:9.1f} ms  {name}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker start-up benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of start-ups measured per worker")
+    parser.add_argument("--importtime", action="store_true", help="Print the slowest imports of each worker")
+    args = parser.parse_args()
+
+    print(f"{'worker':<16}{'queue':<8}{'import (ms)':>12}{'prewarm (ms)':>14}{'ready (ms)':>12}  heavy modules")
+    for module, queue in WORKERS.items():
+        runs = [measure(module, args.importtime and index == 0) for index in range(args.repeat)]
+        median = lambda key: sorted(run[key] for run in runs)[len(runs) // 2] * 1000
+        print(
+            f"{module:<16}{queue:<8}{median('import_seconds'):>12.1f}{median('prewarm_seconds'):>14.1f}"
+            f"{median('ready_seconds'):>12.1f}  {', '.join(runs[-1]['heavy_modules']) or '-'}"
+        )
+        if runs[-1]["error"]:
+            print(f"  prewarm failed: {runs[-1]['error']}")
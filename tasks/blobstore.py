@@ -0,0 +1,223 @@
+# Importing necessary modules for file operations
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile, mkdtemp
+import os, shutil
+
+"""
+
+    Blob Store:
+
+    Uploaded files are stored once per content under their SHA-256 digest,
+    sharded on the first two byte pairs of the digest to keep directories small:
+
+        blobs/ab/cd/abcd...
+
+    The web service stages finalized uploads in uploads/<upload_id>/data in
+    the shared files volume. The ingest worker first takes a reference on the
+    blob and only then moves the upload to that path, always replacing it
+    atomically, so a concurrent release of the same content cannot remove
+    the file between the two. The blob backend then decides where blobs live:
+
+    1. local - The files volume itself (default).
+    2. s3    - An S3-compatible bucket (AWS S3, MinIO, ...). The ingest worker
+               moves new blobs from the files volume to the bucket, so the
+               extraction and AI workers do not need the volume and can run on
+               any node.
+
+    Backend Environment Variables:
+
+    - BLOB_BACKEND: "local" or "s3"
+    - BLOB_S3_BUCKET: Bucket name
+    - BLOB_S3_ENDPOINT_URL: Endpoint of an S3-compatible server, e.g. http://minio:9000
+    - BLOB_S3_PREFIX: Optional key prefix
+    - AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY / AWS_DEFAULT_REGION: Credentials
+
+"""
+
+# Defining the base directory for file operations
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+FILES_DIR = os.path.join(BASE_DIR, "files")
+
+# Function to get the path of a blob relative to the files directory
+def blob_path(sha256):
+    """
+    Get the sharded path of a blob relative to the files directory.
+
+    Parameters:
+        - sha256 (str): The hex SHA-256 digest of the blob content.
+
+    Returns:
+        - str: The relative path of the blob.
+    """
+    return os.path.join("blobs", sha256[:2], sha256[2:4], sha256)
+
+# Function to get the absolute path of a blob in the files volume
+def blob_filepath(sha256):
+    """
+    Get the absolute path of a blob in the files volume.
+
+    Parameters:
+        - sha256 (str): The hex SHA-256 digest of the blob content.
+
+    Returns:
+        - str: The absolute path of the blob.
+    """
+    return os.path.join(FILES_DIR, blob_path(sha256))
+
+# Function to move a finalized upload to its blob path
+def commit_upload(sha256, upload_id):
+    """
+    Move the verified content of a finalized upload to its blob path.
+
+    Must only be called once the blob is referenced. An existing copy of the
+    blob is replaced atomically, it holds the same content.
+
+    Parameters:
+        - sha256 (str): The hex SHA-256 digest of the upload content.
+        - upload_id (str): The identifier of the staged upload.
+
+    Returns:
+        - bool: True if the upload was moved, False if it was not staged.
+    """
+    upload_dir = os.path.join(FILES_DIR, "uploads", os.path.basename(upload_id))
+    datapath = os.path.join(upload_dir, "data")
+    if not os.path.exists(datapath):
+        return False
+    filepath = blob_filepath(sha256)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    os.replace(datapath, filepath)
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    return True
+
+# Blob backend storing blobs in the shared files volume
+class LocalBlobBackend:
+
+    name = "local"
+
+    def store(self, sha256):
+        """Keep a blob written by the web service where it is."""
+        return os.path.exists(blob_filepath(sha256))
+
+    @contextmanager
+    def fetch(self, sha256, suffix=""):
+        """Yield a local path to the blob content, a temporary link named with suffix if one is given."""
+        filepath = blob_filepath(sha256)
+        if not suffix:
+            yield filepath
+            return
+        directory = mkdtemp()
+        linkpath = os.path.join(directory, sha256 + suffix)
+        try:
+            try:
+                os.symlink(filepath, linkpath)
+            except OSError:
+                # Symbolic links may not be permitted, copy the blob instead
+                shutil.copyfile(filepath, linkpath)
+            yield linkpath
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def delete(self, sha256):
+        """Remove a blob, returning False if it did not exist."""
+        try:
+            os.remove(blob_filepath(sha256))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def download_url(self, sha256, filename):
+        """Local blobs are streamed by the web service, there is no direct URL."""
+        return None
+
+# Blob backend storing blobs in an S3-compatible bucket
+class S3BlobBackend:
+
+    name = "s3"
+
+    def __init__(self, bucket, endpoint_url=None, prefix="", client=None):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.prefix = prefix
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client("s3", endpoint_url=self.endpoint_url)
+        return self._client
+
+    def key(self, sha256):
+        """Get the object key of a blob."""
+        return self.prefix + blob_path(sha256).replace(os.sep, "/")
+
+    def store(self, sha256):
+        """Move a blob written by the web service from the files volume to the bucket."""
+        filepath = blob_filepath(sha256)
+        if not os.path.exists(filepath):
+            return False
+        self.client.upload_file(filepath, self.bucket, self.key(sha256))
+        os.remove(filepath)
+        return True
+
+    @contextmanager
+    def fetch(self, sha256, suffix=""):
+        """Download the blob to a temporary file, named with suffix, and yield its path."""
+        with NamedTemporaryFile(suffix=suffix, delete=False) as file:
+            body = self.client.get_object(Bucket=self.bucket, Key=self.key(sha256))["Body"]
+            shutil.copyfileobj(body, file)
+        try:
+            yield file.name
+        finally:
+            os.remove(file.name)
+
+    def delete(self, sha256):
+        """Remove a blob from the bucket."""
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(sha256))
+        return True
+
+    def download_url(self, sha256, filename, expires_in=300):
+        """Get a short-lived presigned URL downloading the blob under its original name."""
+        return self.client.generate_presigned_url("get_object", Params={
+            "Bucket": self.bucket,
+            "Key": self.key(sha256),
+            "ResponseContentDisposition": f'attachment; filename="{filename}"'
+        }, ExpiresIn=expires_in)
+
+_backend = None
+
+# Function to get the configured blob backend
+def get_backend():
+    """
+    Get the blob backend configured with the BLOB_BACKEND environment variable.
+
+    Returns:
+        - LocalBlobBackend or S3BlobBackend: The backend, created once per process.
+    """
+    global _backend
+    if _backend is None:
+        if os.environ.get("BLOB_BACKEND", "local") == "s3":
+            _backend = S3BlobBackend(
+                bucket=os.environ["BLOB_S3_BUCKET"],
+                endpoint_url=os.environ.get("BLOB_S3_ENDPOINT_URL"),
+                prefix=os.environ.get("BLOB_S3_PREFIX", "")
+            )
+        else:
+            _backend = LocalBlobBackend()
+    return _backend
+
+# Function to remove a blob from the configured backend
+def remove_blob(sha256):
+    """
+    Remove a blob from the configured backend.
+
+    Parameters:
+        - sha256 (str): The hex SHA-256 digest of the blob content.
+
+    Returns:
+        - bool: True if the blob was removed, False if it did not exist.
+    """
+    removed = get_backend().delete(sha256)
+    if removed:
+        print(f"[Blob DELETE SUCCESS]: {sha256}")
+    return removed
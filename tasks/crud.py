@@ -3,17 +3,27 @@ from sqlalchemy.orm import relationship
 from sqlalchemy import (
     Column, Integer, 
     Text, ForeignKey,
-    String, and_
+    String, and_,
+    or_, func, update
 )
 from sqlalchemy.exc import (
     NoResultFound, 
-    SQLAlchemyError
+    SQLAlchemyError,
+    IntegrityError
 )
 from io import StringIO
+from datetime import datetime
 import os, json, csv
 from models import *
+from utils import extract_text, compact_text
+from blobstore import blob_filepath, get_backend
+from metrics import timed_query, observe_llm_call
+from dedupe import minhash, pack_signature, unpack_signature, similarity, band_keys, DEDUPE_THRESHOLD
+from scores import is_rating_question, parse_score
+from datetime import timedelta
 
 # Function to add a record to the database
+@timed_query
 def add_record(session, model_class, **kwargs):
     """
     Add a record to the database.
@@ -35,6 +45,7 @@ def add_record(session, model_class, **kwargs):
         print(error)
 
 # Function to retrieve a single record from the database
+@timed_query
 def get_record(session, model_class, **kwargs):
     """
     Retrieve a single record from the database.
@@ -49,6 +60,7 @@ def get_record(session, model_class, **kwargs):
     return session.query(model_class).filter_by(**kwargs).scalar()
 
 # Function to update a record in the database
+@timed_query
 def update_record(session, model_class, target: dict, update: dict):
     """
     Update a record in the database.
@@ -73,6 +85,7 @@ def update_record(session, model_class, target: dict, update: dict):
     return False
 
 # Function to delete a record from the database
+@timed_query
 def delete_record(session, model_class, **kwargs):
     """
     Delete a record from the database.
@@ -94,6 +107,7 @@ def delete_record(session, model_class, **kwargs):
     return False
 
 # Function to delete all records from a table
+@timed_query
 def delete_all_records(session, model_class):
     """
     Delete all records from a table in the database.
@@ -113,6 +127,7 @@ def delete_all_records(session, model_class):
         return False
 
 # Function to retrieve all records from a table
+@timed_query
 def get_all_records(session, model_class, **kwargs):
     """
     Retrieve all records from a table in the database.
@@ -129,7 +144,12 @@ def get_all_records(session, model_class, **kwargs):
         print("error: ", error)
     return None
 
+# Function to compare question texts regardless of case, spacing and trailing punctuation
+def normalize_question(text):
+    return " ".join((text or "").lower().split()).rstrip("?.:! ")
+
 # Function to add a summary to the database
+@timed_query
 def db_add_summary(session, summary_data, job_id):
     """
     Add a summary to the database.
@@ -141,18 +161,29 @@ def db_add_summary(session, summary_data, job_id):
 
     Returns:
     - The ID of the added summary if successful, None otherwise.
+
+    Items are linked to the job question they answer, and the answers of
+    1-10 rating questions are also stored as SummaryScore rows.
     """
     try:
         job = get_record(session, Form, id=job_id)
+        questions = {normalize_question(question.value): question for question in job.questions}
+        scored = set()
         summary = Summary()
         session.add(summary)
         session.flush()
         for title in summary_data:
+            question = questions.get(normalize_question(title))
             summary_item = SummaryItem()
             summary_item.summary = summary
+            summary_item.question_id = question.id if question else None
             summary_item.title = title
             summary_item.description = summary_data[title]
             session.add(summary_item)
+            score = parse_score(summary_data[title]) if question and is_rating_question(question.value) else None
+            if score is not None and question.id not in scored:
+                scored.add(question.id)
+                session.add(SummaryScore(form_id=job.id, question_id=question.id, summary_id=summary.id, score=score))
         job.summaries.append(summary)
         session.flush()
         session.commit()
@@ -160,7 +191,134 @@ def db_add_summary(session, summary_data, job_id):
     except SQLAlchemyError as error:
         print("error", error)
 
+# Function to replace the questions of a job
+@timed_query
+def db_set_questions(session, job_id, user_id, questions):
+    """
+    Replace the questions of a job, keeping the IDs of the questions kept or edited.
+
+    The scores of edited questions are removed, their answers no longer
+    apply. Summaries are not changed, see db_missing_questions.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - job_id: The ID of the job.
+    - user_id: The ID of the user_account owning the job.
+    - questions: A list of {"value": ...} dictionaries, with the "id" of an existing question to keep or edit it.
+
+    Returns:
+    - The question IDs in order, or None if the job does not belong to the user.
+    """
+    try:
+        job = get_record(session, Form, id=job_id, user_account_id=user_id)
+        if job is None:
+            return None
+        existing = {question.id: question for question in job.questions}
+        kept = []
+        for entry in questions:
+            value = (entry.get("value") or "").strip()
+            if not value:
+                continue
+            question = existing.pop(entry["id"], None) if entry.get("id") is not None else None
+            if question is None:
+                question = Question(form_id=job.id, value=value)
+                session.add(question)
+            elif normalize_question(question.value) != normalize_question(value):
+                session.query(SummaryScore).filter(SummaryScore.question_id == question.id).delete(synchronize_session=False)
+                question.value = value
+            kept.append(question)
+        for question in existing.values():
+            session.delete(question)
+        session.flush()
+        session.commit()
+        return [question.id for question in kept]
+    except SQLAlchemyError as error:
+        session.rollback()
+        print("error", error)
+
+# Function to find the questions a summary does not answer yet
+def db_missing_questions(summary, questions):
+    """
+    Diff the current questions of a job against the answers of a summary.
+
+    A question is answered when the summary has an item with the same text,
+    so both new and edited questions are missing.
+
+    Parameters:
+    - summary: The Summary record.
+    - questions: The Question records of the job.
+
+    Returns:
+    - list: The Question records to ask, in job order.
+    """
+    answered = {normalize_question(summary_item.title) for summary_item in summary.summary_items}
+    return [question for question in questions if normalize_question(question.value) not in answered]
+
+# Function to merge the answers of new or edited questions into a summary
+@timed_query
+def db_merge_summary(session, summary_data, summary_id, job_id):
+    """
+    Merge answers into an existing summary, leaving its other answers as they are.
+
+    The answer of an edited question replaces the item linked to that
+    question, other answers are added as new items. Scores of rating
+    questions are replaced. Items saved before answers were linked to
+    their question are matched on their title.
+
+    Items answering no current question of the job, the answers of deleted
+    questions or the old text of an edited one, are dropped, so the merged
+    summary only answers the job's current questions.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - summary_data: A dictionary of question texts to answers.
+    - summary_id: The ID of the summary.
+    - job_id: The ID of the job of the summary.
+
+    Returns:
+    - The summary ID if successful, None otherwise.
+    """
+    try:
+        job = get_record(session, Form, id=job_id)
+        summary = get_record(session, Summary, id=summary_id)
+        questions = {normalize_question(question.value): question for question in job.questions}
+        question_ids = {question.id for question in questions.values()}
+        items = {}
+        for summary_item in summary.summary_items:
+            if summary_item.question_id is None:
+                question = questions.get(normalize_question(summary_item.title))
+                summary_item.question_id = question.id if question else None
+            if summary_item.question_id in question_ids:
+                items.setdefault(summary_item.question_id, summary_item)
+            else:
+                session.delete(summary_item)
+        merged = set()
+        for title in summary_data:
+            question = questions.get(normalize_question(title))
+            if question is not None and question.id in merged:
+                continue
+            summary_item = items.get(question.id) if question else None
+            if summary_item is None:
+                summary_item = SummaryItem(summary=summary, question_id=question.id if question else None)
+                session.add(summary_item)
+            summary_item.title = title
+            summary_item.description = summary_data[title]
+            if question is None:
+                continue
+            merged.add(question.id)
+            session.query(SummaryScore).filter_by(summary_id=summary.id, question_id=question.id).delete(synchronize_session=False)
+            score = parse_score(summary_data[title]) if is_rating_question(question.value) else None
+            if score is not None:
+                session.add(SummaryScore(form_id=job.id, question_id=question.id, summary_id=summary.id, score=score))
+        session.flush()
+        session.commit()
+        return summary.id
+    except SQLAlchemyError as error:
+        session.rollback()
+        print("error", error)
+
 # Function to retrieve summary details from the database
+@timed_query
 def db_get_summary(session, summary_id):
     """
     Retrieve summary details from the database.
@@ -183,50 +341,566 @@ def db_get_summary(session, summary_id):
     return summary_details
 
 # Function to retrieve all summaries associated with a job
-def db_get_all_summaries(session, job_id, user_id):
+@timed_query
+def db_get_all_summaries(
+        session, job_id, user_id, limit=None, after_id=None, fields=None,
+        score_question_id=None, min_score=None, max_score=None, descending=True, offset=None
+    ):
     """
-    Retrieve all summaries associated with a job and user_account from the database.
+    Retrieve summaries associated with a job and user_account from the database.
+
+    Summaries are ordered by ID and paginated with a keyset cursor: pass the last
+    summary ID of the previous page as after_id to get the next one.
+
+    With score_question_id, summaries are ordered by their score for that 1-10
+    rating question instead, unscored summaries last, and paginated with offset.
 
     Parameters:
     - session: The SQLAlchemy session.
     - job_id: The ID of the job.
     - user_id: The ID of the user_account.
+    - limit: The maximum number of summaries to return (all if None).
+    - after_id: Only return summaries with an ID greater than this one.
+    - fields: Only return summary items whose title contains one of these
+      (case-insensitive) strings, all items if None.
+    - score_question_id: The rating question to sort and filter by.
+    - min_score: Only return summaries scored at least this much.
+    - max_score: Only return summaries scored at most this much.
+    - descending: Highest scores first (default), lowest first if False.
+    - offset: The number of summaries to skip when sorting by score.
 
     Returns:
-    - A list of dictionaries containing summary details.
+    - A list of dictionaries containing summary details, and their "score" when
+      sorted by score.
     """
-    result = []
-    summaries = session.query(Summary).join(Form).join(UserAccount).filter(and_(Form.id == job_id, UserAccount.id == user_id)).all()
-    for summary in summaries:
-        summary_details = {"summary_id": summary.id, "summary_items": {}}
-        for summary_item in summary.summary_items:
-            summary_details["summary_items"][summary_item.title] = summary_item.description
-        result.append(summary_details)
-    return result
+    query = (
+        session.query(Summary.id)
+        .join(Form, Summary.form_id == Form.id)
+        .filter(and_(Form.id == job_id, Form.user_account_id == user_id))
+    )
+    if score_question_id is not None:
+        # Only this question's score joins, the (form_id, question_id, score) index serves the filter
+        query = query.outerjoin(SummaryScore, and_(
+            SummaryScore.summary_id == Summary.id,
+            SummaryScore.form_id == job_id,
+            SummaryScore.question_id == score_question_id
+        )).add_columns(SummaryScore.score)
+        if min_score is not None:
+            query = query.filter(SummaryScore.score >= min_score)
+        if max_score is not None:
+            query = query.filter(SummaryScore.score <= max_score)
+        order = SummaryScore.score.desc() if descending else SummaryScore.score.asc()
+        query = query.order_by(order.nulls_last(), Summary.id)
+        if offset:
+            query = query.offset(offset)
+    else:
+        if after_id is not None:
+            query = query.filter(Summary.id > after_id)
+        query = query.order_by(Summary.id)
+    if limit is not None:
+        query = query.limit(limit)
+    result = {}
+    for row in query:
+        result[row[0]] = {"summary_id": row[0], "summary_items": {}}
+        if score_question_id is not None:
+            result[row[0]]["score"] = row.score
+    if not result:
+        return []
+
+    # Load the items of the whole page in a single query
+    items = (
+        session.query(SummaryItem.summary_id, SummaryItem.title, SummaryItem.description)
+        .filter(SummaryItem.summary_id.in_(list(result)))
+    )
+    if fields:
+        items = items.filter(or_(*[SummaryItem.title.ilike(f"%{field}%") for field in fields]))
+    for summary_id, title, description in items.order_by(SummaryItem.summary_id, SummaryItem.id):
+        result[summary_id]["summary_items"][title] = description
+    return list(result.values())
+
+# Function to stream summary answers for a job row by row
+def iter_summary_rows(session, job_id, user_id, questions=None, batch_size=500):
+    """
+    Stream the answers of every summary associated with a job and user_account.
+
+    Summary items are fetched through a server-side cursor (yield_per) and grouped
+    per summary, so memory stays bounded by batch_size regardless of the number
+    of candidates in the job. Answers are keyed by the question they answer, items
+    stored before question_id existed are matched by their normalized title, and
+    questions a summary does not answer are left empty.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - job_id: The ID of the job.
+    - user_id: The ID of the user_account.
+    - questions: The Question records used as columns (default: the questions of the job by ID).
+    - batch_size: The number of summary items fetched per round trip.
+
+    Yields:
+    - A (summary_id, answers) tuple per summary, answers lining up with questions.
+    """
+    if questions is None:
+        questions = session.query(Question).filter(Question.form_id == job_id).order_by(Question.id).all()
+    by_title = {}
+    for question in questions:
+        by_title.setdefault(normalize_question(question.value), question.id)
+    query = (
+        session.query(SummaryItem.summary_id, SummaryItem.question_id, SummaryItem.title, SummaryItem.description)
+        .join(Summary, SummaryItem.summary_id == Summary.id)
+        .join(Form, Summary.form_id == Form.id)
+        .filter(and_(Form.id == job_id, Form.user_account_id == user_id))
+        .order_by(SummaryItem.summary_id, SummaryItem.id)
+        .yield_per(batch_size)
+    )
+    current_id, answers = None, {}
+    for summary_id, question_id, title, description in query:
+        if summary_id != current_id and current_id is not None:
+            yield current_id, [answers.get(question.id, "") for question in questions]
+            answers = {}
+        current_id = summary_id
+        if question_id is None:
+            question_id = by_title.get(normalize_question(title))
+        if question_id is not None:
+            answers.setdefault(question_id, description)
+    if current_id is not None:
+        yield current_id, [answers.get(question.id, "") for question in questions]
 
 # Function to retrieve details of all jobs associated with a user_account
-def db_get_jobs(session, user_id):
+@timed_query
+def db_get_jobs(session, user_id, limit=None, after_id=None, fields=None):
     """
-    Retrieve details of all jobs associated with a user_account from the database.
+    Retrieve details of jobs associated with a user_account from the database.
+
+    Jobs are ordered by ID and paginated with a keyset cursor: pass the last job
+    ID of the previous page as after_id to get the next one.
 
     Parameters:
     - session: The SQLAlchemy session.
     - user_id: The ID of the user_account.
+    - limit: The maximum number of jobs to return (all if None).
+    - after_id: Only return jobs with an ID greater than this one.
+    - fields: The job fields to return (all if None), the ID is always included.
 
     Returns:
     - A list of dictionaries containing job details.
     """
-    result = []
-    jobs = get_all_records(session, Form, user_account_id=user_id)
-    for job in jobs:
-        summaries = session.query(Summary).filter_by(form_id=job.id).count()
-        job_details = {
-            "id": job.id,
-            "job_title": job.job_title,
-            "summaries": summaries,
-            "company_background": job.company_background,
-            "job_duties": job.job_duties,
-            "job_requirements": job.job_requirements
-        }
-        result.append(job_details)
-    return result
+    summary_counts = (
+        session.query(Summary.form_id, func.count(Summary.id).label("summaries"))
+        .group_by(Summary.form_id)
+        .subquery()
+    )
+    columns = {
+        "id": Form.id,
+        "job_title": Form.job_title,
+        "summaries": func.coalesce(summary_counts.c.summaries, 0),
+        "company_background": Form.company_background,
+        "job_duties": Form.job_duties,
+        "job_requirements": Form.job_requirements
+    }
+    selected = ["id"] + [field for field in (fields or columns) if field in columns and field != "id"]
+
+    query = session.query(*[columns[field] for field in selected])
+    if "summaries" in selected:
+        query = query.outerjoin(summary_counts, summary_counts.c.form_id == Form.id)
+    query = query.filter(Form.user_account_id == user_id)
+    if after_id is not None:
+        query = query.filter(Form.id > after_id)
+    query = query.order_by(Form.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return [dict(zip(selected, row)) for row in query]
+
+# Function to split a list of records into a page and the cursor of the next one
+def db_paginate(records, limit, key="id"):
+    """
+    Build a keyset page from records fetched with limit + 1 rows.
+
+    Parameters:
+    - records: The records fetched from the database (at most limit + 1).
+    - limit: The requested page size.
+    - key: The record field used as cursor.
+
+    Returns:
+    - A dictionary with the page "items" and the "next_cursor" (None on the last page).
+    """
+    items = records[:limit]
+    next_cursor = items[-1][key] if len(records) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+# Function to extract and store the prompt-ready text of an uploaded file
+@timed_query
+def db_extract_file(session, db_file):
+    """
+    Extract the text of an uploaded CV and store it on its TempFile record.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - db_file: The TempFile record.
+
+    Returns:
+    - The compacted text, or None if the file could not be read.
+    """
+    # Blob paths have no extension, the parser is chosen from the uploaded file name
+    extension = os.path.splitext(db_file.filename or "")[1]
+    if db_file.blob is not None:
+        # Blobs may live in a remote backend, fetch them to a local file first
+        with get_backend().fetch(db_file.blob.sha256, extension) as filepath:
+            text = extract_text(filepath, extension=extension)
+    else:
+        text = extract_text(tempfile_filepath(db_file), extension=extension)
+    if text is None:
+        return None
+    db_file.text = compact_text(text)
+    db_file.extracted_at = datetime.utcnow()
+    db_file.fingerprint = pack_signature(minhash(db_file.text))
+    session.commit()
+    return db_file.text
+
+# Function to load the model settings used to formulate the questions of a user's jobs
+def db_get_formulate_settings(session, user):
+    """
+    Load the OpenAI credentials and prompt used to formulate questions for a user.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - user: The UserAccount record.
+
+    Returns:
+    - tuple: (gpt_api_key, gpt_model, formulate_questions_prompt).
+    """
+    settings = { setting.name: setting.value for setting in get_all_records(session, Setting) }
+    if user.gpt_api_key_preference == 'default' and user.gpt_api_key_permission == 'default':
+        return settings.get('gpt_api_key'), settings.get('gpt_model'), settings.get('formulate_questions_prompt')
+    return user.gpt_api_key, user.gpt_model, settings.get('formulate_questions_prompt')
+
+# Function to read generated questions from the cache
+@timed_query
+def db_get_cached_questions(session, key, ttl):
+    """
+    Get the cached questions of a formulate_questions call, see question_cache.py.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - key: The cache key.
+    - ttl: Seconds an entry is reused.
+
+    Returns:
+    - The cached model answer, or None on a miss or an expired entry.
+    """
+    entry = get_record(session, QuestionCache, key=key)
+    if entry is None or entry.created_at < datetime.utcnow() - timedelta(seconds=ttl):
+        return None
+    entry.hits += 1
+    entry.last_used_at = datetime.utcnow()
+    session.commit()
+    return entry.questions
+
+# Function to store generated questions in the cache
+@timed_query
+def db_cache_questions(session, key, model, questions, size):
+    """
+    Store the questions of a formulate_questions call, replacing an earlier
+    entry with the same key and evicting the least recently used entries
+    beyond size.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - key: The cache key.
+    - model: The model that generated the questions.
+    - questions: The model answer.
+    - size: Maximum number of entries kept.
+    """
+    try:
+        entry = get_record(session, QuestionCache, key=key)
+        if entry is None:
+            entry = QuestionCache(key=key)
+            session.add(entry)
+        entry.model = model
+        entry.questions = questions
+        entry.hits = 0
+        entry.created_at = entry.last_used_at = datetime.utcnow()
+        session.flush()
+        evicted = session.query(QuestionCache.id).order_by(QuestionCache.last_used_at.desc(), QuestionCache.id.desc()).offset(size)
+        session.query(QuestionCache).filter(QuestionCache.id.in_([entry_id for entry_id, in evicted])).delete(synchronize_session=False)
+        session.commit()
+    except SQLAlchemyError as error:
+        # A concurrent call stored the same key first, its entry is as good
+        session.rollback()
+        print("error", error)
+
+# Function to find an earlier near-duplicate of a CV among the CVs of a user
+@timed_query
+def db_find_duplicate(session, db_file, user_id, job_id, threshold=None):
+    """
+    Find the CV of a user most similar to a CV, preferring one already summarized for the same job.
+
+    Only the user's other CVs, in their jobs or already summarized, sharing an
+    LSH band key with the CV are loaded and compared.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - db_file: The TempFile record, its fingerprint must be set.
+    - user_id: The ID of the user_account owning the jobs searched.
+    - job_id: The ID of the job the CV is summarized for.
+    - threshold: Minimum estimated Jaccard similarity (default: DEDUPE_THRESHOLD).
+
+    Returns:
+    - A tuple of the matching TempFile and its similarity, or (None, 0.0).
+    """
+    signature = unpack_signature(db_file.fingerprint)
+    if signature is None:
+        return None, 0.0
+    threshold = DEDUPE_THRESHOLD if threshold is None else threshold
+    user_files = (
+        session.query(TempFile)
+        .outerjoin(Summary, TempFile.summary_id == Summary.id)
+        .join(Form, or_(Form.id == TempFile.form_id, Form.id == Summary.form_id))
+        .filter(Form.user_account_id == user_id, TempFile.id != db_file.id, TempFile.fingerprint.isnot(None))
+    )
+    # Fingerprints written before band keys were stored are indexed once
+    unindexed = user_files.filter(~session.query(FingerprintBand.id).filter(FingerprintBand.temp_file_id == TempFile.id).exists())
+    for tempfile_id, fingerprint in unindexed.with_entities(TempFile.id, TempFile.fingerprint).all():
+        write_fingerprint_bands(session.connection(), tempfile_id, fingerprint)
+    shared_band = or_(*[and_(FingerprintBand.band == band, FingerprintBand.key == key) for band, key in band_keys(signature)])
+    rows = user_files.filter(
+        TempFile.id.in_(session.query(FingerprintBand.temp_file_id).filter(shared_band))
+    ).with_entities(TempFile.id, TempFile.fingerprint)
+    matches = [(tempfile_id, similarity(signature, unpack_signature(fingerprint))) for tempfile_id, fingerprint in rows]
+    matches = sorted([match for match in matches if match[1] >= threshold], key=lambda match: match[1], reverse=True)
+    if not matches:
+        return None, 0.0
+    candidates = {candidate.id: candidate for candidate in session.query(TempFile).filter(TempFile.id.in_([key for key, _ in matches]))}
+    # A summary of the same job can be reused, any other match is only reported
+    for tempfile_id, score in matches:
+        candidate = candidates[tempfile_id]
+        if candidate.summary is not None and candidate.summary.form_id == int(job_id):
+            return candidate, score
+    return candidates[matches[0][0]], matches[0][1]
+
+# Function to get the path of the stored file of a TempFile
+def tempfile_filepath(db_file):
+    """
+    Get the absolute path of the stored file of a TempFile.
+
+    Parameters:
+    - db_file: The TempFile record.
+
+    Returns:
+    - The blob path, or the legacy files/<filename> path for files stored before the blob store.
+    """
+    if db_file.blob is not None:
+        return blob_filepath(db_file.blob.sha256)
+    return os.path.join(BASE_DIR, "files", db_file.filename)
+
+# Function to reference a blob, creating it on first use
+@timed_query
+def db_acquire_blob(session, sha256, size):
+    """
+    Get the blob of a file content and increment its reference count.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - sha256: The hex SHA-256 digest of the file content.
+    - size: The size of the file in bytes.
+
+    Returns:
+    - The Blob record.
+    """
+    blob = get_record(session, Blob, sha256=sha256)
+    if blob is None:
+        try:
+            with session.begin_nested():
+                blob = Blob(sha256=sha256, size=size, ref_count=0)
+                session.add(blob)
+        except IntegrityError:
+            # Another worker registered the same content concurrently
+            blob = get_record(session, Blob, sha256=sha256)
+    session.execute(update(Blob).where(Blob.id == blob.id).values(ref_count=Blob.ref_count + 1))
+    session.commit()
+    session.refresh(blob)
+    return blob
+
+# Function to delete a TempFile and release its stored file
+@timed_query
+def db_delete_tempfile(session, db_file):
+    """
+    Delete a TempFile record and release its blob (or legacy file).
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - db_file: The TempFile record.
+
+    Returns:
+    - True if the deletion is successful, False otherwise.
+    """
+    try:
+        release_tempfile(session, db_file)
+        session.delete(db_file)
+        session.commit()
+        return True
+    except SQLAlchemyError as error:
+        print("error", error)
+        session.rollback()
+    return False
+
+# Function to delete a job and release the files of its CVs
+@timed_query
+def db_delete_job(session, job_id):
+    """
+    Delete a job, its summaries and files, releasing the blobs they reference.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - job_id: The ID of the job.
+
+    Returns:
+    - True if the deletion is successful, False otherwise.
+    """
+    try:
+        db_files = (
+            session.query(TempFile)
+            .outerjoin(Summary, TempFile.summary_id == Summary.id)
+            .filter(or_(TempFile.form_id == job_id, Summary.form_id == job_id))
+            .all()
+        )
+        for db_file in db_files:
+            release_tempfile(session, db_file)
+        # Bulk delete, the database cascades to questions, summaries and files
+        deleted = session.query(Form).filter(Form.id == job_id).delete(synchronize_session=False)
+        session.commit()
+        return deleted > 0
+    except SQLAlchemyError as error:
+        print("error", error)
+        session.rollback()
+    return False
+
+# Function to delete a user with their jobs, releasing the blobs of their files
+@timed_query
+def db_delete_user(session, user_id):
+    """
+    Delete a user, their jobs, summaries and files, releasing the blobs they reference.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - user_id: The ID of the user_account.
+
+    Returns:
+    - True if the deletion is successful, False otherwise.
+    """
+    try:
+        db_files = (
+            session.query(TempFile)
+            .outerjoin(Summary, TempFile.summary_id == Summary.id)
+            .join(Form, Form.id == func.coalesce(TempFile.form_id, Summary.form_id))
+            .filter(Form.user_account_id == user_id)
+            .all()
+        )
+        for db_file in db_files:
+            release_tempfile(session, db_file)
+        # Bulk delete, the database cascades to jobs, questions, summaries and files
+        deleted = session.query(UserAccount).filter(UserAccount.id == user_id).delete(synchronize_session=False)
+        session.commit()
+        return deleted > 0
+    except SQLAlchemyError as error:
+        print("error", error)
+        session.rollback()
+    return False
+
+# Counters kept by LLMUsage, in the order they are reported
+LLM_USAGE_COUNTERS = (
+    "calls", "failures", "prompt_tokens", "completion_tokens",
+    "cached_tokens", "latency_seconds", "cost"
+)
+
+# Function to record an OpenAI call and add it to the usage totals
+@timed_query
+def db_record_llm_call(session, usage, kind, status, user_id=None, job_id=None, temp_file_id=None, summary_id=None, attempt=1):
+    """
+    Store an OpenAI call and add it to the LLMUsage totals of its user and job.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - usage: The usage dict returned by the prompt functions.
+    - kind: The kind of call, e.g. "summarize_cv" or "formulate_questions".
+    - status: SUCCESS, FAILED or INVALID_JSON.
+    - user_id: The user the call was made for.
+    - job_id: The job the call was made for, if any.
+    - temp_file_id: The CV the call was made for, if any.
+    - summary_id: The summary stored from the answer, if any.
+    - attempt: The attempt number of the call for the same CV or job.
+
+    Returns:
+    - The LLMCall record.
+    """
+    call = LLMCall(
+        kind=kind, status=status, attempt=attempt,
+        model=usage.get("model"),
+        prompt_tokens=usage.get("prompt_tokens", 0),
+        completion_tokens=usage.get("completion_tokens", 0),
+        cached_tokens=usage.get("cached_tokens", 0),
+        latency_seconds=usage.get("latency_seconds", 0.0),
+        retries=usage.get("retries", 0),
+        cost=usage.get("cost"),
+        error=usage.get("error"),
+        user_account_id=user_id, form_id=job_id,
+        temp_file_id=temp_file_id, summary_id=summary_id
+    )
+    session.add(call)
+    observe_llm_call(kind, status, usage)
+
+    increments = {
+        "calls": LLMUsage.calls + 1,
+        "failures": LLMUsage.failures + (0 if status == "SUCCESS" else 1),
+        "prompt_tokens": LLMUsage.prompt_tokens + call.prompt_tokens,
+        "completion_tokens": LLMUsage.completion_tokens + call.completion_tokens,
+        "cached_tokens": LLMUsage.cached_tokens + call.cached_tokens,
+        "latency_seconds": LLMUsage.latency_seconds + call.latency_seconds,
+        "cost": LLMUsage.cost + (call.cost or 0),
+        "updated_at": datetime.utcnow()
+    }
+    # Atomic increment of the existing totals row, created on the first call.
+    # Two workers may both create it, the rollups sum rows so that stays correct.
+    updated = session.execute(
+        update(LLMUsage)
+        .where(LLMUsage.user_account_id == user_id)
+        .where(LLMUsage.form_id == job_id if job_id is not None else LLMUsage.form_id.is_(None))
+        .values(**increments)
+    ).rowcount
+    if not updated:
+        session.add(LLMUsage(
+            user_account_id=user_id, form_id=job_id, calls=1,
+            failures=0 if status == "SUCCESS" else 1,
+            prompt_tokens=call.prompt_tokens, completion_tokens=call.completion_tokens,
+            cached_tokens=call.cached_tokens, latency_seconds=call.latency_seconds,
+            cost=call.cost or 0
+        ))
+    session.commit()
+    return call
+
+# Function to read LLM usage totals
+@timed_query
+def db_get_llm_usage(session, user_id=None, job_id=None, group_by="user"):
+    """
+    Read LLM usage totals from the LLMUsage rollup table.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - user_id: Only count the calls of this user.
+    - job_id: Only count the calls of this job.
+    - group_by: "user" for one row per user, "job" for one row per job, None for a single total.
+
+    Returns:
+    - A list of dictionaries with calls, failures, prompt_tokens, completion_tokens,
+      cached_tokens, latency_seconds, cost and the grouping keys.
+    """
+    keys = {"user": [LLMUsage.user_account_id], "job": [LLMUsage.user_account_id, LLMUsage.form_id], None: []}[group_by]
+    names = {"user_account_id": "user_id", "form_id": "job_id"}
+    query = session.query(*keys, *[func.coalesce(func.sum(getattr(LLMUsage, counter)), 0) for counter in LLM_USAGE_COUNTERS])
+    if user_id is not None:
+        query = query.filter(LLMUsage.user_account_id == user_id)
+    if job_id is not None:
+        query = query.filter(LLMUsage.form_id == job_id)
+    if keys:
+        query = query.group_by(*keys).order_by(*keys)
+    columns = [names[key.key] for key in keys] + list(LLM_USAGE_COUNTERS)
+    return [dict(zip(columns, row)) for row in query]
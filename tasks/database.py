@@ -1,17 +1,181 @@
 from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+from celery.signals import worker_init, worker_process_init
 from models import mapper_registry
+from metrics import DB_POOL_WAIT, DB_POOL_CHECKED_OUT
+import search  # Registers the full-text index DDL run by create_all
+import os, time, threading
+
+"""
+
+    Engine Environment Variables:
+
+    - DATABASE_URI: Database URL (default: the docker-compose Postgres service)
+    - DB_POOL_SIZE: Persistent connections per process (default: worker concurrency per process)
+    - DB_MAX_OVERFLOW: Extra connections allowed under burst (default: 2)
+    - DB_POOL_TIMEOUT: Seconds to wait for a free connection (default: 30)
+    - DB_POOL_RECYCLE: Seconds before a connection is replaced, -1 to disable (default: 1800)
+    - DB_POOL_PRE_PING: Test connections on checkout, "true" or "false" (default: true)
+
+"""
 
 # DB_URL="sqlite:///cv_scan_db.sqlite"
-DB_URL="postgresql://user:pass123@db/cv_scan_db"
-engine = create_engine(DB_URL)
+DB_URL = os.environ.get("DATABASE_URI") or "postgresql+psycopg2://user:pass123@db/cv_scan_db"
+
+# Class collecting connection pool usage of the current process
+class PoolMetrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.checkouts = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+
+    def record_checkout(self, wait_seconds):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+pool_metrics = PoolMetrics()
+
+# Connection pool measuring how long each checkout waits for a connection
+class InstrumentedQueuePool(QueuePool):
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            wait_seconds = time.perf_counter() - start
+            pool_metrics.record_checkout(wait_seconds)
+            DB_POOL_WAIT.observe(wait_seconds)
+
+# Function to get the default pool size for the current process
+def default_pool_size():
+    """
+    Get a pool size matching the number of tasks a worker process runs at once.
+
+    Prefork children run one task at a time and only need one connection, thread
+    or greenlet pools run CELERY_CONCURRENCY tasks in the same process.
+
+    Returns:
+    - int: The pool size.
+    """
+    if os.environ.get("DB_POOL_SIZE"):
+        return int(os.environ["DB_POOL_SIZE"])
+    if os.environ.get("CELERY_POOL", "prefork") in ("threads", "gevent", "eventlet"):
+        return int(os.environ.get("CELERY_CONCURRENCY") or os.cpu_count() or 1)
+    return 1
+
+# Function to create an engine configured from the environment
+def create_db_engine(url=None, **kwargs):
+    """
+    Create a SQLAlchemy engine with pool settings read from the environment.
+
+    Parameters:
+    - url: The database URL (default: DB_URL).
+    - **kwargs: Extra create_engine arguments overriding the environment.
+
+    Returns:
+    - The SQLAlchemy engine.
+    """
+    url = url or DB_URL
+    options = {}
+    if url.startswith("sqlite"):
+        # SQLite connections are local files, pool tuning does not apply
+        def set_sqlite_pragma(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.close()
+    else:
+        set_sqlite_pragma = None
+        options = {
+            "poolclass": InstrumentedQueuePool,
+            "pool_size": default_pool_size(),
+            "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 2)),
+            "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+            "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+            "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true",
+        }
+    options.update(kwargs)
+    db_engine = create_engine(url, **options)
+    if set_sqlite_pragma:
+        event.listen(db_engine, "connect", set_sqlite_pragma)
+    event.listen(db_engine, "checkout", lambda *args: DB_POOL_CHECKED_OUT.inc())
+    event.listen(db_engine, "checkin", lambda *args: DB_POOL_CHECKED_OUT.dec())
+    return db_engine
+
+# Function to report the connection pool state of the current process
+def pool_stats(db_engine=None):
+    """
+    Report the connection pool state and checkout wait times of the current process.
+
+    Parameters:
+    - db_engine: The engine to inspect (default: the module engine).
+
+    Returns:
+    - dict: Pool size, connections checked in/out, overflow and checkout wait times.
+    """
+    pool = (db_engine or engine).pool
+    stats = {"pool": type(pool).__name__, "pid": os.getpid()}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        })
+    with pool_metrics.lock:
+        stats.update({
+            "checkouts": pool_metrics.checkouts,
+            "checkout_wait_seconds_total": pool_metrics.wait_seconds_total,
+            "checkout_wait_seconds_max": pool_metrics.wait_seconds_max,
+        })
+    return stats
+
+engine = create_db_engine()
+
+# Function to create the database tables
+def init_db(db_engine=None):
+    """
+    Create the missing database tables.
+
+    Called once when a worker starts or by register_and_configure.py, instead
+    of on every import of this module.
+
+    Parameters:
+    - db_engine: The engine to use (default: the module engine).
+    """
+    mapper_registry.metadata.create_all(db_engine or engine)
+
+# Function to open the connection pool ahead of the first task
+def prewarm_db(db_engine=None):
+    """
+    Open the pooled connections of the current process so the first task does
+    not pay for the connection handshake.
 
-# Define the event listener function
-# def set_sqlite_pragma(dbapi_connection, connection_record):
-#   cursor = dbapi_connection.cursor()
-#   cursor.execute("PRAGMA foreign_keys=ON")
-#   cursor.close()
+    Parameters:
+    - db_engine: The engine to warm up (default: the module engine).
+    """
+    db_engine = db_engine or engine
+    size = db_engine.pool.size() if isinstance(db_engine.pool, QueuePool) else 1
+    connections = [db_engine.connect() for _ in range(size)]
+    for connection in connections:
+        connection.close()
 
-engine = create_engine(url=DB_URL)
-# event.listen(engine, "connect", set_sqlite_pragma)
+# Create the schema once in the main worker process, before the children are forked
+@worker_init.connect
+def init_db_on_worker_start(**kwargs):
+    init_db()
 
-mapper_registry.metadata.create_all(engine)
\ No newline at end of file
+# Celery prefork children inherit the parent's pool, drop those connections
+# without closing them so the parent's sockets are left untouched
+@worker_process_init.connect
+def dispose_engine_after_fork(**kwargs):
+    engine.dispose(close=False)
+    pool_metrics.reset()
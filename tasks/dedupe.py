@@ -0,0 +1,96 @@
+# Importing necessary modules for near-duplicate CV detection
+import os, re, random, struct, hashlib
+
+"""
+
+    Near-Duplicate CVs:
+
+    Candidates apply several times or upload slightly edited CVs. Each CV
+    gets a MinHash signature of its text when it is extracted: for every one
+    of NUM_PERM hash functions, the smallest hash of its 5-word shingles. The
+    share of equal values in two signatures estimates the Jaccard similarity
+    of their shingle sets.
+
+    Signatures are split in BANDS bands of NUM_PERM / BANDS values, and the
+    hash of every band is stored in the indexed fingerprint_band table when
+    the fingerprint is written. Before a CV is summarized, only the CVs of
+    the same user sharing one of its band keys are loaded and compared, so
+    a batch upload does not rebuild an index of every fingerprint per CV. A CV at least DEDUPE_THRESHOLD
+    similar to one already summarized for the same job reuses its summary
+    instead of calling the model. Near-duplicates from other jobs are only
+    flagged, their summary answers other questions.
+
+    Environment Variables:
+
+    - DEDUPE_MODE: "reuse" (default), "flag" to summarize duplicates anyway, or "off"
+    - DEDUPE_THRESHOLD: Estimated Jaccard similarity from which CVs are duplicates (default: 0.9)
+
+"""
+
+DEDUPE_MODE = os.environ.get("DEDUPE_MODE", "reuse").lower()
+DEDUPE_THRESHOLD = float(os.environ.get("DEDUPE_THRESHOLD", 0.9))
+
+NUM_PERM = 64
+BANDS = 16
+SHINGLE_WORDS = 5
+
+# Hash functions (a * x + b) mod a Mersenne prime, fixed so stored signatures stay comparable
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240101)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+# Function to get the hashed word shingles of a text
+def shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_WORDS:
+        words = words + [""] * (SHINGLE_WORDS - len(words)) if words else []
+    return {
+        int.from_bytes(hashlib.blake2b(" ".join(words[index:index + SHINGLE_WORDS]).encode("utf-8"), digest_size=8).digest(), "big")
+        for index in range(max(0, len(words) - SHINGLE_WORDS + 1))
+    }
+
+# Function to compute the MinHash signature of a text
+def minhash(text):
+    """
+    Compute the MinHash signature of a text.
+
+    Parameters:
+    - text: The CV text.
+
+    Returns:
+    - tuple: NUM_PERM integers, or None if the text has no words.
+    """
+    hashes = shingles(text or "")
+    if not hashes:
+        return None
+    return tuple(min((a * value + b) % _PRIME for value in hashes) for a, b in _PERMUTATIONS)
+
+# Function to store a signature in a binary column
+def pack_signature(signature):
+    return struct.pack(f">{NUM_PERM}Q", *signature) if signature else None
+
+# Function to read a signature stored by pack_signature
+def unpack_signature(data):
+    return struct.unpack(f">{NUM_PERM}Q", data) if data and len(data) == NUM_PERM * 8 else None
+
+# Function to estimate the Jaccard similarity of two signatures
+def similarity(first, second):
+    return sum(1 for a, b in zip(first, second) if a == b) / NUM_PERM
+
+# Function to get the LSH band keys of a signature
+def band_keys(signature, bands=BANDS):
+    """
+    Hash every band of a signature.
+
+    Parameters:
+    - signature: The MinHash signature.
+    - bands: The number of bands.
+
+    Returns:
+    - list: (band, key) tuples, the key being a signed 64-bit hash of the band values.
+    """
+    rows = NUM_PERM // bands
+    return [
+        (band, struct.unpack(">q", hashlib.blake2b(struct.pack(f">{rows}Q", *signature[band * rows:(band + 1) * rows]), digest_size=8).digest())[0])
+        for band in range(bands)
+    ]
@@ -0,0 +1,155 @@
+# Importing necessary modules for writing candidate exports
+from itertools import islice
+from scores import is_rating_question, parse_score
+import csv
+
+"""
+
+    Export Formats:
+
+    1. csv     - Plain CSV, one row per candidate
+    2. parquet - Apache Parquet, for analytics and BI tools
+    3. arrow   - Arrow IPC file, for analytics and BI tools
+    4. xlsx    - Excel workbook written in constant-memory mode
+
+    Every writer receives the question list once and an iterator of
+    (summary_id, answers) tuples, so the candidate x question table is
+    produced in a single pass without holding it in memory.
+
+    The columnar formats store the answers of 1-10 rating questions as float
+    columns holding the parsed rating (see scores.py), null when an answer
+    has none. Other answers are stored as strings.
+
+"""
+
+# Number of candidates buffered per record batch for the columnar formats
+BATCH_SIZE = 500
+
+# Function to align a list of answers with the question columns
+def align_row(values, width):
+    """
+    Pad or trim a list of answers so it lines up with the header.
+
+    Parameters:
+    - values: The answers of one candidate.
+    - width: The number of question columns.
+
+    Returns:
+    - A list of exactly width answers.
+    """
+    return (list(values) + [""] * width)[:width]
+
+# Function to write candidates to a CSV file
+def write_csv(filepath, questions, rows):
+    """
+    Write the candidate x question table to a CSV file.
+
+    Parameters:
+    - filepath: The destination path.
+    - questions: The question texts used as the header.
+    - rows: An iterator of (summary_id, answers) tuples.
+    """
+    with open(filepath, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(questions)
+        for _, values in rows:
+            writer.writerow(align_row(values, len(questions)))
+
+# Function to convert a batch of rows into an Arrow record batch
+def _record_batch(schema, questions, batch):
+    import pyarrow as pa
+    columns = [pa.array([summary_id for summary_id, _ in batch], type=pa.int64())]
+    aligned = [align_row(values, len(questions)) for _, values in batch]
+    for index in range(len(questions)):
+        column = [values[index] for values in aligned]
+        if schema.field(index + 1).type == pa.float64():
+            column = [parse_score(value) for value in column]
+        columns.append(pa.array(column, type=schema.field(index + 1).type))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+# Function to build the Arrow schema of the candidate table
+def _schema(questions):
+    import pyarrow as pa
+    fields = [pa.field("summary_id", pa.int64(), nullable=False)]
+    # Questions are free text and may repeat, so the column names are made unique
+    seen = {}
+    for question in questions:
+        seen[question] = seen.get(question, 0) + 1
+        name = question if seen[question] == 1 else f"{question} ({seen[question]})"
+        fields.append(pa.field(name, pa.float64() if is_rating_question(question) else pa.string()))
+    return pa.schema(fields)
+
+# Function to iterate over rows in fixed-size batches
+def _batches(rows, size=BATCH_SIZE):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+# Function to write candidates to a Parquet file
+def write_parquet(filepath, questions, rows):
+    """
+    Write the candidate x question table to a Parquet file, one row group per batch.
+
+    Parameters:
+    - filepath: The destination path.
+    - questions: The question texts used as column names.
+    - rows: An iterator of (summary_id, answers) tuples.
+    """
+    import pyarrow.parquet as pq
+    schema = _schema(questions)
+    with pq.ParquetWriter(filepath, schema, compression="zstd") as writer:
+        for batch in _batches(rows):
+            writer.write_batch(_record_batch(schema, questions, batch))
+
+# Function to write candidates to an Arrow IPC file
+def write_arrow(filepath, questions, rows):
+    """
+    Write the candidate x question table to an Arrow IPC file.
+
+    Parameters:
+    - filepath: The destination path.
+    - questions: The question texts used as column names.
+    - rows: An iterator of (summary_id, answers) tuples.
+    """
+    import pyarrow as pa
+    schema = _schema(questions)
+    with pa.OSFile(filepath, "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for batch in _batches(rows):
+                writer.write_batch(_record_batch(schema, questions, batch))
+
+# Function to write candidates to an Excel workbook
+def write_xlsx(filepath, questions, rows):
+    """
+    Write the candidate x question table to an XLSX workbook.
+
+    The workbook is written in constant-memory mode, each row is flushed to disk
+    as soon as the next one starts. Numeric answers such as ratings are stored
+    as numbers so they can be sorted and filtered in the spreadsheet.
+
+    Parameters:
+    - filepath: The destination path.
+    - questions: The question texts used as the header.
+    - rows: An iterator of (summary_id, answers) tuples.
+    """
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(filepath, {"constant_memory": True, "strings_to_numbers": True})
+    try:
+        worksheet = workbook.add_worksheet("Candidates")
+        header = workbook.add_format({"bold": True, "text_wrap": True})
+        worksheet.write_row(0, 0, questions, header)
+        for row_index, (_, values) in enumerate(rows, start=1):
+            worksheet.write_row(row_index, 0, align_row(values, len(questions)))
+    finally:
+        workbook.close()
+
+# Mapping of export formats to their writer and file extension
+EXPORT_FORMATS = {
+    "csv": (write_csv, ".csv"),
+    "parquet": (write_parquet, ".parquet"),
+    "arrow": (write_arrow, ".arrow"),
+    "xlsx": (write_xlsx, ".xlsx"),
+}
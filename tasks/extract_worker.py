@@ -0,0 +1,48 @@
+# Importing necessary modules and components for the text extraction worker
+from sqlalchemy.orm import Session
+from celery import Celery
+from celery.signals import worker_process_init
+from database import engine, prewarm_db
+import os
+from crud import *
+import metrics  # Registers the task runtime and queue wait signal handlers
+import tracing  # Registers the trace propagation signal handlers
+from results import configure_results
+
+# Defining the base directory for file operations
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# Configuring Celery for background task execution
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+
+celery = Celery(
+    "tasks",
+    broker=CELERY_BROKER_URL,
+    backend=CELERY_RESULT_BACKEND
+)
+configure_results(celery)
+
+# Function to get the worker process ready before its first task
+def prewarm():
+    """Open the database pool and load the PDF/DOCX parsers before the first task."""
+    prewarm_db()
+    import PyPDF2, docx2txt
+
+@worker_process_init.connect
+def prewarm_worker_process(**kwargs):
+    try:
+        prewarm()
+    except Exception as error:
+        print(f"Failed to prewarm worker: {error}")
+
+# Task for extracting the text of an uploaded file as soon as its upload completes
+@celery.task(name="tasks.extract_file")
+def extract_file(tempfile_id):
+    with Session(engine) as session:
+        db_file = get_record(session, TempFile, id=tempfile_id)
+        if db_file is None:
+            return False
+        if db_file.text is not None:
+            return True
+        return db_extract_file(session, db_file) is not None
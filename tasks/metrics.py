@@ -0,0 +1,180 @@
+# Importing necessary modules for Prometheus metrics
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+from celery.signals import before_task_publish, task_prerun, task_postrun, worker_process_shutdown
+from functools import wraps
+from contextlib import contextmanager
+import os, sys, time
+
+"""
+
+    Worker Metrics:
+
+    The Celery workers run several processes (prefork children, several
+    supervisord programs), so metrics are written with the prometheus_client
+    multiprocess mode to files in PROMETHEUS_MULTIPROC_DIR. A separate
+    exporter process serves the sum of all of them:
+
+        python metrics.py [port]    (default port: METRICS_PORT or 9808)
+
+    The exporter also reports the number of messages waiting in each lane
+    at scrape time. Without PROMETHEUS_MULTIPROC_DIR the metrics are kept in
+    memory and only visible in the process that records them.
+
+    Metrics:
+
+    - celery_task_runtime_seconds{task, state}: Task run time
+    - celery_task_queue_wait_seconds{task, queue}: Time between publishing and start
+    - celery_tasks_total{task, state}: Finished tasks
+    - db_query_seconds{query}: Run time of crud.py functions
+    - db_pool_checkout_wait_seconds: Time spent waiting for a pooled connection
+    - db_pool_checked_out: Connections in use
+    - extract_seconds{extension, outcome}: Text extraction time per CV
+    - llm_call_seconds{kind, model, status}: OpenAI request latency
+    - llm_tokens_total{kind, model, type}: Prompt, completion and cached tokens
+    - llm_cost_usd_total{kind, model}: Estimated OpenAI cost
+    - cv_duplicates_total{action}: Near-duplicate CVs, "reused" or "flagged"
+    - celery_queue_depth{lane, queue}: Messages waiting in each lane (exporter only)
+
+"""
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+# Buckets in seconds, from fast DB lookups to multi-minute OpenAI calls and exports
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+TASK_RUNTIME = Histogram("celery_task_runtime_seconds", "Celery task run time", ["task", "state"], buckets=SLOW_BUCKETS)
+TASK_QUEUE_WAIT = Histogram("celery_task_queue_wait_seconds", "Time a task waited in its queue before starting", ["task", "queue"], buckets=SLOW_BUCKETS)
+TASKS = Counter("celery_tasks", "Finished Celery tasks", ["task", "state"])
+DB_QUERY = Histogram("db_query_seconds", "Run time of database functions", ["query"], buckets=FAST_BUCKETS)
+DB_POOL_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled database connection", buckets=FAST_BUCKETS)
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Database connections in use", multiprocess_mode="livesum")
+EXTRACT = Histogram("extract_seconds", "Text extraction time per CV", ["extension", "outcome"], buckets=SLOW_BUCKETS)
+LLM_CALL = Histogram("llm_call_seconds", "OpenAI request latency", ["kind", "model", "status"], buckets=SLOW_BUCKETS)
+LLM_TOKENS = Counter("llm_tokens", "OpenAI tokens", ["kind", "model", "type"])
+LLM_COST = Counter("llm_cost_usd", "Estimated OpenAI cost in USD", ["kind", "model"])
+DUPLICATES = Counter("cv_duplicates", "Near-duplicate CVs found before summarizing", ["action"])
+QUESTION_CACHE = Counter("question_cache_lookups", "Generated questions cache lookups", ["result"])
+
+# Decorator timing a database function with DB_QUERY
+def timed_query(function):
+    histogram = DB_QUERY.labels(function.__name__)
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    return wrapper
+
+# Context manager timing text extraction, the outcome is set by the caller
+@contextmanager
+def timed_extract(extension):
+    outcome = {"value": "error"}
+    start = time.perf_counter()
+    try:
+        yield outcome
+    finally:
+        EXTRACT.labels(extension or "none", outcome["value"]).observe(time.perf_counter() - start)
+
+# Function to record the usage of an OpenAI call
+def observe_llm_call(kind, status, usage):
+    model = usage.get("model") or "unknown"
+    LLM_CALL.labels(kind, model, status).observe(usage.get("latency_seconds", 0.0))
+    for token_type in ("prompt", "completion", "cached"):
+        LLM_TOKENS.labels(kind, model, token_type).inc(usage.get(f"{token_type}_tokens", 0))
+    if usage.get("cost"):
+        LLM_COST.labels(kind, model).inc(usage["cost"])
+
+# Add the publish time to every task message so workers can measure the queue wait
+@before_task_publish.connect
+def add_sent_at_header(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault("sent_at", time.time())
+
+@task_prerun.connect
+def start_task_timer(task=None, **kwargs):
+    task.request._metrics_start = time.perf_counter()
+    sent_at = getattr(task.request, "sent_at", None)
+    if sent_at:
+        queue = (task.request.delivery_info or {}).get("routing_key") or "unknown"
+        TASK_QUEUE_WAIT.labels(task.name, queue).observe(max(0.0, time.time() - float(sent_at)))
+
+@task_postrun.connect
+def stop_task_timer(task=None, state=None, **kwargs):
+    start = getattr(task.request, "_metrics_start", None)
+    state = state or "UNKNOWN"
+    if start is not None:
+        TASK_RUNTIME.labels(task.name, state).observe(time.perf_counter() - start)
+    TASKS.labels(task.name, state).inc()
+
+# Live gauges of a stopped prefork child must not be summed any more
+@worker_process_shutdown.connect
+def mark_worker_process_dead(pid=None, **kwargs):
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+# Collector reporting the lane queue depths at scrape time
+class QueueDepthCollector:
+
+    def __init__(self, celery_app):
+        self.celery_app = celery_app
+
+    def collect(self):
+        from routing import queue_depths
+        gauge = GaugeMetricFamily("celery_queue_depth", "Messages waiting in each lane", labels=["lane", "queue"])
+        try:
+            for lane, depth in queue_depths(self.celery_app).items():
+                gauge.add_metric([lane, depth["queue"]], depth["depth"])
+        except Exception as error:
+            print(f"Failed to read queue depths: {error}")
+        yield gauge
+
+# Function to remove the metric files of processes that no longer exist
+def remove_stale_files(directory):
+    """
+    Remove multiprocess metric files left by processes of a previous run.
+
+    Files are named after the process ID that wrote them, e.g. counter_1234.db.
+    """
+    for filename in os.listdir(directory):
+        pid = filename.rsplit("_", 1)[-1].split(".")[0]
+        if not pid.isdigit():
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            os.remove(os.path.join(directory, filename))
+        except PermissionError:
+            pass
+
+# Function to serve the metrics of every worker process
+def serve(port):
+    """
+    Serve the summed metrics of all worker processes over HTTP.
+
+    Parameters:
+    - port: The HTTP port.
+    """
+    from celery import Celery
+    from prometheus_client import multiprocess
+    registry = CollectorRegistry()
+    if MULTIPROC_DIR:
+        remove_stale_files(MULTIPROC_DIR)
+        multiprocess.MultiProcessCollector(registry)
+    registry.register(QueueDepthCollector(
+        Celery("tasks", broker=os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+    ))
+    start_http_server(port, registry=registry)
+    print(f"Serving worker metrics on port {port}")
+    while True:
+        time.sleep(3600)
+
+if __name__ == "__main__":
+    serve(int(sys.argv[1]) if len(sys.argv) > 1 else int(os.environ.get("METRICS_PORT", 9808)))
@@ -1,10 +1,14 @@
 # Importing necessary modules from SQLAlchemy and other dependencies
 from sqlalchemy.orm import relationship
 from sqlalchemy import (
-    DateTime, Column, Integer, Text, ForeignKey, String, event
+    DateTime, Column, Integer, Text, ForeignKey, String, Float, Index, LargeBinary, event,
+    select, update, delete
 )
-from sqlalchemy.orm import registry
+from sqlalchemy.orm import registry, Session, object_session
+from sqlalchemy import inspect, insert, BigInteger
 from prompt import formulate_questions_prompt_default, summarize_cv_prompt_default
+from blobstore import remove_blob
+from dedupe import band_keys, unpack_signature
 from datetime import datetime
 import os
 
@@ -22,9 +26,14 @@ mapper_registry = registry()
     2. UserAccount
     3. Form
     4. TempFile
-    5. Question
-    6. Summary
-    7. SummaryItem
+    5. Blob
+    6. Question
+    7. Summary
+    8. SummaryItem
+    9. SummaryScore
+    10. LLMCall
+    11. LLMUsage
+    12. QuestionCache
 
 """
 
@@ -104,6 +113,36 @@ class TempFile:
     form = relationship("Form", back_populates="tempfiles")
     summary_id = Column(Integer, ForeignKey("summary.id", ondelete="CASCADE"))
     summary = relationship("Summary", back_populates="tempfiles")
+    text = Column(Text)  # Compacted text extracted when the upload completes
+    extracted_at = Column(DateTime)
+    fingerprint = Column(LargeBinary)  # MinHash signature of the text, see dedupe.py
+    duplicate_of_id = Column(Integer, ForeignKey("temp_file.id", ondelete="SET NULL"))  # Near-duplicate CV found before summarizing
+    blob_id = Column(Integer, ForeignKey("blob.id"))
+    blob = relationship("Blob")
+
+# Defining the FingerprintBand table, the LSH band keys of the CV fingerprints, see dedupe.py
+@mapper_registry.mapped
+class FingerprintBand:
+    __tablename__ = "fingerprint_band"
+    id = Column(Integer, primary_key=True)
+    temp_file_id = Column(Integer, ForeignKey("temp_file.id", ondelete="CASCADE"), nullable=False, index=True)
+    band = Column(Integer, nullable=False)
+    key = Column(BigInteger, nullable=False)
+
+    __table_args__ = (
+        # Finding the CVs sharing a band with a fingerprint
+        Index("ix_fingerprint_band_band_key", "band", "key"),
+    )
+
+# Defining the Blob table, one row per distinct uploaded file content
+@mapper_registry.mapped
+class Blob:
+    __tablename__ = "blob"
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(String(64), unique=True, nullable=False)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)  # Number of TempFile rows using the blob
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 # Defining the Question table
 @mapper_registry.mapped
@@ -141,17 +180,181 @@ class SummaryItem:
     id = Column(Integer, primary_key=True)
     summary_id = Column(Integer, ForeignKey("summary.id", ondelete="CASCADE"))
     summary = relationship('Summary', back_populates='summary_items')
+    question_id = Column(Integer, ForeignKey("question.id", ondelete="SET NULL"))  # The question answered, None if it was deleted
     title = Column(Text)
     description = Column(Text)
 
-# Event Hook Before Deleting a TempFile Instance
+# Defining the SummaryScore table, the parsed answers of 1-10 rating questions, see scores.py
+@mapper_registry.mapped
+class SummaryScore:
+    __tablename__ = "summary_score"
+    id = Column(Integer, primary_key=True)
+    form_id = Column(Integer, ForeignKey("form.id", ondelete="CASCADE"), nullable=False)
+    question_id = Column(Integer, ForeignKey("question.id", ondelete="CASCADE"), nullable=False)
+    summary_id = Column(Integer, ForeignKey("summary.id", ondelete="CASCADE"), nullable=False)
+    score = Column(Float, nullable=False)
+
+    __table_args__ = (
+        # Sorting and filtering the candidates of a job by the score of one question
+        Index("ix_summary_score_form_id_question_id_score", "form_id", "question_id", "score"),
+        Index("ix_summary_score_summary_id_question_id", "summary_id", "question_id", unique=True),
+    )
+
+# Defining the LLMCall table, one row per OpenAI request
+@mapper_registry.mapped
+class LLMCall:
+    __tablename__ = "llm_call"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(40), nullable=False)  # summarize_cv, resummarize_cv or formulate_questions
+    model = Column(String(60))
+    status = Column(String(20), nullable=False)  # SUCCESS, FAILED or INVALID_JSON
+    attempt = Column(Integer, nullable=False, default=1)  # 1 for the first try, 2+ when the answer was retried
+    retries = Column(Integer, nullable=False, default=0)  # Retries made by the OpenAI client on connection errors or rate limits
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    cached_tokens = Column(Integer, nullable=False, default=0)
+    latency_seconds = Column(Float, nullable=False, default=0)
+    cost = Column(Float)  # Estimated USD cost, None for models without a known price
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Calls are kept for accounting when their job, CV or summary is deleted
+    user_account_id = Column(Integer, ForeignKey("user_account.id", ondelete="SET NULL"))
+    form_id = Column(Integer, ForeignKey("form.id", ondelete="SET NULL"))
+    temp_file_id = Column(Integer, ForeignKey("temp_file.id", ondelete="SET NULL"))
+    summary_id = Column(Integer, ForeignKey("summary.id", ondelete="SET NULL"))
+
+    __table_args__ = (
+        Index("ix_llm_call_form_id", "form_id"),
+        Index("ix_llm_call_user_account_id_created_at", "user_account_id", "created_at"),
+    )
+
+# Defining the LLMUsage table, running totals of LLMCall rows per user and job
+@mapper_registry.mapped
+class LLMUsage:
+    __tablename__ = "llm_usage"
+    id = Column(Integer, primary_key=True)
+    user_account_id = Column(Integer, ForeignKey("user_account.id", ondelete="CASCADE"), index=True)
+    form_id = Column(Integer, ForeignKey("form.id", ondelete="SET NULL"), index=True)  # None for calls outside a job
+    calls = Column(Integer, nullable=False, default=0)
+    failures = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    cached_tokens = Column(Integer, nullable=False, default=0)
+    latency_seconds = Column(Float, nullable=False, default=0)
+    cost = Column(Float, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+# Defining the QuestionCache table, generated questions reused for identical job descriptions, see question_cache.py
+@mapper_registry.mapped
+class QuestionCache:
+    __tablename__ = "question_cache"
+    id = Column(Integer, primary_key=True)
+    key = Column(String(64), unique=True, nullable=False)  # SHA-256 of the normalized model, prompt and job description
+    model = Column(String(60))
+    questions = Column(Text, nullable=False)  # The model answer, as returned by formulate_questions
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+# Session key of the blobs and files to remove once the transaction releasing them commits
+PENDING_REMOVALS = "pending_removals"
+
+# Function to remove a file once the current transaction commits
+def remove_after_commit(session, remove, *args):
+    """
+    Schedule the removal of stored content for after the next commit.
+
+    Deleting files or S3 objects cannot be rolled back, so they are only
+    removed once the rows referencing them are gone for good. A rollback
+    drops the scheduled removals.
+
+    Parameters:
+    - session: The SQLAlchemy session of the current transaction.
+    - remove: The function removing the content, called with args.
+    """
+    session.info.setdefault(PENDING_REMOVALS, []).append((remove, args))
+
+# Function to remove a legacy flat file
+def remove_file(filepath):
+    try:
+        os.remove(filepath)
+        print(f"[TempFile DELETE SUCCESS]: {filepath}")
+    except Exception as err:
+        print(f"[TempFile '{filepath}' DELETE ERROR]: {err}")
+
+# Remove the content released by a transaction once it is committed
+@event.listens_for(Session, "after_commit")
+def remove_released_content(session):
+    for remove, args in session.info.pop(PENDING_REMOVALS, []):
+        try:
+            remove(*args)
+        except Exception as err:
+            print(f"[Released content DELETE ERROR]: {err}")
+
+# Keep the content of a transaction rolled back, its rows still reference it
+@event.listens_for(Session, "after_soft_rollback")
+def keep_released_content(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop(PENDING_REMOVALS, None)
+
+# Function to release a TempFile reference to a Blob
+def release_blob(session, blob_id):
+    """
+    Decrement the reference count of a blob and remove it once it is unused.
+
+    Parameters:
+    - session: The SQLAlchemy session of the current transaction, the blob
+      content is removed after it commits.
+    - blob_id: The ID of the blob.
+
+    Returns:
+    - The remaining reference count, None if the blob does not exist.
+    """
+    connection = session.connection()
+    connection.execute(update(Blob).where(Blob.id == blob_id).values(ref_count=Blob.ref_count - 1))
+    blob = connection.execute(select(Blob.sha256, Blob.ref_count).where(Blob.id == blob_id)).first()
+    if blob is None:
+        return None
+    if blob.ref_count <= 0:
+        connection.execute(update(TempFile).where(TempFile.blob_id == blob_id).values(blob_id=None))
+        connection.execute(delete(Blob).where(Blob.id == blob_id))
+        remove_after_commit(session, remove_blob, blob.sha256)
+    return blob.ref_count
+
+# Function to release the stored file of a TempFile
+def release_tempfile(session, temp_file):
+    """
+    Release the file of a TempFile, through its blob or from the legacy flat layout.
+
+    Parameters:
+    - session: The SQLAlchemy session of the current transaction, the file is
+      removed after it commits.
+    - temp_file: The TempFile record.
+    """
+    if temp_file.blob_id is not None:
+        release_blob(session, temp_file.blob_id)
+        return
+    remove_after_commit(session, remove_file, os.path.join(BASE_DIR, "files", temp_file.filename))
+
+# Function to replace the LSH band keys of a TempFile
+def write_fingerprint_bands(connection, temp_file_id, fingerprint):
+    connection.execute(delete(FingerprintBand).where(FingerprintBand.temp_file_id == temp_file_id))
+    signature = unpack_signature(fingerprint)
+    if signature is not None:
+        connection.execute(insert(FingerprintBand), [
+            {"temp_file_id": temp_file_id, "band": band, "key": key} for band, key in band_keys(signature)
+        ])
+
+# Event Hooks keeping the band keys of a TempFile in sync with its fingerprint
+@event.listens_for(TempFile, "after_insert")
+@event.listens_for(TempFile, "after_update")
+def tempfile_after_write(mapper, connection, target: TempFile):
+    if inspect(target).attrs.fingerprint.history.has_changes():
+        write_fingerprint_bands(connection, target.id, target.fingerprint)
+
+# Event Hook Before Deleting a Summary Instance
 @event.listens_for(Summary, "before_delete")
 def summary_before_delete(mapper, connect, target: Summary):
+    session = object_session(target)
     for temp_file in target.tempfiles:
-        try:
-            # Constructing the file path and removing the file
-            filepath = os.path.join(BASE_DIR, "files", temp_file.filename)
-            os.remove(filepath)
-            print(f"[TempFile DELETE SUCCESS]: {filepath}")
-        except Exception as err:
-            print(f"[TempFile '{temp_file.filename}' DELETE ERROR]: {err}")
+        release_tempfile(session, temp_file)
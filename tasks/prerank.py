@@ -0,0 +1,98 @@
+# Importing necessary modules for CV pre-ranking
+from collections import Counter
+import os, re, math
+
+"""
+
+    Relevance Pre-Ranking:
+
+    The CVs of a job are summarized in order of their BM25 score against the
+    job title, duties and requirements, so the strongest candidates of a
+    large job are summarized, and shown, first. Scoring is local and takes a
+    few milliseconds per hundred CVs, the extracted texts are already stored.
+
+    A job can be limited to its top N CVs, the other CVs stay in the job
+    unsummarized and can be submitted again without a limit.
+
+    CVs whose text is not extracted yet cannot be scored and come last.
+
+    Environment Variables:
+
+    - PRERANK: Order CVs by relevance before summarizing, "true" or "false" (default: true)
+
+"""
+
+PRERANK = os.environ.get("PRERANK", "true").lower() == "true"
+
+# BM25 parameters: term frequency saturation and document length normalization
+K1 = 1.2
+B = 0.75
+
+# Frequent English words carrying no signal about a candidate
+STOPWORDS = set("""
+    a an and are as at be by for from has have in is it its of on or our that the their this to was we will with
+    you your they he she his her who what which can able must should would experience years year work working
+""".split())
+
+# Function to split a text into lowercase terms
+def tokenize(text):
+    return [term for term in re.findall(r"\w+", (text or "").lower()) if term not in STOPWORDS and len(term) > 1]
+
+# Function to score documents against a query with Okapi BM25
+def bm25_scores(query, documents):
+    """
+    Score documents against a query with Okapi BM25.
+
+    Parameters:
+    - query: The query text, each distinct term counts once.
+    - documents: The document texts.
+
+    Returns:
+    - list: One score per document, higher is more relevant.
+    """
+    terms = set(tokenize(query))
+    frequencies = [Counter(tokenize(document)) for document in documents]
+    if not terms or not frequencies:
+        return [0.0] * len(documents)
+    lengths = [sum(frequency.values()) for frequency in frequencies]
+    average_length = sum(lengths) / len(lengths) or 1.0
+    count = len(documents)
+    idf = {}
+    for term in terms:
+        document_frequency = sum(1 for frequency in frequencies if term in frequency)
+        idf[term] = math.log(1 + (count - document_frequency + 0.5) / (document_frequency + 0.5))
+    scores = []
+    for frequency, length in zip(frequencies, lengths):
+        normalization = K1 * (1 - B + B * length / average_length)
+        scores.append(sum(
+            idf[term] * frequency[term] * (K1 + 1) / (frequency[term] + normalization)
+            for term in terms if term in frequency
+        ))
+    return scores
+
+# Function to build the query of a job
+def job_query(form):
+    return " ".join(value for value in (form.job_title, form.job_duties, form.job_requirements) if value)
+
+# Function to order CVs by relevance to a job
+def rank(query, items, top_n=None):
+    """
+    Order CVs by their BM25 score against a job.
+
+    Parameters:
+    - query: The job query, see job_query.
+    - items: (key, text) tuples, text is None for CVs not extracted yet.
+    - top_n: Only keep the N best CVs (all if None or 0).
+
+    Returns:
+    - list: The keys, most relevant first, CVs without text last, in their original order.
+    """
+    scored = [(key, text) for key, text in items if text is not None]
+    unscored = [key for key, text in items if text is None]
+    ordered = [key for key, text in scored]
+    if PRERANK and scored:
+        scores = bm25_scores(query, [text for key, text in scored])
+        # Stable sort, equal scores keep the upload order
+        ordered = [ordered[index] for index in sorted(range(len(ordered)), key=lambda index: -scores[index])]
+    ordered += unscored
+    return ordered[:top_n] if top_n else ordered
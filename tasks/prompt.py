@@ -1,6 +1,121 @@
 # Importing necessary modules for OpenAI integration and file operations
-from openai import OpenAI
-import os
+# The openai package is imported lazily, only the AI worker needs it
+# Set OPENAI_BASE_URL to send requests to another OpenAI-compatible server, e.g. the stub of bench_ai.py
+import os, time
+from tracing import span
+
+# USD price per million tokens as (input, cached input, output), used to estimate the cost of each call
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4-turbo": (10.00, 10.00, 30.00),
+    "gpt-4": (30.00, 30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 0.50, 1.50),
+}
+
+# HTTP client shared by every OpenAI client of the process, so connections are reused
+_http_client = None
+
+# Function to get the shared HTTP client for OpenAI requests
+def get_http_client():
+    """
+    Get the HTTP client shared by the OpenAI clients of this process.
+
+    Returns:
+        - The openai DefaultHttpxClient, created on first use.
+    """
+    global _http_client
+    if _http_client is None:
+        from openai import DefaultHttpxClient
+        _http_client = DefaultHttpxClient()
+    return _http_client
+
+# Function to create an OpenAI client
+def get_openai_client(gpt_api_key):
+    """
+    Create an OpenAI client for an API key using the shared HTTP client.
+
+    Parameters:
+        - gpt_api_key (str): The OpenAI API key.
+
+    Returns:
+        - OpenAI: The client, sending requests to OPENAI_BASE_URL when it is set.
+    """
+    from openai import OpenAI
+    return OpenAI(api_key=gpt_api_key, base_url=os.environ.get("OPENAI_BASE_URL") or None, http_client=get_http_client())
+
+# Function to estimate the cost of a call
+def estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens=0):
+    """
+    Estimate the USD cost of a call from its token usage.
+
+    Parameters:
+        - model (str): The model name, dated snapshots such as gpt-4o-2024-08-06 use the base model price.
+        - prompt_tokens (int): Input tokens, including the cached ones.
+        - completion_tokens (int): Output tokens.
+        - cached_tokens (int): Input tokens served from the prompt cache.
+
+    Returns:
+        - float: The cost, or None if the model has no known price.
+    """
+    # Longest matching name first so gpt-4o-mini is not priced as gpt-4o
+    for name in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model and model.startswith(name):
+            input_price, cached_price, output_price = MODEL_PRICES[name]
+            return (
+                (prompt_tokens - cached_tokens) * input_price
+                + cached_tokens * cached_price
+                + completion_tokens * output_price
+            ) / 1_000_000
+    return None
+
+# Function to send a chat completion request and measure it
+def create_chat_completion(gpt_api_key, gpt_model, messages):
+    """
+    Send a chat completion request and collect its usage.
+
+    Parameters:
+        - gpt_api_key (str): The OpenAI API key.
+        - gpt_model (str): The model name.
+        - messages (list): The chat messages.
+
+    Returns:
+        - tuple: The answer (None on failure) and a usage dict with model, prompt_tokens,
+          completion_tokens, cached_tokens, latency_seconds, retries, cost and error.
+    """
+    usage = {
+        "model": gpt_model, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+        "latency_seconds": 0.0, "retries": 0, "cost": None, "error": None
+    }
+    with span("openai.chat", model=gpt_model) as call:
+        start = time.perf_counter()
+        try:
+            client = get_openai_client(gpt_api_key)
+            raw_response = client.chat.completions.with_raw_response.create(
+                model=gpt_model,
+                messages=messages,
+                temperature=0.2
+            )
+            response = raw_response.parse()
+            usage["retries"] = raw_response.retries_taken
+            usage["model"] = response.model or gpt_model
+            if response.usage:
+                details = response.usage.prompt_tokens_details
+                usage["prompt_tokens"] = response.usage.prompt_tokens or 0
+                usage["completion_tokens"] = response.usage.completion_tokens or 0
+                usage["cached_tokens"] = (details.cached_tokens or 0) if details else 0
+            usage["cost"] = estimate_cost(usage["model"], usage["prompt_tokens"], usage["completion_tokens"], usage["cached_tokens"])
+            return response.choices[0].message.content, usage
+        except Exception as e:
+            usage["error"] = f"{type(e).__name__}: {e}"
+            call.error = usage["error"]
+            return None, usage
+        finally:
+            usage["latency_seconds"] = time.perf_counter() - start
+            call.set(**{key: usage[key] for key in ("model", "prompt_tokens", "completion_tokens", "cached_tokens", "retries")})
 
 # Default prompt for formulating questions
 formulate_questions_prompt_default = """You are a senior recruiter, you are generating a set of questions that can be used to summarize a person's CV/Resume and consider whether the candidate is a fit for a job for the company.
@@ -56,14 +171,8 @@ def formulate_question_using_chat_gpt(
         job_requirements, 
         manualquestions
     ):
-    try:
-        # Creating an OpenAI client
-        client = OpenAI(api_key=gpt_api_key)
-
-        # Generating questions using ChatGPT
-        response = client.chat.completions.create(
-            model=gpt_model,
-            messages=[
+    # Generating questions using ChatGPT
+    questions, usage = create_chat_completion(gpt_api_key, gpt_model, [
                 {
                     "role": "system",
                     "content": f"""
@@ -88,14 +197,11 @@ def formulate_question_using_chat_gpt(
                     Manual Questions:
                     {manualquestions}
                     """},
-            ],
-            temperature=0.2,
-        )
-        questions = response.choices[0].message.content
-        return questions, 'SUCCESS'
-    except Exception as e:
-        print(f"Failed to generate question: {e}")
-        return str(e), 'FAILED'
+    ])
+    if usage["error"]:
+        print(f"Failed to generate question: {usage['error']}")
+        return usage["error"], 'FAILED', usage
+    return questions, 'SUCCESS', usage
 
 # Function for summarizing CVs using ChatGPT
 def summarize_using_chat_gpt(
@@ -109,14 +215,9 @@ def summarize_using_chat_gpt(
         job_duties, 
         job_requirements
     ):
-    try:
-        # Creating an OpenAI client
-        client = OpenAI(api_key=gpt_api_key)
-
-        # Summarizing CV using ChatGPT
-        response = client.chat.completions.create(
-            model=gpt_model,
-            messages=[
+    # Summarizing CV using ChatGPT
+    with span("prompt.build", questions=len(questions), cv_chars=len(cv)):
+        messages = [
                 {
                     "role": "system","content": f"""
                     {summarize_cv_prompt}"""},
@@ -142,11 +243,9 @@ def summarize_using_chat_gpt(
                     Question we want to ask and you should generate json output on:
                     {questions}
 """},
-            ],
-            temperature=0.2
-        )
-        summary = response.choices[0].message.content
-        return summary, 'SUCCESS'
-    except Exception as e:
-        print(f"Failed to summarize: {e}")
-        return str(e), 'FAILED'
\ No newline at end of file
+        ]
+    summary, usage = create_chat_completion(gpt_api_key, gpt_model, messages)
+    if usage["error"]:
+        print(f"Failed to summarize: {usage['error']}")
+        return usage["error"], 'FAILED', usage
+    return summary, 'SUCCESS', usage
@@ -0,0 +1,45 @@
+# Importing necessary modules for caching generated questions
+import os, json, hashlib
+
+"""
+
+    Generated Questions Cache:
+
+    Recruiters reuse job description templates, so the same job is often
+    sent to formulate_questions again. Generated questions are cached in the
+    question_cache table under a SHA-256 of the model, the formulate
+    questions prompt, job title, company background, job duties, job
+    requirements and manual questions, each compared case-insensitively
+    with its whitespace collapsed.
+
+    /generateQuestions sends the request to the interactive lane, which
+    answers a hit from the cache at once and sends a miss on to the model
+    under the same task ID, so the web service never waits on the lookup. Entries expire after QUESTION_CACHE_TTL seconds and the least
+    recently used entries are evicted beyond QUESTION_CACHE_SIZE. A
+    recruiter asking to regenerate bypasses the cache and replaces the entry.
+
+    Environment Variables:
+
+    - QUESTION_CACHE_TTL: Seconds a cached answer is reused, 0 disables the cache (default: 604800)
+    - QUESTION_CACHE_SIZE: Maximum number of cached answers (default: 1000)
+
+"""
+
+QUESTION_CACHE_TTL = int(os.environ.get("QUESTION_CACHE_TTL", 7 * 24 * 3600))
+QUESTION_CACHE_SIZE = int(os.environ.get("QUESTION_CACHE_SIZE", 1000))
+
+# Function to normalize a cached input, so edits in case or spacing still hit
+def normalize(value):
+    return " ".join(str(value or "").casefold().split())
+
+# Function to compute the cache key of a formulate_questions call
+def cache_key(gpt_model, formulate_questions_prompt, job_title, company_background, job_duties, job_requirements, manualquestions):
+    values = [gpt_model, formulate_questions_prompt, job_title, company_background, job_duties, job_requirements, manualquestions]
+    return hashlib.sha256(json.dumps([normalize(value) for value in values]).encode("utf-8")).hexdigest()
+
+# Function to check whether a model answer holds questions worth caching
+def is_cacheable(questions):
+    try:
+        return isinstance(json.loads(questions.replace('```json', '').replace('```', '')), dict)
+    except (ValueError, AttributeError):
+        return False
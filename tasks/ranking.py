@@ -0,0 +1,164 @@
+# Importing necessary modules for weighted candidate ranking
+from collections import OrderedDict
+from sqlalchemy import and_, func
+from models import Form, Question, SummaryScore
+import os, bisect, heapq, threading
+
+"""
+
+    Weighted Candidate Ranking:
+
+    Recruiters weight the rating questions of a job ("technical fit x2,
+    language x1") and re-rank its candidates as they move the sliders.
+
+    The candidate x rating question matrix of a job is loaded from the
+    summary_score table once and cached per worker process. Every request
+    checks the cached matrix against the count and largest ID of the job's
+    scores, one indexed query, and reloads it when a summary was added or
+    deleted since. Re-ranking then only runs over the cached rows.
+
+    A candidate's weighted score is the weighted mean of the ratings it
+    has, questions it was not scored on are left out. Candidates without
+    any weighted rating come last with no score, summaries without any
+    rating are not listed.
+
+    Environment Variables:
+
+    - RANKING_CACHE_JOBS: Number of job matrices cached per process (default: 64)
+
+"""
+
+RANKING_CACHE_JOBS = int(os.environ.get("RANKING_CACHE_JOBS", 64))
+
+# Class holding the rating matrix of one job
+class ScoreMatrix:
+
+    def __init__(self, question_ids, summary_ids, rows, version):
+        self.question_ids = question_ids  # Column order
+        self.summary_ids = summary_ids  # Row order
+        self.rows = rows  # One tuple per summary, None where the summary has no score
+        self.version = version
+
+    def weighted_scores(self, weights):
+        """
+        Compute the weighted mean rating of every candidate.
+
+        Parameters:
+        - weights: Question ID mapped to its weight, questions left out weigh 1, 0 ignores a question.
+
+        Returns:
+        - list: One score per row, None for candidates without a weighted rating.
+        """
+        columns = [
+            (index, float(weights.get(question_id, 1)))
+            for index, question_id in enumerate(self.question_ids)
+        ]
+        columns = [(index, weight) for index, weight in columns if weight > 0]
+        scores = []
+        for row in self.rows:
+            total = weight_sum = 0.0
+            for index, weight in columns:
+                value = row[index]
+                if value is not None:
+                    total += weight * value
+                    weight_sum += weight
+            scores.append(total / weight_sum if weight_sum else None)
+        return scores
+
+# Function to get the version of a job's scores, it changes whenever a score is added or deleted
+def scores_version(session, job_id):
+    count, last_id = session.query(func.count(SummaryScore.id), func.max(SummaryScore.id)).filter(SummaryScore.form_id == job_id).one()
+    return count, last_id
+
+# Function to load the rating matrix of a job
+def load_matrix(session, job_id, version):
+    question_ids = [
+        question_id for question_id, in
+        session.query(SummaryScore.question_id).filter(SummaryScore.form_id == job_id).distinct().order_by(SummaryScore.question_id)
+    ]
+    columns = {question_id: index for index, question_id in enumerate(question_ids)}
+    rows = {}
+    scores = session.query(SummaryScore.summary_id, SummaryScore.question_id, SummaryScore.score).filter(SummaryScore.form_id == job_id)
+    for summary_id, question_id, score in scores:
+        rows.setdefault(summary_id, [None] * len(question_ids))[columns[question_id]] = score
+    summary_ids = sorted(rows)
+    return ScoreMatrix(question_ids, summary_ids, [tuple(rows[summary_id]) for summary_id in summary_ids], version)
+
+# Class caching the rating matrices of the most recently ranked jobs
+class MatrixCache:
+
+    def __init__(self, size=RANKING_CACHE_JOBS):
+        self.size = size
+        self.lock = threading.Lock()
+        self.matrices = OrderedDict()
+        self.loads = 0
+
+    def get(self, session, job_id):
+        version = scores_version(session, job_id)
+        with self.lock:
+            matrix = self.matrices.get(job_id)
+            if matrix is not None and matrix.version == version:
+                self.matrices.move_to_end(job_id)
+                return matrix
+        matrix = load_matrix(session, job_id, version)
+        with self.lock:
+            self.loads += 1
+            self.matrices[job_id] = matrix
+            self.matrices.move_to_end(job_id)
+            while len(self.matrices) > self.size:
+                self.matrices.popitem(last=False)
+        return matrix
+
+    def clear(self):
+        with self.lock:
+            self.matrices.clear()
+
+matrix_cache = MatrixCache()
+
+# Function to rank the candidates of a job by their weighted rating
+def rank_candidates(session, job_id, user_id, weights=None, top_k=None):
+    """
+    Rank the candidates of a job by the weighted mean of their ratings.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - job_id: The ID of the job.
+    - user_id: The ID of the user_account owning the job.
+    - weights: Question ID (int or str) mapped to its weight (default: 1 for every question).
+    - top_k: Only return the K best candidates (all if None).
+
+    Returns:
+    - dict: The rating "questions" ({id, value}), the number of candidates
+      "count" and the ranked "candidates" ({summary_id, score, percentile,
+      scores}), or None if the job does not belong to the user.
+    """
+    job_id = int(job_id)
+    if session.query(Form.id).filter(and_(Form.id == job_id, Form.user_account_id == user_id)).first() is None:
+        return None
+    matrix = matrix_cache.get(session, job_id)
+    weights = {int(question_id): weight for question_id, weight in (weights or {}).items()}
+    scores = matrix.weighted_scores(weights)
+
+    # Percentile: share of scored candidates ranked strictly below, ties share the same percentile
+    scored = sorted(score for score in scores if score is not None)
+    percentile = lambda score: round(100.0 * bisect.bisect_left(scored, score) / len(scored), 1)
+
+    # Best score first, equal scores keep the summary order
+    order = range(len(scores))
+    key = lambda index: (scores[index] is None, -(scores[index] or 0), index)
+    order = heapq.nsmallest(top_k, order, key=key) if top_k else sorted(order, key=key)
+
+    questions = dict(session.query(Question.id, Question.value).filter(Question.id.in_(matrix.question_ids)))
+    return {
+        "questions": [{"id": question_id, "value": questions.get(question_id)} for question_id in matrix.question_ids],
+        "count": len(scores),
+        "candidates": [
+            {
+                "summary_id": matrix.summary_ids[index],
+                "score": scores[index],
+                "percentile": percentile(scores[index]) if scores[index] is not None else None,
+                "scores": dict(zip(matrix.question_ids, matrix.rows[index])),
+            }
+            for index in order
+        ],
+    }
@@ -1,6 +1,6 @@
 import argparse
 from sqlalchemy.orm import Session
-from database import engine
+from database import engine, init_db
 from utils import hash_password
 from prompt import formulate_questions_prompt_default, summarize_cv_prompt_default
 from crud import add_record, get_record, UserAccount, Setting
@@ -46,6 +46,9 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    # Create the database tables if the workers have not done it yet
+    init_db()
+
     with Session(engine) as session:
         # Register User
         user_id = register_user(session, args.username, args.password, args.email, role="admin")
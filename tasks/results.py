@@ -0,0 +1,155 @@
+# Importing necessary modules for result backend settings
+from celery.signals import task_postrun
+from kombu.serialization import register
+from kombu.utils.json import dumps, loads
+import os, time, zlib
+
+"""
+
+    Result Policies:
+
+    Each task name can set how its result is kept in the result backend:
+
+    - ignore_result: Do not store the result, for fire-and-forget tasks whose
+                     status is never polled by the web service.
+    - expires: Seconds the result is kept after the task finishes.
+
+    Tasks without a policy keep their result for RESULT_EXPIRES seconds.
+
+    Results are stored with the "zjson" serializer: plain JSON, compressed
+    with zlib once the payload is larger than RESULT_COMPRESS_THRESHOLD bytes.
+    The web service registers the same serializer to read them back.
+
+    Environment Variables:
+
+    - RESULT_EXPIRES: Default result TTL in seconds (default: 3600)
+    - RESULT_COMPRESS_THRESHOLD: Payload size in bytes above which results are compressed (default: 1024)
+
+"""
+
+RESULT_EXPIRES = int(os.environ.get("RESULT_EXPIRES", 3600))
+RESULT_COMPRESS_THRESHOLD = int(os.environ.get("RESULT_COMPRESS_THRESHOLD", 1024))
+
+# Result policy of each task that does not use the defaults
+RESULT_POLICIES = {
+    # Fire-and-forget, nothing reads their result
+    "tasks.db_save_job": {"ignore_result": True},
+    "tasks.db_save_file": {"ignore_result": True},
+    "tasks.db_delete_file": {"ignore_result": True},
+    "tasks.dispatch_summarization": {"ignore_result": True},
+    "tasks.schedule_summarization": {"ignore_result": True},
+    "tasks.schedule_resummarization": {"ignore_result": True},
+    "tasks.dispatch_scheduler": {"ignore_result": True},
+    "tasks.summarize_cv": {"ignore_result": True},
+    "tasks.extract_file": {"ignore_result": True},
+    # Read by the web service right after they are sent
+    "tasks.get_user": {"expires": 60},
+    "tasks.login_user": {"expires": 60},
+    "tasks.register_user": {"expires": 60},
+    "tasks.get_jobs": {"expires": 60},
+    "tasks.get_summaries": {"expires": 60},
+    "tasks.search": {"expires": 60},
+    "tasks.rank_candidates": {"expires": 60},
+    "tasks.update_questions": {"expires": 60},
+    "tasks.get_summary": {"expires": 60},
+    "tasks.get_summary_file": {"expires": 60},
+    "tasks.export_summaries_csv": {"expires": 60},
+    "tasks.delete_job": {"expires": 60},
+    "tasks.delete_summary": {"expires": 60},
+    "tasks.get_llm_usage": {"expires": 60},
+    # Only the status is polled, the value is a boolean
+    "tasks.set_settings": {"expires": 60},
+    "tasks.set_user_settings": {"expires": 60},
+    # Polled by the browser until done
+    "tasks.formulate_questions": {"expires": 600},
+    "tasks.cached_questions": {"expires": 600},
+    "tasks.summarize_cvs_using_chat_gpt": {"expires": 86400},
+}
+
+# Redis sorted set indexing stored results as "name|task_id", scored by expiry time
+RESULT_INDEX_KEY = "celery-result-index"
+
+# zlib streams start with 0x78 ("x"), which no JSON document starts with
+ZLIB_HEADER = b"x"
+
+# Function to serialize a result as JSON, compressed when large
+def zjson_dumps(obj):
+    data = dumps(obj).encode("utf-8")
+    if len(data) > RESULT_COMPRESS_THRESHOLD:
+        return zlib.compress(data)
+    return data
+
+# Function to deserialize a result written by zjson_dumps
+def zjson_loads(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if data[:1] == ZLIB_HEADER:
+        data = zlib.decompress(data)
+    return loads(data)
+
+register("zjson", zjson_dumps, zjson_loads, content_type="application/x-zjson", content_encoding="binary")
+
+# Function to apply the result settings to a Celery app
+def configure_results(celery_app):
+    """
+    Apply the result serializer, TTLs and per-task policies to a Celery app.
+
+    Parameters:
+    - celery_app: The Celery app of a worker module.
+    """
+    celery_app.conf.update(
+        result_serializer="zjson",
+        result_accept_content=["zjson", "json"],
+        result_expires=RESULT_EXPIRES,
+        task_annotations={
+            name: {"ignore_result": True}
+            for name, policy in RESULT_POLICIES.items() if policy.get("ignore_result")
+        }
+    )
+
+# The Redis backend applies result_expires to every key, shorten it per task once the
+# result is stored and index the result by task name for result_memory_usage
+@task_postrun.connect
+def expire_result(task_id=None, task=None, **kwargs):
+    backend = task.backend
+    if task.ignore_result or not hasattr(backend, "client"):
+        return
+    expires = RESULT_POLICIES.get(task.name, {}).get("expires", RESULT_EXPIRES)
+    now = time.time()
+    pipeline = backend.client.pipeline(transaction=False)
+    pipeline.expire(backend.get_key_for_task(task_id), expires)
+    pipeline.zadd(RESULT_INDEX_KEY, {f"{task.name}|{task_id}": now + expires})
+    pipeline.zremrangebyscore(RESULT_INDEX_KEY, 0, now)
+    pipeline.execute()
+
+# Function to report the result backend memory used per task name
+def result_memory_usage(celery_app, batch_size=500):
+    """
+    Report the memory used in the Redis result backend per task name.
+
+    Parameters:
+    - celery_app: The Celery app whose result backend is inspected.
+    - batch_size: Number of keys inspected per round trip.
+
+    Returns:
+    - dict: Task name mapped to its number of stored results and their size in bytes,
+      largest first.
+    """
+    backend = celery_app.backend
+    client = backend.client
+    usage = {}
+    # Drop the index entries of expired results first
+    client.zremrangebyscore(RESULT_INDEX_KEY, 0, time.time())
+    entries = [entry.decode().rsplit("|", 1) for entry in client.zrange(RESULT_INDEX_KEY, 0, -1)]
+    for index in range(0, len(entries), batch_size):
+        batch = entries[index:index + batch_size]
+        pipeline = client.pipeline(transaction=False)
+        for _, task_id in batch:
+            pipeline.memory_usage(backend.get_key_for_task(task_id))
+        for (name, _), size in zip(batch, pipeline.execute()):
+            if size is None:
+                continue
+            stats = usage.setdefault(name, {"results": 0, "bytes": 0})
+            stats["results"] += 1
+            stats["bytes"] += size
+    return dict(sorted(usage.items(), key=lambda item: item[1]["bytes"], reverse=True))
@@ -0,0 +1,213 @@
+# Importing necessary modules for task routing
+import os, sys
+
+"""
+
+    Task Lanes:
+
+    Tasks are routed to lanes by how long they hold a worker and what they
+    wait on, so a slow export or an SMTP timeout cannot stall a login:
+
+    1. interactive - queue1 - Short DB lookups behind a page or login (bcrypt)
+    2. summarize   - queue2 - ai_worker, OpenAI summarization
+    3. extract     - queue3 - extract_worker, text extraction of uploaded CVs
+    4. bulk        - queue4 - Exports, deletions with file cleanup and CV text shipping
+    5. io          - queue5 - Tasks waiting on SMTP or blob storage
+
+    Each lane runs its own Celery worker with its own concurrency, pool and
+    prefetch multiplier. Regenerate supervisord.conf after changing a lane:
+
+        python routing.py supervisord > supervisord.conf
+
+    Report the number of messages waiting in each lane:
+
+        python routing.py depth
+
+    Lane Environment Variables (override the defaults below):
+
+    - LANE_<NAME>_CONCURRENCY: Number of processes or threads
+    - LANE_<NAME>_PREFETCH: Prefetch multiplier
+
+"""
+
+# Lanes with their queue, Celery app module and worker options
+LANES = {
+    "interactive": {"queue": "queue1", "app": "worker", "pool": "prefork", "concurrency": None, "prefetch": 4},
+    "summarize": {"queue": "queue2", "app": "ai_worker", "pool": "prefork", "concurrency": None, "prefetch": 1},
+    "extract": {"queue": "queue3", "app": "extract_worker", "pool": "prefork", "concurrency": None, "prefetch": 1},
+    "bulk": {"queue": "queue4", "app": "worker", "pool": "prefork", "concurrency": 2, "prefetch": 1},
+    "io": {"queue": "queue5", "app": "worker", "pool": "threads", "concurrency": 16, "prefetch": 1},
+}
+
+# Lane of each worker.py task that does not belong to the interactive lane
+TASK_LANES = {
+    "tasks.export_summaries_csv": "bulk",
+    "tasks.delete_job": "bulk",
+    "tasks.delete_user": "bulk",
+    "tasks.dispatch_summarization": "bulk",
+    "tasks.schedule_summarization": "bulk",
+    "tasks.schedule_resummarization": "bulk",
+    "tasks.forgot_password_user": "io",
+    "tasks.db_save_file": "io",
+    "tasks.summarize_cvs_using_chat_gpt": "summarize",
+    "tasks.summarize_cv": "summarize",
+    "tasks.formulate_questions": "summarize",
+    "tasks.extract_file": "extract",
+}
+
+DEFAULT_LANE = "interactive"
+
+# Function to get the options of a lane, with environment overrides applied
+def lane_options(lane):
+    """
+    Get the worker options of a lane.
+
+    Parameters:
+    - lane: The lane name.
+
+    Returns:
+    - dict: queue, app, pool, concurrency and prefetch of the lane.
+    """
+    options = dict(LANES[lane])
+    prefix = f"LANE_{lane.upper()}_"
+    if os.environ.get(prefix + "CONCURRENCY"):
+        options["concurrency"] = int(os.environ[prefix + "CONCURRENCY"])
+    if os.environ.get(prefix + "PREFETCH"):
+        options["prefetch"] = int(os.environ[prefix + "PREFETCH"])
+    return options
+
+# Function to get the queue of a task
+def task_queue(name):
+    """
+    Get the queue a task is routed to.
+
+    Parameters:
+    - name: The registered task name, e.g. "tasks.login_user".
+
+    Returns:
+    - str: The queue name.
+    """
+    return LANES[TASK_LANES.get(name, DEFAULT_LANE)]["queue"]
+
+# Router used as the Celery task_routes setting
+def route_task(name, args, kwargs, options, task=None, **kw):
+    return {"queue": task_queue(name)}
+
+# Function to build the celery worker command of a lane
+def worker_command(lane, celery_bin="/venv/bin/celery"):
+    """
+    Build the celery worker command line of a lane.
+
+    Parameters:
+    - lane: The lane name.
+    - celery_bin: Path of the celery executable.
+
+    Returns:
+    - str: The command line.
+    """
+    options = lane_options(lane)
+    command = [
+        celery_bin, "-A", f"{options['app']}.celery", "worker", "-l", "info",
+        "-Q", options["queue"], "-n", f"{lane}@%h",
+        "-P", options["pool"], "--prefetch-multiplier", str(options["prefetch"])
+    ]
+    if options["concurrency"]:
+        command += ["-c", str(options["concurrency"])]
+    if options["prefetch"] == 1:
+        # Only reserve a task once a process is free, long tasks are not queued behind each other
+        command += ["-O", "fair"]
+    return " ".join(command)
+
+# Function to render the supervisord configuration running one worker per lane
+def render_supervisord(directory="/tasks"):
+    """
+    Render a supervisord configuration with one program per lane, celery
+    beat and the metrics exporter.
+
+    The pool and concurrency are also exported to the worker environment so
+    database.py sizes its connection pool for thread pools.
+
+    Parameters:
+    - directory: Working directory of the workers.
+
+    Returns:
+    - str: The configuration file content.
+    """
+    # Every program writes its metrics to the same directory, served by metrics.py
+    sections = ["[supervisord]\nnodaemon=true\nenvironment=PROMETHEUS_MULTIPROC_DIR=\"/tmp/prometheus\"\n"]
+    for lane in LANES:
+        options = lane_options(lane)
+        environment = f'CELERY_POOL="{options["pool"]}"'
+        if options["concurrency"]:
+            environment += f',CELERY_CONCURRENCY="{options["concurrency"]}"'
+        sections.append("\n".join([
+            f"[program:celery_{lane}]",
+            # supervisord expands %(...)s, a literal % is written %%
+            f"command={worker_command(lane).replace('%', '%%')}",
+            f"directory={directory}",
+            f"environment={environment}",
+            "autostart=true",
+            "autorestart=true",
+            "redirect_stderr=true",
+            f"stdout_logfile={directory}/worker-{lane}.log",
+            "user=root",
+        ]) + "\n")
+    # One beat process sends the periodic tasks, such as the fair-share scheduler dispatch
+    sections.append("\n".join([
+        "[program:celery_beat]",
+        "command=/venv/bin/celery -A worker.celery beat -l info -s /tmp/celerybeat-schedule",
+        f"directory={directory}",
+        "autostart=true",
+        "autorestart=true",
+        "redirect_stderr=true",
+        f"stdout_logfile={directory}/beat.log",
+        "user=root",
+    ]) + "\n")
+    sections.append("\n".join([
+        "[program:metrics_exporter]",
+        "command=/venv/bin/python metrics.py",
+        f"directory={directory}",
+        "autostart=true",
+        "autorestart=true",
+        "redirect_stderr=true",
+        f"stdout_logfile={directory}/metrics.log",
+        "user=root",
+    ]) + "\n")
+    return "\n".join(sections)
+
+# Function to count the messages waiting in each lane
+def queue_depths(celery_app):
+    """
+    Count the messages waiting in the queue of each lane.
+
+    Parameters:
+    - celery_app: A Celery app connected to the broker.
+
+    Returns:
+    - dict: Lane name mapped to its queue and number of waiting messages.
+    """
+    depths = {}
+    with celery_app.connection_for_read() as connection:
+        for lane, options in LANES.items():
+            channel = connection.channel()
+            try:
+                depth = channel.queue_declare(queue=options["queue"], passive=True).message_count
+            except connection.channel_errors:
+                # The queue is only created once a worker or producer uses it
+                depth = 0
+            finally:
+                channel.close()
+            depths[lane] = {"queue": options["queue"], "depth": depth}
+    return depths
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["supervisord"]:
+        print(render_supervisord(), end="")
+    elif sys.argv[1:] == ["depth"]:
+        from celery import Celery
+        celery = Celery("tasks", broker=os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+        for lane, depth in queue_depths(celery).items():
+            print(f"{lane:<12}{depth['queue']:<8}{depth['depth']}")
+    else:
+        print("Usage: python routing.py supervisord|depth")
+        sys.exit(1)
@@ -0,0 +1,339 @@
+# Importing necessary modules for fair-share scheduling
+import os, json, time
+
+"""
+
+    Fair-Share Summarization Scheduler:
+
+    Instead of sending a whole job to queue2, the CVs of every submitted job
+    wait in the scheduler and are sent to the AI workers one at a time, so
+    queue2 never holds more than FAIRSHARE_MAX_INFLIGHT CVs and the order in
+    which CVs are summarized is decided here rather than by arrival:
+
+    1. Small jobs (at most FAIRSHARE_SMALL_JOB CVs) are served first, in
+       submission order, and are the only ones allowed to use the last
+       FAIRSHARE_RESERVED_SLOTS slots. A 5-CV job starts as soon as a slot
+       frees up even while big batches keep the API key saturated.
+    2. Other jobs are served round-robin across users, and round-robin
+       across the jobs of each user. A user gets as many consecutive CVs per
+       turn as the weight of their role.
+    3. A user never has more than FAIRSHARE_USER_CAP CVs in flight.
+
+    Every dispatched CV holds a lease. A CV whose worker died or hung is
+    put back at the head of its job after FAIRSHARE_LEASE seconds, and given
+    up after FAIRSHARE_MAX_ATTEMPTS dispatches. Celery beat runs a dispatch
+    every FAIRSHARE_SWEEP seconds, so expired leases are reclaimed even when
+    no CV completes and no job is submitted. The scheduler state is a small
+    JSON document in Redis (users, jobs, counters), the CV IDs of each job
+    are kept in a Redis list.
+
+    Submitting a job that is already scheduled queues the CVs it does not
+    hold yet, and reports the completion of the whole job to both tasks.
+
+    Environment Variables:
+
+    - FAIRSHARE_REDIS_URL: Redis used for the scheduler state (default: CELERY_BROKER_URL)
+    - FAIRSHARE_MAX_INFLIGHT: CVs summarized at once across all users (default: 8)
+    - FAIRSHARE_RESERVED_SLOTS: Slots kept free for small jobs (default: 2)
+    - FAIRSHARE_USER_CAP: CVs summarized at once per user (default: 4)
+    - FAIRSHARE_SMALL_JOB: Largest job, in CVs, served as a small job (default: 10)
+    - FAIRSHARE_LEASE: Seconds before a dispatched CV is sent again (default: 900)
+    - FAIRSHARE_MAX_ATTEMPTS: Dispatches of a CV before it is given up (default: 3)
+    - FAIRSHARE_SWEEP: Seconds between two periodic dispatches (default: 30)
+    - FAIRSHARE_WEIGHTS: CVs per round-robin turn by role, e.g. "admin:2,user:1"
+
+"""
+
+FAIRSHARE_SWEEP = int(os.environ.get("FAIRSHARE_SWEEP", 30))
+
+STATE_KEY = "fairshare:state"
+LOCK_KEY = "fairshare:lock"
+
+# Function to get the Redis key holding the pending CV IDs of a job
+def job_files_key(job_id):
+    return f"fairshare:job:{job_id}:files"
+
+# Function to parse role weights such as "admin:2,user:1"
+def parse_weights(value):
+    weights = {}
+    for item in value.split(","):
+        if ":" in item:
+            role, weight = item.split(":", 1)
+            weights[role.strip()] = max(1, int(weight))
+    return weights
+
+# Class dispatching CVs of summarization jobs fairly across users and jobs
+class FairShareScheduler:
+
+    def __init__(self, client, send, store_status, max_inflight=None, reserved_slots=None,
+                 user_cap=None, small_job=None, lease=None, weights=None, max_attempts=None):
+        """
+        Parameters:
+        - client: A Redis client.
+        - send: Callable(job_id, user_id, file_id, traceparent) sending one CV to the AI workers.
+        - store_status: Callable(task_id, state, result) updating the task status polled by the web service.
+        - Limits default to the FAIRSHARE_* environment variables.
+        """
+        self.client = client
+        self.send = send
+        self.store_status = store_status
+        self.max_inflight = max_inflight or int(os.environ.get("FAIRSHARE_MAX_INFLIGHT", 8))
+        self.reserved_slots = reserved_slots if reserved_slots is not None else int(os.environ.get("FAIRSHARE_RESERVED_SLOTS", 2))
+        self.user_cap = user_cap or int(os.environ.get("FAIRSHARE_USER_CAP", 4))
+        self.small_job = small_job or int(os.environ.get("FAIRSHARE_SMALL_JOB", 10))
+        self.lease = lease or int(os.environ.get("FAIRSHARE_LEASE", 900))
+        self.weights = weights or parse_weights(os.environ.get("FAIRSHARE_WEIGHTS", "admin:2,user:1"))
+        self.max_attempts = max_attempts or int(os.environ.get("FAIRSHARE_MAX_ATTEMPTS", 3))
+
+    def _load(self):
+        state = self.client.get(STATE_KEY)
+        if state:
+            return json.loads(state)
+        return {"order": [], "users": {}, "jobs": {}, "express": [], "leases": {}}
+
+    def _save(self, state):
+        self.client.set(STATE_KEY, json.dumps(state))
+
+    def _locked(self):
+        return self.client.lock(LOCK_KEY, timeout=30, blocking_timeout=30)
+
+    def submit(self, job_id, user_id, role, task_id, file_ids, traceparent=None):
+        """
+        Queue the CVs of a job and dispatch what the limits allow.
+
+        Parameters:
+        - job_id: The job ID.
+        - user_id: The user owning the job.
+        - role: The user role, selecting the weight.
+        - task_id: The task ID polled by the web service, set to SUCCESS once every CV is done.
+        - file_ids: The IDs of the CVs to summarize.
+        - traceparent: Trace context the CVs are sent with, so they join the trace of the
+          submitting request rather than of the task that happens to dispatch them.
+        """
+        job_key, user_key = str(job_id), str(user_id)
+        with self._locked():
+            state = self._load()
+            if job_key in state["jobs"]:
+                # Already scheduled, queue the CVs it does not hold yet and report the
+                # completion of the whole job to this task as well
+                job = state["jobs"][job_key]
+                job["task_ids"].append(task_id)
+                held = {int(file_id) for file_id in self.client.lrange(job_files_key(job_id), 0, -1)}
+                held.update(int(lease.split("|")[1]) for lease in state["leases"] if lease.split("|")[0] == job_key)
+                file_ids = [file_id for file_id in file_ids if int(file_id) not in held]
+                if file_ids:
+                    self.client.rpush(job_files_key(job_id), *file_ids)
+                    job["total"] += len(file_ids)
+                    job["pending"] += len(file_ids)
+                    if job["small"] and job["pending"] + job["running"] > self.small_job:
+                        # Grown into a big job, it leaves the small job queue
+                        self._remove(state, job_key)
+                        job["small"] = False
+                    self._offer(state, job_key)
+            elif not file_ids:
+                self.store_status(task_id, "SUCCESS", {"total": 0})
+            else:
+                self.client.rpush(job_files_key(job_id), *file_ids)
+                state["jobs"][job_key] = {
+                    "user_id": user_key,
+                    "task_ids": [task_id],
+                    "total": len(file_ids),
+                    "pending": len(file_ids),
+                    "running": 0,
+                    "small": len(file_ids) <= self.small_job,
+                    "weight": self.weights.get(role, 1),
+                    "attempts": {},
+                    "traceparent": traceparent
+                }
+                self._offer(state, job_key)
+            self._dispatch(state)
+            self._save(state)
+
+    def complete(self, job_id, file_id):
+        """
+        Release the slot of a summarized CV and dispatch the next ones.
+
+        Parameters:
+        - job_id: The job ID.
+        - file_id: The ID of the summarized CV.
+        """
+        with self._locked():
+            state = self._load()
+            if state["leases"].pop(f"{job_id}|{file_id}", None) is not None:
+                self._release(state, str(job_id))
+            self._dispatch(state)
+            self._save(state)
+
+    def dispatch(self):
+        """Send the CVs of expired leases again and dispatch what the limits allow."""
+        with self._locked():
+            state = self._load()
+            self._dispatch(state)
+            self._save(state)
+
+    def stats(self):
+        """
+        Report the scheduler queues.
+
+        Returns:
+        - dict: CVs in flight, and per user the pending and running CVs.
+        """
+        state = self._load()
+        users = {}
+        for job in state["jobs"].values():
+            stats = users.setdefault(job["user_id"], {"jobs": 0, "pending": 0, "running": 0})
+            stats["jobs"] += 1
+            stats["pending"] += job["pending"]
+            stats["running"] += job["running"]
+        return {"inflight": len(state["leases"]), "max_inflight": self.max_inflight, "users": users}
+
+    def _release(self, state, job_key):
+        state["jobs"][job_key]["running"] -= 1
+        self._report(state, job_key)
+
+    def _report(self, state, job_key):
+        # Report progress to the polled task IDs, and success once every CV is done
+        job = state["jobs"][job_key]
+        if job["pending"] == 0 and job["running"] == 0:
+            del state["jobs"][job_key]
+            for task_id in job["task_ids"]:
+                self.store_status(task_id, "SUCCESS", {"total": job["total"], "failed": job.get("failed", 0)})
+        else:
+            done = job["total"] - job["pending"] - job["running"]
+            for task_id in job["task_ids"]:
+                self.store_status(task_id, "PROGRESS", {"done": done, "total": job["total"]})
+
+    def _offer(self, state, job_key):
+        # Offer a job with pending CVs to the small job queue, or to the round-robin of its user
+        job = state["jobs"][job_key]
+        if job["small"]:
+            if job_key not in state["express"]:
+                state["express"].append(job_key)
+            return
+        user_key, weight = job["user_id"], job.get("weight", 1)
+        user = state["users"].setdefault(user_key, {"weight": weight, "credit": weight, "jobs": []})
+        if job_key not in user["jobs"]:
+            user["jobs"].append(job_key)
+        if user_key not in state["order"]:
+            state["order"].append(user_key)
+
+    def _requeue(self, state, job_key, file_id):
+        # The worker holding this CV died or hung, send it again unless it failed too often
+        job = state["jobs"].get(job_key)
+        if job is None:
+            return
+        job["running"] -= 1
+        attempts = job.setdefault("attempts", {})
+        attempts[file_id] = attempts.get(file_id, 1) + 1
+        if attempts[file_id] > self.max_attempts:
+            print(f"[Scheduler] CV {file_id} of job {job_key} given up after {self.max_attempts} attempts")
+            job["failed"] = job.get("failed", 0) + 1
+            self._report(state, job_key)
+            return
+        self.client.lpush(job_files_key(job_key), file_id)
+        job["pending"] += 1
+        self._offer(state, job_key)
+
+    def _user_running(self, state, user_key):
+        return sum(job["running"] for job in state["jobs"].values() if job["user_id"] == user_key)
+
+    def _dispatch(self, state):
+        now = time.time()
+        for lease, deadline in list(state["leases"].items()):
+            if deadline < now:
+                del state["leases"][lease]
+                job_key, file_id = lease.split("|")
+                self._requeue(state, job_key, file_id)
+
+        while True:
+            job_key = self._pick(state)
+            if job_key is None:
+                return
+            job = state["jobs"][job_key]
+            file_id = self.client.lpop(job_files_key(job_key))
+            # An empty list means the job's CV IDs were lost, nothing is left to send
+            job["pending"] = job["pending"] - 1 if file_id is not None else 0
+            if job["pending"] == 0:
+                self._remove(state, job_key)
+            if file_id is None:
+                if job["running"] == 0:
+                    self._report(state, job_key)
+                continue
+            file_id = int(file_id)
+            job["running"] += 1
+            state["leases"][f"{job_key}|{file_id}"] = now + self.lease
+            self.send(int(job_key), int(job["user_id"]), file_id, job.get("traceparent"))
+
+    def _pick(self, state):
+        inflight = len(state["leases"])
+        if inflight >= self.max_inflight:
+            return None
+
+        # Small jobs first, they may use the reserved slots
+        for job_key in state["express"]:
+            if self._user_running(state, state["jobs"][job_key]["user_id"]) < self.user_cap:
+                return job_key
+
+        if inflight >= self.max_inflight - self.reserved_slots:
+            return None
+
+        # Round-robin across users, weighted by role, then across the jobs of the user
+        order = state["order"]
+        for _ in range(len(order)):
+            user_key = order[0]
+            user = state["users"][user_key]
+            if self._user_running(state, user_key) >= self.user_cap:
+                order.append(order.pop(0))
+                continue
+            job_key = user["jobs"][0]
+            user["jobs"].append(user["jobs"].pop(0))
+            user["credit"] -= 1
+            if user["credit"] <= 0:
+                user["credit"] = user["weight"]
+                order.append(order.pop(0))
+            return job_key
+        return None
+
+    def _remove(self, state, job_key):
+        # Stop offering a job once all of its CVs are dispatched
+        job = state["jobs"][job_key]
+        if job_key in state["express"]:
+            state["express"].remove(job_key)
+            return
+        user = state["users"].get(job["user_id"])
+        if user and job_key in user["jobs"]:
+            user["jobs"].remove(job_key)
+            if not user["jobs"]:
+                del state["users"][job["user_id"]]
+                state["order"].remove(job["user_id"])
+
+_scheduler = None
+
+# Function to get the scheduler of a worker process
+def get_scheduler(celery_app):
+    """
+    Get the fair-share scheduler, sending CVs and task statuses with a Celery app.
+
+    Parameters:
+    - celery_app: The Celery app of the worker module.
+
+    Returns:
+    - FairShareScheduler: The scheduler, created once per process.
+    """
+    global _scheduler
+    if _scheduler is None:
+        import redis
+        from routing import task_queue
+        url = os.environ.get("FAIRSHARE_REDIS_URL") or os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379/0")
+
+        def send(job_id, user_id, file_id, traceparent=None):
+            celery_app.send_task(
+                "tasks.summarize_cv", args=[job_id, user_id, file_id], queue=task_queue("tasks.summarize_cv"),
+                headers={"traceparent": traceparent} if traceparent else None
+            )
+
+        def store_status(task_id, state, result):
+            celery_app.backend.store_result(task_id, result, state)
+
+        _scheduler = FairShareScheduler(redis.Redis.from_url(url), send, store_status)
+    return _scheduler
@@ -0,0 +1,64 @@
+# Importing necessary modules for parsing rating answers
+import re
+
+"""
+
+    Rating Scores:
+
+    The default prompts ask for questions rating the candidate on a 1-10
+    scale. Their answers are free text ("8/10 - strong Python background",
+    "Educated guess: 7. ..."), so when a summary is stored the answers of
+    rating questions are parsed into numbers and kept in the summary_score
+    table, where candidates can be sorted and filtered by score in SQL.
+
+    Answers without a recognizable 1-10 rating get no score.
+
+"""
+
+MIN_SCORE, MAX_SCORE = 1, 10
+
+# Questions asking for a rating on a 1-10 scale
+RATING_QUESTION = re.compile(
+    r"\b(?:1|one)\s*(?:-|–|to)\s*(?:10|ten)\b|\bout\s+of\s+(?:10|ten)\b|/\s*10\b",
+    re.IGNORECASE
+)
+
+NUMBER = r"(\d+(?:\.\d+)?)"
+
+# "8/10", "8 / 10", "8 out of 10"
+EXPLICIT_SCORE = re.compile(NUMBER + r"\s*(?:/|out\s+of)\s*10\b", re.IGNORECASE)
+
+# Numbers that are quantities rather than ratings, e.g. "5 years", "90%", "10+"
+QUANTITY = re.compile(r"\s*(?:\+|%|years?\b|yrs?\b|months?\b|people\b|staff\b|members?\b)", re.IGNORECASE)
+
+# Function to check whether a question asks for a 1-10 rating
+def is_rating_question(question):
+    return bool(question) and RATING_QUESTION.search(question) is not None
+
+# Function to read the 1-10 rating of an answer
+def parse_score(answer):
+    """
+    Read the 1-10 rating given in an answer.
+
+    "7/10" and "7 out of 10" are preferred anywhere in the answer, otherwise
+    the first number that is not a quantity (years, percentages, ...) is used.
+
+    Parameters:
+    - answer: The answer text, or a number.
+
+    Returns:
+    - float: The rating, or None if the answer has no rating between 1 and 10.
+    """
+    if isinstance(answer, (int, float)) and not isinstance(answer, bool):
+        return float(answer) if MIN_SCORE <= answer <= MAX_SCORE else None
+    answer = str(answer or "")
+    match = EXPLICIT_SCORE.search(answer)
+    if match is None:
+        match = next((
+            number for number in re.finditer(NUMBER, answer)
+            if not QUANTITY.match(answer, number.end())
+        ), None)
+    if match is None:
+        return None
+    score = float(match.group(1))
+    return score if MIN_SCORE <= score <= MAX_SCORE else None
@@ -0,0 +1,181 @@
+# Importing necessary modules for the full-text search index
+from sqlalchemy import event, text
+from models import mapper_registry
+from metrics import timed_query
+import html, re
+
+"""
+
+    Full-Text Search:
+
+    Summary answers (summary_item.description) and extracted CV texts
+    (temp_file.text) are searchable per user, e.g. "candidates who mention
+    Kubernetes", without exporting every summary.
+
+    - Postgres: a stored generated tsvector column next to each column
+      (description_tsv, text_tsv) with a GIN index, kept up to date by
+      Postgres on every insert and update. Queries use
+      websearch_to_tsquery syntax ("quoted phrases", or, -excluded) and are
+      ranked with ts_rank_cd, snippets come from ts_headline.
+    - SQLite (tests and local runs): FTS5 tables with external content,
+      kept up to date by triggers on insert, update and delete. Every word
+      of the query must match, hits are ranked with bm25.
+
+    The indexes are created with the tables (create_all) and backfilled
+    when they are added to an existing database.
+
+    Snippets are HTML escaped, matched words are wrapped in <mark> tags.
+
+"""
+
+# Markers around matched words in snippets, replaced by <mark> tags once the snippet is escaped
+START_MARK, STOP_MARK = "\x02", "\x03"
+
+SEARCH_KINDS = ("summaries", "cvs")
+
+# Indexed columns: (table, column)
+INDEXED_COLUMNS = (("summary_item", "description"), ("temp_file", "text"))
+
+# Function to create the Postgres search columns and indexes
+def _create_postgres_indexes(connection):
+    for table, column in INDEXED_COLUMNS:
+        # Stored so ranking reads the vectors instead of parsing every matching text again
+        connection.execute(text(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column}_tsv tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('english', coalesce({column}, ''))) STORED"
+        ))
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_{column}_tsv ON {table} USING gin ({column}_tsv)"))
+
+# Function to create the SQLite search tables and the triggers maintaining them
+def _create_sqlite_indexes(connection):
+    for table, column in INDEXED_COLUMNS:
+        fts = f"{table}_fts"
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": fts}
+        ).first()
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{column}, content='{table}', content_rowid='id', tokenize='porter unicode61')"
+        ))
+        insert = f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column});"
+        remove = f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});"
+        connection.execute(text(f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN {insert} END"))
+        connection.execute(text(f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN {remove} END"))
+        # Only changes of the indexed column touch the index, not every update of the row
+        connection.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column} ON {table} BEGIN {remove} {insert} END"
+        ))
+        if not exists:
+            # Index the rows written before the search table existed
+            connection.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+# Create the search indexes whenever the schema is created, existing indexes are kept
+@event.listens_for(mapper_registry.metadata, "after_create")
+def create_search_indexes(target, connection, **kwargs):
+    if connection.dialect.name == "postgresql":
+        _create_postgres_indexes(connection)
+    elif connection.dialect.name == "sqlite":
+        _create_sqlite_indexes(connection)
+
+# Drop the SQLite search tables with the schema, they would outlive their content tables
+@event.listens_for(mapper_registry.metadata, "after_drop")
+def drop_search_indexes(target, connection, **kwargs):
+    if connection.dialect.name == "sqlite":
+        for table, column in INDEXED_COLUMNS:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table}_fts"))
+
+# Function to turn a snippet with match markers into escaped HTML
+def format_snippet(snippet):
+    escaped = html.escape(snippet or "")
+    return escaped.replace(START_MARK, "<mark>").replace(STOP_MARK, "</mark>")
+
+# Function to get the SQL of a search
+def _search_sql(dialect, kind, job_id):
+    """
+    Get the SQL of a search over summary answers or CV texts.
+
+    The statements take :query, :user_id, :job_id and :limit parameters and
+    return record_id, job_id, job_title, summary_id, title, snippet and
+    score columns, best hits first.
+    """
+    if kind == "summaries":
+        table, column, title = "summary_item", "description", "record.title"
+        joins = "JOIN summary ON summary.id = record.summary_id JOIN form ON form.id = summary.form_id"
+    else:
+        table, column, title = "temp_file", "text", "record.filename"
+        # Summarized CVs only keep their job through their summary
+        joins = "LEFT JOIN summary ON summary.id = record.summary_id JOIN form ON form.id = coalesce(record.form_id, summary.form_id)"
+    scope = "form.user_account_id = :user_id" + (" AND form.id = :job_id" if job_id is not None else "")
+
+    if dialect == "postgresql":
+        # Rank in the inner query so ts_headline only runs on the returned hits
+        return f"""
+            SELECT hit.record_id, hit.job_id, hit.job_title, hit.summary_id, hit.title, hit.score,
+                   ts_headline('english', record.{column}, hit.query,
+                               'StartSel={START_MARK}, StopSel={STOP_MARK}, MaxWords=24, MinWords=8, MaxFragments=2') AS snippet
+            FROM (
+                SELECT record.id AS record_id, form.id AS job_id, form.job_title, record.summary_id AS summary_id,
+                       {title} AS title, ts_rank_cd(record.{column}_tsv, query.query) AS score, query.query
+                FROM {table} AS record {joins}, websearch_to_tsquery('english', :query) AS query(query)
+                WHERE record.{column}_tsv @@ query.query AND {scope}
+                ORDER BY score DESC, record.id
+                LIMIT :limit
+            ) AS hit
+            JOIN {table} AS record ON record.id = hit.record_id
+            ORDER BY hit.score DESC, hit.record_id
+        """
+    return f"""
+        SELECT record.id AS record_id, form.id AS job_id, form.job_title, record.summary_id AS summary_id,
+               {title} AS title, -bm25({table}_fts) AS score,
+               snippet({table}_fts, 0, '{START_MARK}', '{STOP_MARK}', '…', 16) AS snippet
+        FROM {table}_fts JOIN {table} AS record ON record.id = {table}_fts.rowid {joins}
+        WHERE {table}_fts MATCH :query AND {scope}
+        ORDER BY bm25({table}_fts), record.id
+        LIMIT :limit
+    """
+
+# Function to turn a free-text query into an FTS5 query matching every word
+def _fts5_query(query):
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", query))
+
+# Function to search the summaries and CV texts of a user
+@timed_query
+def db_search(session, user_id, query, job_id=None, kinds=SEARCH_KINDS, limit=20):
+    """
+    Search the summary answers and CV texts of a user's jobs.
+
+    Parameters:
+    - session: The SQLAlchemy session.
+    - user_id: The ID of the user_account, only their jobs are searched.
+    - query: The search text.
+    - job_id: Only search this job (all jobs of the user if None).
+    - kinds: "summaries" and/or "cvs".
+    - limit: The maximum number of hits per kind.
+
+    Returns:
+    - dict: A list of hits per kind, best first. Each hit has the record_id,
+      job_id, job_title, summary_id, title (question or filename), an HTML
+      snippet and a score comparable within its kind only.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect != "postgresql":
+        query = _fts5_query(query or "")
+    results = {kind: [] for kind in kinds if kind in SEARCH_KINDS}
+    if not (query or "").strip():
+        return results
+    parameters = {"query": query, "user_id": user_id, "job_id": job_id, "limit": limit}
+    for kind in results:
+        rows = session.execute(text(_search_sql(dialect, kind, job_id)), parameters).mappings()
+        results[kind] = [
+            {
+                "record_id": row["record_id"],
+                "job_id": row["job_id"],
+                "job_title": row["job_title"],
+                "summary_id": row["summary_id"],
+                "title": row["title"],
+                "snippet": format_snippet(row["snippet"]),
+                "score": float(row["score"]),
+            }
+            for row in rows
+        ]
+    return results
@@ -1,7 +1,19 @@
 from sqlalchemy import create_engine, event
 from sqlalchemy.orm import Session
 from crud import *
-import os, unittest, re
+from export import write_csv, write_arrow, _schema
+from prompt import estimate_cost, create_chat_completion
+from bench_ai import StubOpenAI
+import bench_extract
+import blobstore, routing, results, scheduler, metrics, tracing, dedupe, prerank
+from search import db_search
+from scores import is_rating_question, parse_score
+import ranking, question_cache
+from prometheus_client import REGISTRY
+from contextlib import nullcontext
+from unittest.mock import patch
+from celery import Celery
+import os, unittest, re, csv, tempfile, io, json, hashlib, time
 
 DB_TEST_URL = "sqlite:///test_db.sqlite"
 
@@ -130,6 +142,785 @@ class SummaryTestCase(unittest.TestCase):
       result = get_all_records(session, SummaryItem, summary_id=1)
       self.assertEqual(len(result), 0)
 
+class ExportTestCase(unittest.TestCase):
+
+  def test_step_1_iter_summary_rows(self):
+    with Session(engine) as session:
+      user_id = add_record(session, UserAccount, username="exporter", password="password", email="exporter@example.com")
+      form_id = add_record(session, Form, job_title="Data Engineer", user_account_id=user_id)
+      add_record(session, Question, form_id=form_id, value="Name?")
+      add_record(session, Question, form_id=form_id, value="Email?")
+      db_add_summary(session, {"Name?": "Alice", "Email?": "alice@example.com"}, form_id)
+      db_add_summary(session, {"Name?": "Bob", "Email?": "bob@example.com"}, form_id)
+
+      rows = [values for _, values in iter_summary_rows(session, form_id, user_id, batch_size=1)]
+      self.assertEqual(rows, [["Alice", "alice@example.com"], ["Bob", "bob@example.com"]])
+
+  def test_step_2_iter_summary_rows_other_user(self):
+    with Session(engine) as session:
+      user = get_record(session, UserAccount, username="exporter")
+      form = get_record(session, Form, job_title="Data Engineer")
+      rows = list(iter_summary_rows(session, form.id, user.id + 1))
+      self.assertEqual(rows, [])
+
+  def test_step_3_iter_summary_rows_by_question(self):
+    with Session(engine) as session:
+      user = get_record(session, UserAccount, username="exporter")
+      form = get_record(session, Form, job_title="Data Engineer")
+      db_add_summary(session, {"Email?": "carol@example.com", "Name?": "Carol"}, form.id)
+      db_add_summary(session, {"Email?": "dave@example.com"}, form.id)
+
+      rows = [values for _, values in iter_summary_rows(session, form.id, user.id)]
+      self.assertEqual(rows[2:], [["Carol", "carol@example.com"], ["", "dave@example.com"]])
+
+class PaginationTestCase(unittest.TestCase):
+
+  def test_step_1_paginate_jobs(self):
+    with Session(engine) as session:
+      user_id = add_record(session, UserAccount, username="paginator", password="password", email="paginator@example.com")
+      for index in range(5):
+        add_record(session, Form, job_title=f"Job {index}", user_account_id=user_id)
+
+      page = db_paginate(db_get_jobs(session, user_id, limit=3), 2)
+      self.assertEqual([job["job_title"] for job in page["items"]], ["Job 0", "Job 1"])
+      self.assertEqual(page["next_cursor"], page["items"][-1]["id"])
+
+      page = db_paginate(db_get_jobs(session, user_id, limit=3, after_id=page["next_cursor"]), 2)
+      self.assertEqual([job["job_title"] for job in page["items"]], ["Job 2", "Job 3"])
+
+      page = db_paginate(db_get_jobs(session, user_id, limit=3, after_id=page["next_cursor"]), 2)
+      self.assertEqual([job["job_title"] for job in page["items"]], ["Job 4"])
+      self.assertIsNone(page["next_cursor"])
+
+  def test_step_2_project_jobs(self):
+    with Session(engine) as session:
+      user = get_record(session, UserAccount, username="paginator")
+      jobs = db_get_jobs(session, user.id, fields=["job_title", "summaries"])
+      self.assertEqual(set(jobs[0]), {"id", "job_title", "summaries"})
+      self.assertEqual(jobs[0]["summaries"], 0)
+
+  def test_step_3_paginate_summaries(self):
+    with Session(engine) as session:
+      user = get_record(session, UserAccount, username="paginator")
+      form = get_record(session, Form, job_title="Job 0")
+      for name in ["Alice", "Bob", "Carol"]:
+        db_add_summary(session, {"English name?": name, "Experience?": "Long answer"}, form.id)
+
+      summaries = db_get_all_summaries(session, form.id, user.id, limit=2, fields=["english"])
+      self.assertEqual([summary["summary_items"] for summary in summaries], [{"English name?": "Alice"}, {"English name?": "Bob"}])
+
+      summaries = db_get_all_summaries(session, form.id, user.id, after_id=summaries[-1]["summary_id"])
+      self.assertEqual(summaries[0]["summary_items"], {"English name?": "Carol", "Experience?": "Long answer"})
+      self.assertEqual(db_get_jobs(session, user.id, fields=["summaries"])[0]["summaries"], 3)
+
+class LLMUsageTestCase(unittest.TestCase):
+
+  def test_step_1_estimate_cost(self):
+    self.assertAlmostEqual(estimate_cost("gpt-4o-mini-2024-07-18", 1000000, 1000000), 0.75)
+    self.assertAlmostEqual(estimate_cost("gpt-4o", 1000000, 0, cached_tokens=1000000), 1.25)
+    self.assertIsNone(estimate_cost("unknown-model", 10, 10))
+
+  def test_step_2_record_calls(self):
+    usage = {"model": "gpt-4o", "prompt_tokens": 1000, "completion_tokens": 200, "cached_tokens": 0, "latency_seconds": 1.5, "cost": 0.01}
+    with Session(engine) as session:
+      user_id = add_record(session, UserAccount, username="llm", password="password", email="llm@example.com")
+      job_id = add_record(session, Form, job_title="LLM Job", user_account_id=user_id)
+      db_record_llm_call(session, usage, "summarize_cv", "INVALID_JSON", user_id=user_id, job_id=job_id, attempt=1)
+      db_record_llm_call(session, usage, "summarize_cv", "SUCCESS", user_id=user_id, job_id=job_id, attempt=2)
+      db_record_llm_call(session, usage, "formulate_questions", "SUCCESS", user_id=user_id)
+
+      jobs = db_get_llm_usage(session, user_id=user_id, group_by="job")
+      self.assertEqual([(row["job_id"], row["calls"], row["failures"]) for row in jobs], [(None, 1, 0), (job_id, 2, 1)])
+      self.assertEqual(db_get_llm_usage(session, user_id=user_id)[0]["prompt_tokens"], 3000)
+      self.assertAlmostEqual(db_get_llm_usage(session, job_id=job_id, group_by=None)[0]["cost"], 0.02)
+
+      # Calls outlive their job, its totals move to the calls outside a job
+      delete_record(session, Form, id=job_id)
+      self.assertEqual(len(get_all_records(session, LLMCall, user_account_id=user_id)), 3)
+      self.assertEqual(db_get_llm_usage(session, user_id=user_id, group_by=None)[0]["calls"], 3)
+
+class DedupeTestCase(unittest.TestCase):
+
+  cv = " ".join(f"Worked as engineer number {index} at a Hong Kong bank on payments" for index in range(40))
+
+  def test_step_1_minhash_similarity(self):
+    edited = self.cv.replace("number 3 ", "number three ")
+    self.assertGreaterEqual(dedupe.similarity(dedupe.minhash(self.cv), dedupe.minhash(edited)), 0.9)
+    self.assertLess(dedupe.similarity(dedupe.minhash(self.cv), dedupe.minhash("Marketing manager in Shanghai " * 20)), 0.5)
+    self.assertIsNone(dedupe.minhash("  "))
+    signature = dedupe.minhash(self.cv)
+    self.assertEqual(dedupe.unpack_signature(dedupe.pack_signature(signature)), signature)
+
+  def test_step_2_find_duplicate_of_summarized_cv(self):
+    with Session(engine) as session:
+      user_id = add_record(session, UserAccount, username="dedupe", password="password", email="dedupe@example.com")
+      job_id = add_record(session, Form, job_title="Dedupe Job", user_account_id=user_id)
+      other_job_id = add_record(session, Form, job_title="Other Job", user_account_id=user_id)
+      summary_id = add_record(session, Summary, form_id=job_id)
+      fingerprint = dedupe.pack_signature(dedupe.minhash(self.cv))
+      summarized_id = add_record(session, TempFile, filename="first.pdf", summary_id=summary_id, fingerprint=fingerprint)
+      new_id = add_record(session, TempFile, filename="again.pdf", form_id=job_id, fingerprint=fingerprint)
+      elsewhere_id = add_record(session, TempFile, filename="other.pdf", form_id=other_job_id, fingerprint=fingerprint)
+
+      duplicate, score = db_find_duplicate(session, get_record(session, TempFile, id=new_id), user_id, job_id)
+      self.assertEqual((duplicate.id, score), (summarized_id, 1.0))
+      # Another user's CVs are never matched
+      self.assertEqual(db_find_duplicate(session, get_record(session, TempFile, id=new_id), user_id + 1, job_id), (None, 0.0))
+      duplicate, _ = db_find_duplicate(session, get_record(session, TempFile, id=elsewhere_id), user_id, other_job_id)
+      self.assertIn(duplicate.id, (summarized_id, new_id))
+
+  def test_step_3_band_keys_follow_fingerprints(self):
+    with Session(engine) as session:
+      user_id = add_record(session, UserAccount, username="bands", password="password", email="bands@example.com")
+      job_id = add_record(session, Form, job_title="Bands Job", user_account_id=user_id)
+      fingerprint = dedupe.pack_signature(dedupe.minhash(self.cv))
+      first_id = add_record(session, TempFile, filename="first.pdf", form_id=job_id, fingerprint=fingerprint)
+      self.assertEqual(session.query(FingerprintBand).filter_by(temp_file_id=first_id).count(), dedupe.BANDS)
+
+      # Fingerprints stored before band keys existed are indexed on the next lookup
+      session.query(FingerprintBand).filter_by(temp_file_id=first_id).delete()
+      session.commit()
+      second_id = add_record(session, TempFile, filename="second.pdf", form_id=job_id, fingerprint=fingerprint)
+      duplicate, _ = db_find_duplicate(session, get_record(session, TempFile, id=second_id), user_id, job_id)
+      self.assertEqual(duplicate.id, first_id)
+      self.assertEqual(session.query(FingerprintBand).filter_by(temp_file_id=first_id).count(), dedupe.BANDS)
+
+      # A new text replaces the band keys
+      record = get_record(session, TempFile, id=first_id)
+      record.fingerprint = dedupe.pack_signature(dedupe.minhash("Marketing manager in Shanghai " * 20))
+      session.commit()
+      self.assertEqual(db_find_duplicate(session, get_record(session, TempFile, id=second_id), user_id, job_id), (None, 0.0))
+
+class ScoreTestCase(unittest.TestCase):
+
+  def test_step_1_parse_score(self):
+    self.assertTrue(is_rating_question("Rate the candidate's Python skills on a 1-10 scale"))
+    self.assertFalse(is_rating_question("Why does this rating apply?"))
+    self.assertEqual(parse_score("Educated guess: 5 years of Python, so 7/10."), 7.0)
+    self.assertEqual(parse_score("8. Led payment teams."), 8.0)
+    self.assertEqual(parse_score(9), 9.0)
+    self.assertIsNone(parse_score("No Info"))
+    self.assertIsNone(parse_score("Graduated in 2015."))
+
+  def test_step_2_sort_and_filter_by_score(self):
+    with Session(engine) as session:
+      user_id = add_record(session, UserAccount, username="scores", password="password", email="scores@example.com")
+      job_id = add_record(session, Form, job_title="Scored Job", user_account_id=user_id)
+      rating = "Rate the candidate's fit on a 1-10 scale?"
+      rating_id = add_record(session, Question, form_id=job_id, value=rating)
+      add_record(session, Question, form_id=job_id, value="English name?")
+      for name, answer in (("Alice", "6/10"), ("Bob", "9 - excellent"), ("Carol", "No Info")):
+        db_add_summary(session, {"English name?": name, rating: answer}, job_id)
+
+      self.assertEqual(session.query(SummaryScore).filter_by(form_id=job_id).count(), 2)
+      self.assertEqual(session.query(SummaryItem).filter_by(title=rating).first().question_id, rating_id)
+
+      ranked = db_get_all_summaries(session, job_id, user_id, score_question_id=rating_id)
+      self.assertEqual([(summary["summary_items"]["English name?"], summary["score"]) for summary in ranked], [("Bob", 9.0), ("Alice", 6.0), ("Carol", None)])
+      ranked = db_get_all_summaries(session, job_id, user_id, score_question_id=rating_id, descending=False, limit=1, offset=1)
+      self.assertEqual([summary["score"] for summary in ranked], [9.0])
+      shortlisted = db_get_all_summaries(session, job_id, user_id, score_question_id=rating_id, min_score=7)
+      self.assertEqual([summary["summary_items"]["English name?"] for summary in shortlisted], ["Bob"])
+
+class RankingTestCase(unittest.TestCase):
+
+  def test_step_1_weighted_ranking(self):
+    with Session(engine) as session:
+      user_id = add_record(session, UserAccount, username="ranking", password="password", email="ranking@example.com")
+      job_id = add_record(session, Form, job_title="Ranked Job", user_account_id=user_id)
+      technical, language = "Technical fit (1-10)?", "Language skills (1-10)?"
+      technical_id = add_record(session, Question, form_id=job_id, value=technical)
+      language_id = add_record(session, Question, form_id=job_id, value=language)
+      alice = db_add_summary(session, {technical: "9/10", language: "3/10"}, job_id)
+      bob = db_add_summary(session, {technical: "5/10", language: "9/10"}, job_id)
+
+      result = ranking.rank_candidates(session, job_id, user_id)
+      self.assertEqual([candidate["summary_id"] for candidate in result["candidates"]], [bob, alice])
+      loads = ranking.matrix_cache.loads
+      result = ranking.rank_candidates(session, job_id, user_id, weights={str(technical_id): 3}, top_k=1)
+      self.assertEqual([(candidate["summary_id"], candidate["score"]) for candidate in result["candidates"]], [(alice, 7.5)])
+      self.assertEqual(result["candidates"][0]["percentile"], 50.0)
+      self.assertEqual(ranking.matrix_cache.loads, loads)
+      self.assertIsNone(ranking.rank_candidates(session, job_id, user_id + 1))
+
+      # A new summary invalidates the cached matrix
+      carol = db_add_summary(session, {technical: "10/10", language: "10/10"}, job_id)
+      result = ranking.rank_candidates(session, job_id, user_id, weights={language_id: 0})
+      self.assertEqual([candidate["summary_id"] for candidate in result["candidates"]], [carol, alice, bob])
+      self.assertEqual(ranking.matrix_cache.loads, loads + 1)
+
+class ResummarizeTestCase(unittest.TestCase):
+
+  def test_step_1_merge_new_and_edited_questions(self):
+    with Session(engine) as session:
+      user_id = add_record(session, UserAccount, username="delta", password="password", email="delta@example.com")
+      job_id = add_record(session, Form, job_title="Delta Job", user_account_id=user_id)
+      name_id, fit_id = db_set_questions(session, job_id, user_id, [{"value": "English name?"}, {"value": "Fit (1-10)?"}])
+      summary_id = db_add_summary(session, {"English name?": "Alice", "Fit (1-10)?": "6/10"}, job_id)
+
+      # Edit the rating question, add one and keep the name
+      question_ids = db_set_questions(session, job_id, user_id, [
+        {"id": name_id, "value": "English name?"},
+        {"id": fit_id, "value": "Python fit (1-10)?"},
+        {"value": "Chinese name?"},
+      ])
+      self.assertEqual(question_ids[:2], [name_id, fit_id])
+      self.assertIsNone(db_set_questions(session, job_id, user_id + 1, []))
+      self.assertEqual(session.query(SummaryScore).filter_by(summary_id=summary_id).count(), 0)
+
+      summary = get_record(session, Summary, id=summary_id)
+      questions = sorted(get_record(session, Form, id=job_id).questions, key=lambda question: question.id)
+      missing = db_missing_questions(summary, questions)
+      self.assertEqual([question.value for question in missing], ["Python fit (1-10)?", "Chinese name?"])
+
+      db_merge_summary(session, {"Python fit (1-10)?": "8/10", "Chinese name?": "Ai Li"}, summary_id, job_id)
+      self.assertEqual(db_get_summary(session, summary_id)["summary_items"], {
+        "English name?": "Alice", "Python fit (1-10)?": "8/10", "Chinese name?": "Ai Li"
+      })
+      self.assertEqual([score.score for score in session.query(SummaryScore).filter_by(summary_id=summary_id)], [8.0])
+      self.assertEqual(db_missing_questions(get_record(session, Summary, id=summary_id), questions), [])
+
+  def test_step_2_merge_unlinked_summary(self):
+    with Session(engine) as session:
+      user_id = add_record(session, UserAccount, username="echo", password="password", email="echo@example.com")
+      job_id = add_record(session, Form, job_title="Echo Job", user_account_id=user_id)
+      name_id, fit_id, team_id = db_set_questions(session, job_id, user_id, [{"value": "English name?"}, {"value": "Fit (1-10)?"}, {"value": "Team size?"}])
+      # Summaries saved before their items were linked to questions
+      summary_id = add_record(session, Summary, form_id=job_id)
+      for title, description in [("English name?", "Alice"), ("Fit (1-10)?", "6/10"), ("Team size?", "5")]:
+        add_record(session, SummaryItem, summary_id=summary_id, title=title, description=description)
+
+      # Edit the rating question and delete the team size
+      db_set_questions(session, job_id, user_id, [{"id": name_id, "value": "English name?"}, {"id": fit_id, "value": "Python fit (1-10)?"}])
+      summary = get_record(session, Summary, id=summary_id)
+      questions = sorted(get_record(session, Form, id=job_id).questions, key=lambda question: question.id)
+      self.assertEqual([question.value for question in db_missing_questions(summary, questions)], ["Python fit (1-10)?"])
+
+      db_merge_summary(session, {"Python fit (1-10)?": "8/10"}, summary_id, job_id)
+      self.assertEqual(db_get_summary(session, summary_id)["summary_items"], {"English name?": "Alice", "Python fit (1-10)?": "8/10"})
+      items = session.query(SummaryItem).filter_by(summary_id=summary_id).order_by(SummaryItem.id)
+      self.assertEqual([item.question_id for item in items], [name_id, fit_id])
+
+class QuestionCacheTestCase(unittest.TestCase):
+
+  def test_step_1_cache_key(self):
+    key = question_cache.cache_key("gpt-4o", "Prompt", "Data Engineer", "A bank.", "Build  pipelines.", "Python", "")
+    self.assertEqual(key, question_cache.cache_key("gpt-4o", "Prompt", "data engineer ", "A bank.", "Build pipelines.", "Python", None))
+    self.assertNotEqual(key, question_cache.cache_key("gpt-4o-mini", "Prompt", "Data Engineer", "A bank.", "Build pipelines.", "Python", ""))
+    self.assertTrue(question_cache.is_cacheable('```json\n{"Name?": "Conrad"}```'))
+    self.assertFalse(question_cache.is_cacheable("Sorry, I cannot help."))
+
+  def test_step_2_ttl_and_lru_eviction(self):
+    with Session(engine) as session:
+      db_cache_questions(session, "a" * 64, "gpt-4o", '{"A?": "1"}', size=2)
+      db_cache_questions(session, "b" * 64, "gpt-4o", '{"B?": "1"}', size=2)
+      self.assertEqual(db_get_cached_questions(session, "a" * 64, ttl=60), '{"A?": "1"}')
+      # "b" is now the least recently used entry
+      db_cache_questions(session, "c" * 64, "gpt-4o", '{"C?": "1"}', size=2)
+      self.assertIsNone(db_get_cached_questions(session, "b" * 64, ttl=60))
+      self.assertEqual(get_record(session, QuestionCache, key="a" * 64).hits, 1)
+      entry = get_record(session, QuestionCache, key="c" * 64)
+      entry.created_at = datetime.utcnow() - timedelta(seconds=120)
+      session.commit()
+      self.assertIsNone(db_get_cached_questions(session, "c" * 64, ttl=60))
+
+class SearchTestCase(unittest.TestCase):
+
+  def test_step_1_search_summaries_and_cvs(self):
+    with Session(engine) as session:
+      user_id = add_record(session, UserAccount, username="search", password="password", email="search@example.com")
+      job_id = add_record(session, Form, job_title="Platform Engineer", user_account_id=user_id)
+      summary_id = add_record(session, Summary, form_id=job_id)
+      add_record(session, SummaryItem, summary_id=summary_id, title="Cloud skills?", description="Ran <b>Kubernetes</b> clusters for payments.")
+      add_record(session, SummaryItem, summary_id=summary_id, title="Languages?", description="English and Cantonese.")
+      file_id = add_record(session, TempFile, filename="platform.pdf", form_id=job_id, summary_id=summary_id)
+      # Texts extracted after the upload are indexed on update
+      record = get_record(session, TempFile, id=file_id)
+      record.text = "Site reliability engineer, deployed Kubernetes and Terraform."
+      session.commit()
+
+      hits = db_search(session, user_id, "kubernetes")
+      self.assertEqual([hit["title"] for hit in hits["summaries"]], ["Cloud skills?"])
+      self.assertEqual(hits["summaries"][0]["job_id"], job_id)
+      self.assertIn("<mark>Kubernetes</mark>", hits["summaries"][0]["snippet"])
+      self.assertIn("&lt;b&gt;", hits["summaries"][0]["snippet"])
+      self.assertEqual([hit["record_id"] for hit in hits["cvs"]], [file_id])
+      # Summarized CVs are only linked to their job through their summary
+      other_summary_id = add_record(session, Summary, form_id=job_id)
+      summarized_id = add_record(session, TempFile, filename="guru.pdf", summary_id=other_summary_id)
+      get_record(session, TempFile, id=summarized_id).text = "Kubernetes guru and Helm maintainer."
+      session.commit()
+      hits = db_search(session, user_id, "helm", job_id=job_id, kinds=["cvs"])["cvs"]
+      self.assertEqual([(hit["record_id"], hit["job_id"]) for hit in hits], [(summarized_id, job_id)])
+      # Stemmed words, punctuation and other users
+      self.assertEqual(len(db_search(session, user_id, "deploying terraform!", kinds=["cvs"])["cvs"]), 1)
+      self.assertEqual(db_search(session, user_id + 1, "kubernetes"), {"summaries": [], "cvs": []})
+      self.assertEqual(db_search(session, user_id, "kubernetes", job_id=job_id + 1)["cvs"], [])
+
+      delete_record(session, SummaryItem, title="Cloud skills?")
+      self.assertEqual(db_search(session, user_id, "kubernetes")["summaries"], [])
+
+class ExportFormatTestCase(unittest.TestCase):
+
+  def test_step_1_write_csv(self):
+    with tempfile.TemporaryDirectory() as directory:
+      filepath = os.path.join(directory, "export.csv")
+      write_csv(filepath, ["Name?", "Rating?"], iter([(1, ["Alice", "8"]), (2, ["Bob"])]))
+      with open(filepath, newline="") as file:
+        self.assertEqual(list(csv.reader(file)), [["Name?", "Rating?"], ["Alice", "8"], ["Bob", ""]])
+
+  def test_step_2_column_schema(self):
+    try:
+      import pyarrow
+    except ImportError:
+      self.skipTest("pyarrow is not installed")
+    self.assertEqual(_schema(["Name?", "Name?"]).names, ["summary_id", "Name?", "Name? (2)"])
+
+  def test_step_3_rating_columns(self):
+    try:
+      import pyarrow as pa
+    except ImportError:
+      self.skipTest("pyarrow is not installed")
+    with tempfile.TemporaryDirectory() as directory:
+      filepath = os.path.join(directory, "export.arrow")
+      write_arrow(filepath, ["Name?", "Fit (1-10)?"], iter([(1, ["Alice", "8/10"]), (2, ["Bob", "No rating"])]))
+      with pa.memory_map(filepath) as source:
+        table = pa.ipc.open_file(source).read_all()
+    self.assertEqual(table.schema.field("Fit (1-10)?").type, pa.float64())
+    self.assertEqual(table.column("Fit (1-10)?").to_pylist(), [8.0, None])
+    self.assertEqual(table.column("Name?").to_pylist(), ["Alice", "Bob"])
+
+class ExtractTestCase(unittest.TestCase):
+
+  def test_step_1_compact_text(self):
+    self.assertEqual(compact_text("  John   Doe \n\n\n\nPython\t\tSQL  "), "John Doe\n\nPython SQL")
+
+  def test_step_2_extract_unsupported_file(self):
+    with Session(engine) as session:
+      tempfile_id = add_record(session, TempFile, filename="notes.txt")
+      db_file = get_record(session, TempFile, id=tempfile_id)
+      self.assertIsNone(db_extract_file(session, db_file))
+      self.assertIsNone(db_file.text)
+
+  def test_step_3_extract_generated_corpus(self):
+    with tempfile.TemporaryDirectory() as directory:
+      for path in bench_extract.generate(directory, 1, 0):
+        self.assertIn("Candidate", extract_text(path), path)
+
+class BlobTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.files_dir = blobstore.FILES_DIR
+    blobstore.FILES_DIR = self.directory.name
+
+  def tearDown(self):
+    blobstore.FILES_DIR = self.files_dir
+    self.directory.cleanup()
+
+  def test_step_1_blob_reference_counting(self):
+    sha256 = "ab" * 32
+    filepath = blobstore.blob_filepath(sha256)
+    self.assertTrue(filepath.endswith(os.path.join("blobs", "ab", "ab", sha256)))
+    os.makedirs(os.path.dirname(filepath))
+    open(filepath, "wb").close()
+
+    with Session(engine) as session:
+      first_id = add_record(session, TempFile, filename="cv.pdf", blob_id=db_acquire_blob(session, sha256, 0).id)
+      second_id = add_record(session, TempFile, filename="cv.pdf", blob_id=db_acquire_blob(session, sha256, 0).id)
+      self.assertEqual(get_record(session, Blob, sha256=sha256).ref_count, 2)
+
+      self.assertTrue(db_delete_tempfile(session, get_record(session, TempFile, id=first_id)))
+      self.assertEqual(get_record(session, Blob, sha256=sha256).ref_count, 1)
+      self.assertTrue(os.path.exists(filepath))
+
+      self.assertTrue(db_delete_tempfile(session, get_record(session, TempFile, id=second_id)))
+      self.assertIsNone(get_record(session, Blob, sha256=sha256))
+      self.assertFalse(os.path.exists(filepath))
+
+  def test_step_2_extract_blob_stored_cvs(self):
+    with tempfile.TemporaryDirectory() as directory, Session(engine) as session:
+      paths = bench_extract.generate(directory, 1, 0)
+      for path in [path for path in paths if os.path.basename(path) in ("pdf-simple-0.pdf", "docx-simple-0.docx")]:
+        with open(path, "rb") as file:
+          content = file.read()
+        sha256 = hashlib.sha256(content).hexdigest()
+        os.makedirs(os.path.dirname(blobstore.blob_filepath(sha256)), exist_ok=True)
+        with open(blobstore.blob_filepath(sha256), "wb") as file:
+          file.write(content)
+        blob_id = db_acquire_blob(session, sha256, len(content)).id
+        tempfile_id = add_record(session, TempFile, filename="upload" + os.path.splitext(path)[1], blob_id=blob_id)
+        db_file = get_record(session, TempFile, id=tempfile_id)
+        self.assertIn("Candidate", db_extract_file(session, db_file) or "", path)
+        self.assertIsNotNone(db_file.fingerprint)
+
+  def test_step_3_local_fetch_with_suffix(self):
+    sha256 = "cd" * 32
+    os.makedirs(os.path.dirname(blobstore.blob_filepath(sha256)))
+    with open(blobstore.blob_filepath(sha256), "wb") as file:
+      file.write(b"%PDF-1.4")
+    with blobstore.LocalBlobBackend().fetch(sha256, ".pdf") as filepath:
+      self.assertTrue(filepath.endswith(".pdf"))
+      with open(filepath, "rb") as file:
+        self.assertEqual(file.read(), b"%PDF-1.4")
+    self.assertFalse(os.path.exists(filepath))
+    self.assertTrue(os.path.exists(blobstore.blob_filepath(sha256)))
+    with blobstore.LocalBlobBackend().fetch(sha256) as filepath:
+      self.assertEqual(filepath, blobstore.blob_filepath(sha256))
+
+  def test_step_4_keep_blob_on_rollback(self):
+    sha256 = "ef" * 32
+    os.makedirs(os.path.dirname(blobstore.blob_filepath(sha256)))
+    open(blobstore.blob_filepath(sha256), "wb").close()
+
+    with Session(engine) as session:
+      tempfile_id = add_record(session, TempFile, filename="cv.pdf", blob_id=db_acquire_blob(session, sha256, 0).id)
+      release_tempfile(session, get_record(session, TempFile, id=tempfile_id))
+      self.assertIsNone(session.query(Blob).filter(Blob.sha256 == sha256).first())
+      self.assertTrue(os.path.exists(blobstore.blob_filepath(sha256)))
+      session.rollback()
+      self.assertEqual(get_record(session, Blob, sha256=sha256).ref_count, 1)
+      self.assertTrue(os.path.exists(blobstore.blob_filepath(sha256)))
+
+      release_tempfile(session, get_record(session, TempFile, id=tempfile_id))
+      session.commit()
+      self.assertFalse(os.path.exists(blobstore.blob_filepath(sha256)))
+
+  def test_step_5_commit_upload_after_reference(self):
+    content = b"%PDF-1.4 staged"
+    sha256 = hashlib.sha256(content).hexdigest()
+    os.makedirs(os.path.dirname(blobstore.blob_filepath(sha256)))
+    with open(blobstore.blob_filepath(sha256), "wb") as file:
+      file.write(content)
+    upload_dir = os.path.join(blobstore.FILES_DIR, "uploads", "upload-1")
+    os.makedirs(upload_dir)
+    with open(os.path.join(upload_dir, "data"), "wb") as file:
+      file.write(content)
+
+    with Session(engine) as session:
+      first_id = add_record(session, TempFile, filename="cv.pdf", blob_id=db_acquire_blob(session, sha256, len(content)).id)
+      # The new upload takes its reference before the previous one is released
+      second_id = add_record(session, TempFile, filename="cv.pdf", blob_id=db_acquire_blob(session, sha256, len(content)).id)
+      self.assertTrue(db_delete_tempfile(session, get_record(session, TempFile, id=first_id)))
+      self.assertTrue(blobstore.commit_upload(sha256, "upload-1"))
+      self.assertEqual(get_record(session, Blob, sha256=sha256).ref_count, 1)
+      self.assertEqual(get_record(session, TempFile, id=second_id).blob.sha256, sha256)
+    with open(blobstore.blob_filepath(sha256), "rb") as file:
+      self.assertEqual(file.read(), content)
+    self.assertFalse(os.path.exists(upload_dir))
+    self.assertFalse(blobstore.commit_upload(sha256, "upload-1"))
+
+  def test_step_6_delete_user_releases_blobs(self):
+    with Session(engine) as session:
+      user_id = add_record(session, UserAccount, username="foxtrot", password="password", email="foxtrot@example.com")
+      job_id = add_record(session, Form, job_title="Foxtrot Job", user_account_id=user_id)
+      summary_id = add_record(session, Summary, form_id=job_id)
+      digests = []
+      for index, (form_id, summary) in enumerate([(job_id, None), (None, summary_id)]):
+        sha256 = hashlib.sha256(b"user cv %d" % index).hexdigest()
+        os.makedirs(os.path.dirname(blobstore.blob_filepath(sha256)))
+        open(blobstore.blob_filepath(sha256), "wb").close()
+        add_record(session, TempFile, filename=f"cv{index}.pdf", form_id=form_id, summary_id=summary, blob_id=db_acquire_blob(session, sha256, 0).id)
+        digests.append(sha256)
+
+      self.assertTrue(db_delete_user(session, user_id))
+      for sha256 in digests:
+        self.assertIsNone(get_record(session, Blob, sha256=sha256))
+        self.assertFalse(os.path.exists(blobstore.blob_filepath(sha256)))
+      self.assertFalse(db_delete_user(session, user_id))
+
+class FakeS3Client:
+  """In-memory stand-in for an S3-compatible server such as MinIO."""
+
+  def __init__(self):
+    self.objects = {}
+
+  def upload_file(self, filename, bucket, key):
+    with open(filename, "rb") as file:
+      self.objects[(bucket, key)] = file.read()
+
+  def get_object(self, Bucket, Key):
+    return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+  def delete_object(self, Bucket, Key):
+    self.objects.pop((Bucket, Key), None)
+
+class S3BlobBackendTestCase(unittest.TestCase):
+
+  def test_step_1_store_fetch_delete(self):
+    with tempfile.TemporaryDirectory() as directory:
+      files_dir, blobstore.FILES_DIR = blobstore.FILES_DIR, directory
+      try:
+        sha256 = "ef" * 32
+        filepath = blobstore.blob_filepath(sha256)
+        os.makedirs(os.path.dirname(filepath))
+        with open(filepath, "wb") as file:
+          file.write(b"CV content")
+
+        client = FakeS3Client()
+        backend = blobstore.S3BlobBackend("cvs", prefix="prod/", client=client)
+        self.assertTrue(backend.store(sha256))
+        self.assertFalse(os.path.exists(filepath))
+        self.assertIn(("cvs", "prod/blobs/ef/ef/" + sha256), client.objects)
+
+        with backend.fetch(sha256, ".pdf") as fetched:
+          self.assertTrue(fetched.endswith(".pdf"))
+          with open(fetched, "rb") as file:
+            self.assertEqual(file.read(), b"CV content")
+        self.assertFalse(os.path.exists(fetched))
+
+        backend.delete(sha256)
+        self.assertEqual(client.objects, {})
+      finally:
+        blobstore.FILES_DIR = files_dir
+
+class RoutingTestCase(unittest.TestCase):
+
+  def test_step_1_task_lanes(self):
+    self.assertEqual(routing.task_queue("tasks.login_user"), "queue1")
+    self.assertEqual(routing.task_queue("tasks.export_summaries_csv"), "queue4")
+    self.assertEqual(routing.task_queue("tasks.dispatch_summarization"), "queue4")
+    self.assertEqual(routing.task_queue("tasks.schedule_summarization"), "queue4")
+    self.assertEqual(routing.task_queue("tasks.forgot_password_user"), "queue5")
+    self.assertEqual(routing.route_task("tasks.delete_job", [], {}, {}), {"queue": "queue4"})
+
+  def test_step_2_render_supervisord(self):
+    os.environ["LANE_BULK_CONCURRENCY"] = "3"
+    try:
+      config = routing.render_supervisord()
+    finally:
+      del os.environ["LANE_BULK_CONCURRENCY"]
+    # One worker per lane and celery beat
+    self.assertEqual(config.count("[program:celery_"), len(routing.LANES) + 1)
+    self.assertIn("-A worker.celery beat", config)
+    self.assertIn("-Q queue4 -n bulk@%%h -P prefork --prefetch-multiplier 1 -c 3 -O fair", config)
+    self.assertIn('environment=CELERY_POOL="threads",CELERY_CONCURRENCY="16"', config)
+
+class ResultsTestCase(unittest.TestCase):
+
+  def test_step_1_zjson_compresses_large_results(self):
+    small = {"status": "SUCCESS", "result": True}
+    large = {"status": "SUCCESS", "result": ["answer"] * 1000}
+    self.assertEqual(results.zjson_dumps(small)[:1], b"{")
+    self.assertLess(len(results.zjson_dumps(large)), results.RESULT_COMPRESS_THRESHOLD)
+    self.assertEqual(results.zjson_loads(results.zjson_dumps(small)), small)
+    self.assertEqual(results.zjson_loads(results.zjson_dumps(large)), large)
+
+  def test_step_2_result_policies(self):
+    app = Celery("tasks", broker="memory://", backend="cache+memory://")
+    results.configure_results(app)
+
+    @app.task(name="tasks.db_save_job")
+    def db_save_job():
+      return True
+
+    @app.task(name="tasks.get_jobs")
+    def get_jobs():
+      return []
+
+    self.assertTrue(db_save_job.ignore_result)
+    self.assertFalse(get_jobs.ignore_result)
+    meta = {"status": "SUCCESS", "result": ["answer"] * 1000}
+    self.assertEqual(app.backend.decode(app.backend.encode(meta)), meta)
+
+class FakeRedis:
+  """In-memory stand-in for the Redis commands used by the scheduler."""
+
+  def __init__(self):
+    self.values = {}
+
+  def get(self, key):
+    return self.values.get(key)
+
+  def set(self, key, value):
+    self.values[key] = value
+
+  def rpush(self, key, *values):
+    self.values.setdefault(key, []).extend(str(value).encode() for value in values)
+
+  def lpop(self, key):
+    values = self.values.get(key)
+    return values.pop(0) if values else None
+
+  def lpush(self, key, *values):
+    for value in values:
+      self.values.setdefault(key, []).insert(0, str(value).encode())
+
+  def lrange(self, key, start, end):
+    values = self.values.get(key, [])
+    return values[start:] if end == -1 else values[start:end + 1]
+
+  def lock(self, key, **kwargs):
+    return nullcontext()
+
+class SchedulerTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.sent = []
+    self.statuses = {}
+    self.scheduler = scheduler.FairShareScheduler(
+      FakeRedis(),
+      lambda job_id, user_id, file_id, traceparent: self.sent.append((job_id, file_id)),
+      lambda task_id, state, result: self.statuses.__setitem__(task_id, state),
+      max_inflight=4, reserved_slots=1, user_cap=2, small_job=2, weights={"admin": 2, "user": 1}
+    )
+
+  def test_step_1_round_robin_with_user_cap(self):
+    self.scheduler.submit(1, 10, "user", "big-1", list(range(100, 110)))
+    self.scheduler.submit(2, 20, "user", "big-2", list(range(200, 210)))
+    # One slot is reserved for small jobs, the user cap keeps job 1 from taking them all
+    self.assertEqual(self.sent, [(1, 100), (1, 101), (2, 200)])
+
+    self.scheduler.complete(1, 100)
+    self.assertEqual(self.sent[-1], (1, 102))
+
+  def test_step_2_small_jobs_use_reserved_slots(self):
+    self.scheduler.submit(1, 10, "user", "big-1", list(range(100, 110)))
+    self.scheduler.submit(2, 20, "user", "big-2", list(range(200, 210)))
+    self.scheduler.submit(3, 30, "user", "small", [300, 301])
+    self.assertEqual(self.sent[-1], (3, 300))
+
+    self.scheduler.complete(1, 100)
+    self.assertEqual(self.sent[-1], (3, 301))
+    self.scheduler.complete(3, 300)
+    self.scheduler.complete(3, 301)
+    self.assertEqual(self.statuses["small"], "SUCCESS")
+    self.assertEqual(self.statuses["big-1"], "PROGRESS")
+
+  def test_step_3_empty_job_succeeds(self):
+    self.scheduler.submit(1, 10, "user", "empty", [])
+    self.assertEqual(self.statuses["empty"], "SUCCESS")
+    self.assertEqual(self.sent, [])
+
+  def test_step_4_expired_lease_is_sent_again(self):
+    self.scheduler.lease = 60
+    self.scheduler.max_attempts = 2
+    self.scheduler.submit(3, 30, "user", "small", [300])
+    self.assertEqual(self.sent, [(3, 300)])
+
+    # The worker died, the periodic dispatch sends the CV again once its lease expires
+    self.scheduler.dispatch()
+    self.assertEqual(self.sent, [(3, 300)])
+    with patch("scheduler.time.time", return_value=time.time() + 120):
+      self.scheduler.dispatch()
+    self.assertEqual(self.sent, [(3, 300), (3, 300)])
+    self.assertNotIn("small", self.statuses)
+
+    # Given up after max_attempts dispatches
+    with patch("scheduler.time.time", return_value=time.time() + 240):
+      self.scheduler.dispatch()
+    self.assertEqual(len(self.sent), 2)
+    self.assertEqual(self.statuses["small"], "SUCCESS")
+
+  def test_step_5_resubmit_queues_new_cvs(self):
+    self.scheduler.submit(3, 30, "user", "first", [300])
+    self.scheduler.submit(3, 30, "user", "second", [300, 301])
+    self.assertEqual(self.sent, [(3, 300), (3, 301)])
+
+    self.scheduler.complete(3, 300)
+    self.assertEqual(self.statuses["first"], "PROGRESS")
+    self.scheduler.complete(3, 301)
+    self.assertEqual((self.statuses["first"], self.statuses["second"]), ("SUCCESS", "SUCCESS"))
+
+class MetricsTestCase(unittest.TestCase):
+
+  def sample(self, name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+  def test_step_1_query_and_extract_metrics(self):
+    queries = self.sample("db_query_seconds_count", query="get_all_records")
+    unsupported = self.sample("extract_seconds_count", extension=".txt", outcome="unsupported")
+    with Session(engine) as session:
+      get_all_records(session, Setting)
+    self.assertIsNone(extract_text("cv.txt"))
+    self.assertEqual(self.sample("db_query_seconds_count", query="get_all_records"), queries + 1)
+    self.assertEqual(self.sample("extract_seconds_count", extension=".txt", outcome="unsupported"), unsupported + 1)
+
+  def test_step_2_llm_metrics(self):
+    metrics.observe_llm_call("summarize_cv", "SUCCESS", {"model": "gpt-4o", "latency_seconds": 2.0, "prompt_tokens": 100, "completion_tokens": 20, "cost": 0.5})
+    self.assertGreaterEqual(self.sample("llm_tokens_total", kind="summarize_cv", model="gpt-4o", type="prompt"), 100)
+    self.assertGreaterEqual(self.sample("llm_cost_usd_total", kind="summarize_cv", model="gpt-4o"), 0.5)
+
+class TracingTestCase(unittest.TestCase):
+
+  def test_step_1_spans_share_the_trace(self):
+    with tempfile.TemporaryDirectory() as directory:
+      trace_file = os.path.join(directory, "spans.jsonl")
+      tracing.TRACE_FILE = trace_file
+      try:
+        with tracing.span("request", job_id=7) as request:
+          headers = {}
+          tracing.add_traceparent_header(headers=headers)
+          with tracing.span("child"):
+            pass
+        # A task continues the trace from the traceparent header of its message
+        task = tracing.start_span("task", headers["traceparent"])
+        task.finish()
+        # Spans are written by a background thread
+        tracing.flush()
+      finally:
+        tracing.TRACE_FILE = None
+      spans = {item["name"]: item for item in tracing.read_spans(trace_file, job_id=7)}
+    self.assertEqual(headers["traceparent"], request.traceparent)
+    self.assertEqual({item["trace_id"] for item in spans.values()}, {request.trace_id})
+    self.assertEqual(spans["child"]["parent_id"], request.span_id)
+    self.assertEqual(spans["task"]["parent_id"], request.span_id)
+    self.assertIsNone(tracing.current_traceparent())
+
+  def test_step_2_malformed_traceparent_starts_a_trace(self):
+    self.assertEqual(tracing.parse_traceparent("garbage"), (None, None))
+    self.assertIsNone(tracing.start_span("task", "garbage").parent_id)
+
+  def test_step_3_sampling_and_rotation(self):
+    with patch("tracing.TRACE_SAMPLE_RATE", 0.5):
+      self.assertTrue(tracing.is_sampled("00000000" + "0" * 24))
+      self.assertFalse(tracing.is_sampled("ffffffff" + "0" * 24))
+    with tempfile.TemporaryDirectory() as directory:
+      trace_file = os.path.join(directory, "spans.jsonl")
+      old = tracing.Span("old", start=0.5)
+      old.end = 1.0
+      with open(trace_file, "w") as file:
+        file.write(json.dumps(old.to_dict()) + "\n")
+      with patch("tracing.TRACE_FILE", trace_file), patch("tracing.TRACE_FILE_MAX_BYTES", 1):
+        with tracing.span("new"):
+          pass
+        tracing.flush()
+      self.assertTrue(os.path.exists(trace_file + ".1"))
+      self.assertEqual([item["name"] for item in tracing.read_spans(trace_file)], ["old", "new"])
+
+class StubOpenAITestCase(unittest.TestCase):
+
+  def test_step_1_chat_completion_against_stub(self):
+    stub = StubOpenAI(latency=0, token_rate=10 ** 6, malformed=1.0, completion_tokens=100)
+    os.environ["OPENAI_BASE_URL"] = stub.start()
+    try:
+      content, usage = create_chat_completion("sk-test", "gpt-4o-mini", [{"role": "user", "content": "x" * 400}])
+    finally:
+      del os.environ["OPENAI_BASE_URL"]
+      stub.stop()
+    self.assertIsNone(usage["error"])
+    self.assertEqual((usage["prompt_tokens"], usage["completion_tokens"]), (100, 100))
+    self.assertEqual(stub.malformed_answers, 1)
+    with self.assertRaises(ValueError):
+      json.loads(content)
+
+class PrerankTestCase(unittest.TestCase):
+
+  def test_step_1_rank_by_relevance(self):
+    query = "Senior Python developer, PostgreSQL and Celery required"
+    items = [
+      (1, "Pastry chef, ten years in French bakeries and restaurants."),
+      (2, None),
+      (3, "Python developer building Celery pipelines on PostgreSQL, senior engineer."),
+      (4, "Java developer, some Python scripting."),
+    ]
+    self.assertEqual(prerank.rank(query, items), [3, 4, 1, 2])
+    self.assertEqual(prerank.rank(query, items, top_n=2), [3, 4])
+
+  def test_step_2_equal_scores_keep_upload_order(self):
+    self.assertEqual(prerank.rank("", [(5, "a cv"), (6, "another cv"), (7, None)]), [5, 6, 7])
+    self.assertEqual(prerank.bm25_scores("python", []), [])
+
 class UserTestCase(unittest.TestCase):
 
   def test_step_1_register_user(self):
@@ -0,0 +1,353 @@
+# Importing necessary modules for request tracing
+from celery.signals import before_task_publish, task_prerun, task_postrun
+from contextlib import contextmanager
+from contextvars import ContextVar
+import os, sys, json, time, queue, atexit, secrets, threading, urllib.request
+
+"""
+
+    Tracing:
+
+    A trace follows one request from Flask through the Celery tasks it sends
+    down to the OpenAI calls and database writes. The context travels as a
+    W3C traceparent ("00-<trace id>-<span id>-01") in the task message
+    headers, so every task span is a child of the span that sent it.
+
+    Spans are exported when TRACE_FILE or OTEL_EXPORTER_OTLP_ENDPOINT is set,
+    otherwise only the context is propagated:
+
+    - TRACE_FILE: Append spans as JSON lines, e.g. files/traces/spans.jsonl
+      on the volume shared with the web service. The file is renamed to
+      <TRACE_FILE>.1 once it reaches TRACE_FILE_MAX_BYTES.
+    - OTEL_EXPORTER_OTLP_ENDPOINT: Send spans to an OpenTelemetry collector
+      over OTLP/HTTP JSON, e.g. http://otel-collector:4318
+
+    Finished spans are queued and exported by a background thread of each
+    process, in batches every TRACE_FLUSH_INTERVAL seconds, so requests and
+    tasks never wait on the file or the collector. Spans are dropped when
+    the queue is full. Only TRACE_SAMPLE_RATE of the traces are exported,
+    chosen from the trace ID so every service keeps the same traces.
+
+    Environment Variables:
+
+    - TRACE_SAMPLE_RATE: Share of the traces exported, 0 to 1 (default: 1)
+    - TRACE_FILE_MAX_BYTES: Size at which TRACE_FILE is rotated, 0 never rotates (default: 52428800)
+    - TRACE_FLUSH_INTERVAL: Seconds between two exports of the queued spans (default: 1)
+    - TRACE_QUEUE_SIZE: Spans queued per process before new ones are dropped (default: 4096)
+
+    Print the timeline of a trace, or of the traces that touched a job:
+
+        python tracing.py <trace id>
+        python tracing.py --job <job id>
+
+"""
+
+TRACE_FILE = os.environ.get("TRACE_FILE")
+OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "cv-scan-worker")
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 1))
+TRACE_FILE_MAX_BYTES = int(os.environ.get("TRACE_FILE_MAX_BYTES", 50 * 1024 * 1024))
+TRACE_FLUSH_INTERVAL = float(os.environ.get("TRACE_FLUSH_INTERVAL", 1))
+TRACE_QUEUE_SIZE = int(os.environ.get("TRACE_QUEUE_SIZE", 4096))
+
+# Largest number of spans written or sent at once
+EXPORT_BATCH_SIZE = 512
+
+_current_span = ContextVar("current_span", default=None)
+
+# Class describing a timed operation of a trace
+class Span:
+
+    def __init__(self, name, trace_id=None, parent_id=None, attributes=None, start=None):
+        self.name = name
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start = start or time.time()
+        self.end = None
+        self.error = None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, end=None):
+        self.end = end or time.time()
+        export(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "service": SERVICE_NAME,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": round((self.end - self.start) * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+# Function to parse a W3C traceparent header
+def parse_traceparent(traceparent):
+    """
+    Parse a W3C traceparent header.
+
+    Parameters:
+    - traceparent: The header value, e.g. 00-<32 hex trace id>-<16 hex span id>-01.
+
+    Returns:
+    - tuple: (trace_id, span_id), or (None, None) if the value is missing or malformed.
+    """
+    parts = (traceparent or "").split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        return parts[1], parts[2]
+    return None, None
+
+# Function to get the traceparent of the current span
+def current_traceparent():
+    span = _current_span.get()
+    return span.traceparent if span else None
+
+# Function to start a span, child of the current span or of a traceparent
+def start_span(name, traceparent=None, start=None, **attributes):
+    parent = _current_span.get()
+    if traceparent or parent is None:
+        trace_id, parent_id = parse_traceparent(traceparent)
+    else:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    return Span(name, trace_id, parent_id, attributes, start)
+
+# Context manager timing a block as a child span of the current span
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a block of code as a span, child of the current span.
+
+    Parameters:
+    - name: The span name, e.g. "openai.chat".
+    - **attributes: Attributes recorded with the span, more can be added with span.set().
+
+    Yields:
+    - Span: The span.
+    """
+    current = start_span(name, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as error:
+        current.error = f"{type(error).__name__}: {error}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish()
+
+# Function to decide whether a trace is exported, the same in every service
+def is_sampled(trace_id):
+    if TRACE_SAMPLE_RATE >= 1:
+        return True
+    return int(trace_id[:8], 16) < TRACE_SAMPLE_RATE * 0x100000000
+
+# Function to rotate the trace file once it reaches TRACE_FILE_MAX_BYTES
+def rotate_trace_file(filepath):
+    try:
+        if TRACE_FILE_MAX_BYTES and os.path.getsize(filepath) >= TRACE_FILE_MAX_BYTES:
+            os.replace(filepath, filepath + ".1")
+    except FileNotFoundError:
+        pass
+
+# Function to write and send a batch of finished spans
+def export_batch(spans):
+    try:
+        if TRACE_FILE:
+            rotate_trace_file(TRACE_FILE)
+            lines = "".join(json.dumps(item.to_dict(), default=str) + "\n" for item in spans)
+            os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+            # One append per batch keeps lines from several processes intact
+            with open(TRACE_FILE, "a", encoding="utf-8") as file:
+                file.write(lines)
+        if OTLP_ENDPOINT:
+            send_otlp(spans)
+    except Exception as error:
+        print(f"Failed to export {len(spans)} spans: {error}")
+
+# Class exporting finished spans in batches from a background thread
+class BatchExporter:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.queue = None
+        self.dropped = 0
+
+    def add(self, finished_span):
+        self._start()
+        try:
+            self.queue.put_nowait(finished_span)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Wait until every queued span of this process is exported."""
+        if self.pid == os.getpid():
+            self.queue.join()
+
+    def _start(self):
+        # Threads do not survive a fork, every worker process starts its own
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                self.queue = queue.Queue(TRACE_QUEUE_SIZE)
+                threading.Thread(target=self._run, name="trace-exporter", daemon=True).start()
+                self.pid = os.getpid()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + TRACE_FLUSH_INTERVAL
+            while len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.time())))
+                except queue.Empty:
+                    break
+            export_batch(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+_exporter = BatchExporter()
+
+# Function to queue a finished span for export
+def export(finished_span):
+    if (TRACE_FILE or OTLP_ENDPOINT) and is_sampled(finished_span.trace_id):
+        _exporter.add(finished_span)
+
+# Function to wait until the queued spans of this process are exported
+def flush():
+    _exporter.flush()
+
+# Function to convert an attribute value to an OTLP AnyValue
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+# Function to send spans to an OpenTelemetry collector over OTLP/HTTP JSON
+def send_otlp(spans):
+    payload = {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "cv-scan"}, "spans": [{
+            "traceId": item.trace_id,
+            "spanId": item.span_id,
+            "parentSpanId": item.parent_id or "",
+            "name": item.name,
+            "kind": 1,
+            "startTimeUnixNano": str(int(item.start * 1e9)),
+            "endTimeUnixNano": str(int(item.end * 1e9)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in item.attributes.items()],
+            "status": {"code": 2, "message": item.error} if item.error else {"code": 1}
+        } for item in spans]}]
+    }]}
+    request = urllib.request.Request(
+        OTLP_ENDPOINT.rstrip("/") + "/v1/traces",
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"}
+    )
+    urllib.request.urlopen(request, timeout=2).close()
+
+# Send the current trace context with every task message
+@before_task_publish.connect
+def add_traceparent_header(headers=None, **kwargs):
+    traceparent = current_traceparent()
+    if headers is not None and traceparent:
+        headers.setdefault("traceparent", traceparent)
+
+# Open a span for each task, child of the span that sent it
+@task_prerun.connect
+def start_task_span(task=None, **kwargs):
+    traceparent = getattr(task.request, "traceparent", None)
+    sent_at = getattr(task.request, "sent_at", None)
+    queue = (task.request.delivery_info or {}).get("routing_key")
+    if traceparent and sent_at:
+        # Time spent in the broker before a worker picked the task up
+        waiting = start_span("queue.wait", traceparent, start=float(sent_at), task=task.name, queue=queue)
+        waiting.finish()
+    task_span = start_span(f"task {task.name}", traceparent, task=task.name, task_id=task.request.id, queue=queue)
+    task.request._trace_token = _current_span.set(task_span)
+    task.request._trace_span = task_span
+
+@task_postrun.connect
+def finish_task_span(task=None, state=None, **kwargs):
+    task_span = getattr(task.request, "_trace_span", None)
+    if task_span is None:
+        return
+    task_span.set(state=state)
+    if state == "FAILURE":
+        task_span.error = str(kwargs.get("retval"))
+    _current_span.reset(task.request._trace_token)
+    task_span.finish()
+
+# Function to read the spans of a trace, or of every trace that touched a job
+def read_spans(filepath, trace_id=None, job_id=None):
+    """
+    Read spans from a TRACE_FILE and its rotated copy.
+
+    Parameters:
+    - filepath: The JSON lines file.
+    - trace_id: Only return the spans of this trace.
+    - job_id: Only return the spans of traces with a span carrying this job_id attribute.
+
+    Returns:
+    - list: Span dicts sorted by start time.
+    """
+    spans = []
+    # The rotated file holds the older spans
+    for path in (filepath + ".1", filepath):
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                spans += [json.loads(line) for line in file if line.strip()]
+    if job_id is not None:
+        trace_ids = {item["trace_id"] for item in spans if str(item["attributes"].get("job_id")) == str(job_id)}
+        spans = [item for item in spans if item["trace_id"] in trace_ids]
+    if trace_id is not None:
+        spans = [item for item in spans if item["trace_id"] == trace_id]
+    return sorted(spans, key=lambda item: item["start"])
+
+# Function to print spans as an indented timeline
+def print_timeline(spans):
+    children = {}
+    span_ids = {item["span_id"] for item in spans}
+    for item in spans:
+        parent = item["parent_id"] if item["parent_id"] in span_ids else None
+        children.setdefault(parent, []).append(item)
+
+    def show(item, depth, origin):
+        offset = (item["start"] - origin) * 1000
+        status = f"  ERROR {item['error']}" if item["error"] else ""
+        print(f"{offset:>10.1f} ms {item['duration_ms']:>10.1f} ms  {'  ' * depth}{item['name']} [{item['service']}]{status}")
+        for child in children.get(item["span_id"], []):
+            show(child, depth + 1, origin)
+
+    for root in children.get(None, []):
+        print(f"Trace {root['trace_id']}")
+        show(root, 0, root["start"])
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--job":
+        spans = read_spans(TRACE_FILE or "files/traces/spans.jsonl", job_id=sys.argv[2])
+    elif len(sys.argv) == 2:
+        spans = read_spans(TRACE_FILE or "files/traces/spans.jsonl", trace_id=sys.argv[1])
+    else:
+        print("Usage: python tracing.py <trace id> | --job <job id>")
+        sys.exit(1)
+    print_timeline(spans)
@@ -1,5 +1,8 @@
 # Importing necessary modules for file operations and password hashing
-import docx2txt, PyPDF2, bcrypt
+# docx2txt, PyPDF2 and bcrypt are imported lazily so each worker only loads what its queue needs
+import os, re
+from metrics import timed_extract
+from tracing import span
 
 # Function to hash a password using bcrypt
 def hash_password(password):
@@ -12,6 +15,7 @@ def hash_password(password):
     Returns:
         - bytes: The hashed password.
     """
+    import bcrypt
     # Generate a salt and hash the password
     salt = bcrypt.gensalt()
     hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
@@ -29,6 +33,7 @@ def verify_password(input_password, hashed_password):
     Returns:
         - bool: True if the passwords match, False otherwise.
     """
+    import bcrypt
     # Check if the input password matches the hashed password
     return bcrypt.checkpw(input_password.encode('utf-8'), hashed_password.encode('utf-8') if isinstance(hashed_password, str) else hashed_password)
 
@@ -43,6 +48,7 @@ def extract_text_from_pdf(pdf_file):
     Returns:
         - str or None: The extracted text if successful, or None if an error occurs.
     """
+    import PyPDF2
     try:
         with open(pdf_file, "rb") as pdf:
             # Create a PdfReader object
@@ -70,6 +76,7 @@ def extract_text_from_docx(docx_file):
     Returns:
         - str or None: The extracted text if successful, or None if an error occurs.
     """
+    import docx2txt
     try:
         # Use docx2txt to extract text from DOCX
         return docx2txt.process(docx_file)
@@ -77,3 +84,48 @@ def extract_text_from_docx(docx_file):
         # Print an error message if the DOCX extraction fails
         print(f"Failed to read DOCX: {e}")
     return None
+
+# Function to Extract Text from a PDF or DOCX file based on its extension
+def extract_text(filepath, extension=None):
+    """
+    Extract text content from a CV file.
+
+    Parameters:
+        - filepath (str): The path to the PDF or DOCX file.
+        - extension (str): The file type, e.g. ".pdf" (default: the extension of filepath).
+          Blobs are stored without extension, pass the one of the uploaded file name.
+
+    Returns:
+        - str or None: The extracted text, or None if the file type is unsupported or extraction fails.
+    """
+    extension = (extension or os.path.splitext(filepath)[1]).lower()
+    with span("extract", extension=extension) as extract, timed_extract(extension) as outcome:
+        if extension == ".pdf":
+            text = extract_text_from_pdf(filepath)
+        elif extension == ".docx":
+            text = extract_text_from_docx(filepath)
+        else:
+            outcome["value"] = "unsupported"
+            extract.set(outcome="unsupported")
+            return None
+        outcome["value"] = "success" if text is not None else "error"
+        extract.set(outcome=outcome["value"], chars=len(text or ""))
+        return text
+
+# Function to Compact Extracted Text for Prompts
+def compact_text(text):
+    """
+    Normalize extracted text so it is ready to be embedded in a prompt.
+
+    Trailing spaces, runs of spaces and tabs, and consecutive blank lines are
+    collapsed, which removes layout noise from PDF extraction and saves tokens.
+
+    Parameters:
+        - text (str): The extracted text.
+
+    Returns:
+        - str: The compacted text.
+    """
+    lines = [re.sub(r"[ \t\u00a0]+", " ", line).strip() for line in text.splitlines()]
+    text = "\n".join(lines)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
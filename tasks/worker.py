@@ -1,14 +1,29 @@
 # Importing necessary modules and components for the Flask app and background 
 from sqlalchemy.orm import Session
-from io import StringIO
+from tempfile import NamedTemporaryFile
+from itertools import chain
 from celery import Celery
-from database import engine
+from celery.exceptions import Ignore
+from celery.signals import worker_process_init
+from database import engine, pool_stats, prewarm_db
 from datetime import datetime, timedelta
 import os, json, csv
 from prompt import *
 from forgot_password import *
 from utils import *
 from crud import *
+from export import EXPORT_FORMATS
+from blobstore import commit_upload
+from routing import route_task, task_queue, queue_depths
+import metrics  # Registers the task runtime and queue wait signal handlers
+import tracing  # Registers the trace propagation signal handlers
+from results import configure_results, result_memory_usage
+from scheduler import get_scheduler, FAIRSHARE_SWEEP
+from prerank import rank, job_query
+from search import db_search, SEARCH_KINDS
+from ranking import rank_candidates
+from question_cache import cache_key, QUESTION_CACHE_TTL
+from metrics import QUESTION_CACHE
 
 # Defining the base directory for file operations
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -22,6 +37,30 @@ celery = Celery(
     broker=CELERY_BROKER_URL,
     backend=CELERY_RESULT_BACKEND
 )
+configure_results(celery)
+celery.conf.task_routes = (route_task,)
+
+# Periodic dispatch of the fair-share scheduler, run by celery beat
+celery.conf.beat_schedule = {
+    "fairshare-dispatch": {
+        "task": "tasks.dispatch_scheduler",
+        "schedule": FAIRSHARE_SWEEP,
+        "options": {"expires": FAIRSHARE_SWEEP}
+    }
+}
+
+# Function to get the worker process ready before its first task
+def prewarm():
+    """Open the database pool and load bcrypt before the first task."""
+    prewarm_db()
+    import bcrypt
+
+@worker_process_init.connect
+def prewarm_worker_process(**kwargs):
+    try:
+        prewarm()
+    except Exception as error:
+        print(f"Failed to prewarm worker: {error}")
 
 # Task for saving a job and associated questions to the database
 @celery.task(name="tasks.db_save_job")
@@ -49,27 +88,175 @@ def db_save_job(questions: list, **kwargs):
 
 # Task for saving a file associated with a job to the database
 @celery.task(name="tasks.db_save_file")
-def db_savefile(filename: str, job_id, user_id):
+def db_savefile(filename: str, job_id, user_id, sha256=None, size=None, upload_id=None):
     with Session(engine) as session: 
         existing_tempfile = get_record(session, TempFile, filename=filename, form_id=job_id)
-        if existing_tempfile: return existing_tempfile.id
-        return add_record(session, TempFile, filename=filename, form_id=job_id)
+        extracted = False
+        if existing_tempfile:
+            tempfile_id = existing_tempfile.id
+            unchanged = sha256 is None or (existing_tempfile.blob is not None and existing_tempfile.blob.sha256 == sha256)
+            extracted = unchanged and existing_tempfile.text is not None
+            if not unchanged:
+                # The same file name was uploaded again with a different content
+                release_tempfile(session, existing_tempfile)
+                existing_tempfile.blob = db_acquire_blob(session, sha256, size)
+                existing_tempfile.text = None
+                existing_tempfile.extracted_at = None
+                session.commit()
+        else:
+            blob_id = db_acquire_blob(session, sha256, size).id if sha256 else None
+            tempfile_id = add_record(session, TempFile, filename=filename, form_id=job_id, blob_id=blob_id)
+        # The blob is referenced now, move the staged upload in and hand it over to the configured blob backend
+        if sha256:
+            if upload_id:
+                commit_upload(sha256, upload_id)
+            get_backend().store(sha256)
+        if extracted: return tempfile_id
+        # Extract the text right away so it is ready when the job is summarized
+        if tempfile_id:
+            celery.send_task("tasks.extract_file", args=[tempfile_id], queue=task_queue("tasks.extract_file"))
+        return tempfile_id
 
 # Task for deleting a file associated with a job from the database and filesystem
 @celery.task(name="tasks.db_delete_file")
 def db_delete_file(filename: str, job_id, user_id):
     with Session(engine) as session:
         try:
-            filepath = os.path.join(BASE_DIR, "files", filename)
-            os.remove(filepath)
-            return delete_record(session, TempFile, filename=filename, form_id=job_id)
+            db_file = get_record(session, TempFile, filename=filename, form_id=job_id)
+            if db_file is None:
+                return False
+            return db_delete_tempfile(session, db_file)
         except Exception as error:
             print(error)
 
-# Task for retrieving all summaries associated with a job
+# Task for locating the stored CV of a summary
+@celery.task(name="tasks.get_summary_file")
+def get_summary_file(summary_id, user_id):
+    with Session(engine) as session:
+        db_file = (
+            session.query(TempFile)
+            .join(Summary, TempFile.summary_id == Summary.id)
+            .join(Form, Summary.form_id == Form.id)
+            .filter(and_(Summary.id == summary_id, Form.user_account_id == user_id))
+            .first()
+        )
+        if db_file is None:
+            return None
+        if db_file.blob is not None:
+            url = get_backend().download_url(db_file.blob.sha256, db_file.filename)
+            if url:
+                return {"filename": db_file.filename, "url": url}
+        return {
+            "filename": db_file.filename,
+            "path": os.path.relpath(tempfile_filepath(db_file), os.path.join(BASE_DIR, "files"))
+        }
+
+# Task for sending a summarization job to the AI workers together with the CV texts
+@celery.task(name="tasks.dispatch_summarization")
+def dispatch_summarization(job_id, user_id, task_id=None, top_n=None):
+    """
+    Load the extracted text of every CV of a job and send it inside the
+    summarization task payload, so AI workers need neither the files volume
+    nor the blob backend and can run on any node. With top_n, only the texts
+    of the N most relevant CVs are sent.
+    """
+    with Session(engine) as session:
+        texts = {}
+        for db_file in get_all_records(session, TempFile, form_id=job_id):
+            text = db_file.text if db_file.text is not None else db_extract_file(session, db_file)
+            if text is not None:
+                texts[str(db_file.id)] = text
+        if top_n:
+            form = get_record(session, Form, id=job_id)
+            texts = {key: texts[key] for key in rank(job_query(form), list(texts.items()), top_n)}
+    celery.send_task(
+        "tasks.summarize_cvs_using_chat_gpt",
+        args=[job_id, user_id],
+        kwargs={"texts": texts},
+        queue=task_queue("tasks.summarize_cvs_using_chat_gpt"),
+        task_id=task_id
+    )
+    return task_id
+
+# Task for queueing the CVs of a job in the fair-share summarization scheduler
+@celery.task(name="tasks.schedule_summarization")
+def schedule_summarization(job_id, user_id, task_id, top_n=None, ship_text=False):
+    """
+    Queue every CV of a job that is not summarized yet, most relevant first,
+    or only the top_n most relevant ones. The scheduler sends them one by one
+    to the AI workers and sets task_id to SUCCESS once the last one is done.
+    With ship_text, CVs not extracted yet are extracted here first, so the
+    AI workers read every text from the database and need neither the files
+    volume nor the blob backend.
+    """
+    with Session(engine) as session:
+        user = get_record(session, UserAccount, id=user_id)
+        form = get_record(session, Form, id=job_id)
+        db_files = get_all_records(session, TempFile, form_id=job_id)
+        if ship_text:
+            for db_file in db_files:
+                if db_file.text is None:
+                    db_extract_file(session, db_file)
+        file_ids = rank(job_query(form), [(db_file.id, db_file.text) for db_file in db_files], top_n) if form else []
+    get_scheduler(celery).submit(job_id, user_id, user.role if user else None, task_id, file_ids, tracing.current_traceparent())
+    return task_id
+
+# Task for sending expired CVs again and dispatching queued ones, run periodically by celery beat
+@celery.task(name="tasks.dispatch_scheduler")
+def dispatch_scheduler():
+    get_scheduler(celery).dispatch()
+
+# Task for queueing the summarized CVs of a job that miss answers in the fair-share scheduler
+@celery.task(name="tasks.schedule_resummarization")
+def schedule_resummarization(job_id, user_id, task_id):
+    """
+    Queue one CV of every summary of a job that does not answer all of the
+    job's questions, new or edited. The AI workers only ask a summary the
+    questions it misses and merge the answers, one summary per scheduled CV,
+    and the scheduler sets task_id to SUCCESS once the last one is done.
+    """
+    with Session(engine) as session:
+        user = get_record(session, UserAccount, id=user_id)
+        form = get_record(session, Form, id=job_id, user_account_id=user_id)
+        file_ids = []
+        if form:
+            questions = sorted(form.questions, key=lambda question: question.id)
+            for summary in get_all_records(session, Summary, form_id=job_id):
+                if summary.tempfiles and db_missing_questions(summary, questions):
+                    # Summaries reused by near-duplicate CVs are asked once, through their first CV
+                    file_ids.append(min(db_file.id for db_file in summary.tempfiles))
+    get_scheduler(celery).submit(job_id, user_id, user.role if user else None, task_id, file_ids, tracing.current_traceparent())
+    return task_id
+
+# Task for reporting the fair-share scheduler queues
+@celery.task(name="tasks.get_scheduler_stats")
+def get_scheduler_stats():
+    return get_scheduler(celery).stats()
+
+# Task for retrieving summaries associated with a job, optionally one page at a time
 @celery.task(name="tasks.get_summaries")
-def get_summaries(job_id, user_id):
-    with Session(engine) as session: return db_get_all_summaries(session, job_id, user_id)
+def get_summaries(job_id, user_id, limit=None, cursor=None, fields=None, score_question_id=None, min_score=None, max_score=None, order="desc"):
+    """
+    With score_question_id the summaries are sorted by their score for that
+    rating question and the cursor is the number of summaries already returned.
+    """
+    scores = {
+        "score_question_id": score_question_id,
+        "min_score": min_score,
+        "max_score": max_score,
+        "descending": order != "asc",
+    }
+    with Session(engine) as session:
+        if limit is None:
+            return db_get_all_summaries(session, job_id, user_id, fields=fields, **scores)
+        if score_question_id is not None:
+            offset = cursor or 0
+            summaries = db_get_all_summaries(session, job_id, user_id, limit=limit + 1, fields=fields, offset=offset, **scores)
+            page = db_paginate(summaries, limit, key="summary_id")
+            page["next_cursor"] = offset + limit if page["next_cursor"] is not None else None
+            return page
+        summaries = db_get_all_summaries(session, job_id, user_id, limit=limit + 1, after_id=cursor, fields=fields)
+        return db_paginate(summaries, limit, key="summary_id")
 
 # Task for retrieving a specific summary by its ID
 @celery.task(name="tasks.get_summary")
@@ -81,38 +268,100 @@ def get_summary(summary_id):
 def delete_summary(summary_id):
     with Session(engine) as session: return delete_record(session, Summary, id=summary_id)
 
-# Task for exporting all summaries associated with a job to a CSV file
+# Task for exporting all summaries associated with a job to a CSV, Parquet, Arrow or XLSX file
 @celery.task(name="tasks.export_summaries_csv")
-def export_summaries_csv(job_id, user_id):
+def export_summaries_csv(job_id, user_id, export_format="csv"):
+    """
+    Write the summaries of a job to a spool file in the shared files volume.
+
+    Rows are streamed from the database and written one at a time, so neither
+    the worker nor the result backend ever holds the whole export. Only the
+    relative path of the spool file is returned, the web service streams it
+    to the client and removes it afterwards.
+    """
+    if export_format not in EXPORT_FORMATS:
+        return []
+    writer, extension = EXPORT_FORMATS[export_format]
     with Session(engine) as session:
-        stringio = StringIO()
-        questions = [question.value for question in get_all_records(session, Question, form_id=job_id)]
-        summaries = [summary["summary_items"] for summary in db_get_all_summaries(session, job_id, user_id)]
-        rows = []
-        for summary in summaries:
-            row = {}
-            values = list(summary.values())
-            for index, value in enumerate(values):
-                row[questions[index]] = values[index]
-            rows.append(row)
-        if len(summaries) > 0:
-            dict_writer = csv.DictWriter(stringio, fieldnames=questions)
-            dict_writer.writeheader()
-            dict_writer.writerows(rows)
-            return stringio.getvalue()
-    return []
-
-# Task for retrieving all jobs associated with a user account
+        db_questions = session.query(Question).filter(Question.form_id == job_id).order_by(Question.id).all()
+        questions = [question.value for question in db_questions]
+        rows = iter_summary_rows(session, job_id, user_id, db_questions)
+        first_row = next(rows, None)
+        if first_row is None:
+            return []
+        os.makedirs(os.path.join(BASE_DIR, "files", "exports"), exist_ok=True)
+        with NamedTemporaryFile(suffix=extension, dir=os.path.join(BASE_DIR, "files", "exports"), delete=False) as spool:
+            pass
+        try:
+            writer(spool.name, questions, chain([first_row], rows))
+        except Exception:
+            os.remove(spool.name)
+            raise
+        return os.path.join("exports", os.path.basename(spool.name))
+
+# Task for retrieving jobs associated with a user account, optionally one page at a time
 @celery.task(name="tasks.get_jobs")
-def get_jobs(user_id):
+def get_jobs(user_id, limit=None, cursor=None, fields=None):
     with Session(engine) as session:
-        return db_get_jobs(session, user_id)
+        if limit is None:
+            return db_get_jobs(session, user_id, fields=fields)
+        jobs = db_get_jobs(session, user_id, limit=limit + 1, after_id=cursor, fields=fields)
+        return db_paginate(jobs, limit)
+
+# Task for looking up the questions generated earlier for an identical job description
+@celery.task(name="tasks.cached_questions", bind=True)
+def cached_questions(self, user_id, job_title, company_background, job_duties, job_requirements, manualquestions):
+    """
+    Return the cached result of formulate_questions for these inputs, in the
+    same (questions, status) shape. A miss is sent to formulate_questions
+    under this task ID, so the web service polls one ID without waiting on
+    the lookup.
+    """
+    questions = None
+    if QUESTION_CACHE_TTL > 0:
+        with Session(engine) as session:
+            user = get_record(session, UserAccount, id=user_id)
+            if user is not None:
+                gpt_api_key, gpt_model, formulate_questions_prompt = db_get_formulate_settings(session, user)
+                key = cache_key(gpt_model, formulate_questions_prompt, job_title, company_background, job_duties, job_requirements, manualquestions)
+                questions = db_get_cached_questions(session, key, QUESTION_CACHE_TTL)
+                QUESTION_CACHE.labels("hit" if questions is not None else "miss").inc()
+    if questions is not None:
+        return questions, 'SUCCESS'
+    celery.send_task("tasks.formulate_questions", kwargs={
+        "user_id": user_id,
+        "job_title": job_title,
+        "company_background": company_background,
+        "job_duties": job_duties,
+        "job_requirements": job_requirements,
+        "manualquestions": manualquestions
+    }, queue=task_queue("tasks.formulate_questions"), task_id=self.request.id)
+    # The result of this task ID is written by formulate_questions
+    raise Ignore()
+
+# Task for replacing the questions of a job, see schedule_resummarization for the summaries
+@celery.task(name="tasks.update_questions")
+def update_questions(job_id, user_id, questions):
+    with Session(engine) as session:
+        return db_set_questions(session, job_id, user_id, questions)
+
+# Task for ranking the candidates of a job by their weighted ratings
+@celery.task(name="tasks.rank_candidates")
+def rank_job_candidates(job_id, user_id, weights=None, top_k=None):
+    with Session(engine) as session:
+        return rank_candidates(session, job_id, user_id, weights=weights, top_k=top_k)
+
+# Task for searching the summaries and CV texts of a user's jobs
+@celery.task(name="tasks.search")
+def search_summaries(user_id, query, job_id=None, kinds=SEARCH_KINDS, limit=20):
+    with Session(engine) as session:
+        return db_search(session, user_id, query, job_id=job_id, kinds=kinds, limit=limit)
 
 # Task for deleting a job by its ID
 @celery.task(name="tasks.delete_job")
 def delete_job(job_id):
     with Session(engine) as session:
-        return delete_record(session, Form, id=job_id)
+        return db_delete_job(session, job_id)
 
 # --------------------------------------------------------------------
 # Additional tasks related to user management and settings
@@ -303,15 +552,19 @@ def get_users(user_id):
     with Session(engine) as session:
         users = get_all_records(session, UserAccount)
         if users:
+            llm_usage = {row["user_id"]: row for row in db_get_llm_usage(session)}
             result = []
             for user in users:
                 if int(user_id) != user.id:
+                    usage = llm_usage.get(user.id, {})
                     result.append({
                         "id": user.id,
                         "username": user.username,
                         "email": user.email,
                         "role": user.role,
-                        "gpt_api_key_permission": user.gpt_api_key_permission
+                        "gpt_api_key_permission": user.gpt_api_key_permission,
+                        "llm_tokens": usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0),
+                        "llm_cost": usage.get("cost", 0)
                     })
             return result
 
@@ -353,7 +606,7 @@ def add_user(**kwargs):
 @celery.task(name="tasks.delete_user")
 def delete_user(user_id):
     with Session(engine) as session:
-        return delete_record(session, UserAccount, id=user_id)
+        return db_delete_user(session, user_id)
 
 # Task for updating user information
 @celery.task(name="tasks.update_user")
@@ -370,4 +623,25 @@ def get_contacts():
             for setting in settings:
                 if setting.name.startswith("contacts_"): 
                     result[setting.name] = setting.value
-            return result
\ No newline at end of file
+            return result
+
+# Task for reporting the database connection pool state of the worker process that runs it
+@celery.task(name="tasks.get_db_pool_stats")
+def get_db_pool_stats():
+    return pool_stats()
+
+# Task for reporting the number of messages waiting in each lane
+@celery.task(name="tasks.get_lane_stats")
+def get_lane_stats():
+    return queue_depths(celery)
+
+# Task for reporting the result backend memory used per task name
+@celery.task(name="tasks.get_result_memory_usage")
+def get_result_memory_usage():
+    return result_memory_usage(celery)
+
+# Task for reporting LLM usage totals per user, per job or overall
+@celery.task(name="tasks.get_llm_usage")
+def get_llm_usage(user_id=None, job_id=None, group_by="user"):
+    with Session(engine) as session:
+        return db_get_llm_usage(session, user_id=user_id, job_id=job_id, group_by=group_by)